@@ -0,0 +1,197 @@
+import os
+import re
+import sys
+import time
+import hashlib
+import numpy as np
+
+DEFAULT_ANNOTATION_DIR = os.path.join(os.path.expanduser("~"), ".cache", "dental3d", "annotations")
+# 'mark' is a 2D click on a slice in pixel coordinates; 'marker3d' is a 3D marker in world coordinates
+ANNOTATION_KINDS = ('mark', 'marker3d')
+FORMAT_VERSION = 1
+COLUMNS = (('ids', np.int64, ()), ('kinds', np.uint8, ()), ('slices', np.int32, ()), ('positions', np.float32, (3,)))
+UID_PATTERN = re.compile(r'[0-9][0-9.]{0,63}')
+
+
+def annotation_path(series_uid, file_paths=()):
+    # Named by SeriesInstanceUID. A UID that is not safe as a file name is hashed, and a series without one
+    # is named by a hash of its file paths so unrelated series never share ".npz".
+    series_uid = str(series_uid or '')
+    if UID_PATTERN.fullmatch(series_uid):
+        name = series_uid
+    elif series_uid:
+        name = 'uid-' + hashlib.sha1(series_uid.encode('utf-8', 'surrogateescape')).hexdigest()
+    else:
+        paths = '\n'.join(sorted(os.path.abspath(p) for p in file_paths))
+        name = 'files-' + hashlib.sha1(paths.encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(os.environ.get('DENTAL_ANNOTATIONS', DEFAULT_ANNOTATION_DIR), f"{name}.npz")
+
+
+class AnnotationStore:
+    # Annotations of one series as columns of NumPy arrays, with a per-slice index of rows so a redraw reads
+    # only the current slice. Ids stay valid across removals; rows are compacted by moving the last one in.
+    def __init__(self):
+        self.count = 0
+        self.next_id = 0
+        self.rows = {}
+        self.slice_rows = {}
+        self._slice_cache = {}
+        for name, dtype, shape in COLUMNS:
+            setattr(self, '_' + name, np.empty((0,) + shape, dtype=dtype))
+
+    def __len__(self):
+        return self.count
+
+    def column(self, name):
+        return getattr(self, '_' + name)[:self.count]
+
+    def _reserve(self, count):
+        if count <= len(self._ids):
+            return
+        capacity = max(count, 2 * len(self._ids), 256)
+        for name, _, _ in COLUMNS:
+            old = getattr(self, '_' + name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, '_' + name, new)
+
+    def _index(self, row):
+        slice_index = int(self._slices[row])
+        self.slice_rows.setdefault(slice_index, []).append(row)
+        self._slice_cache.pop(slice_index, None)
+
+    def add_many(self, kind, slice_indices, positions):
+        # positions are (x, y) pixels or (x, y, z) world coordinates; returns the new ids
+        positions = np.asarray(positions, dtype=np.float32)
+        positions = positions.reshape(-1, positions.shape[-1] if positions.ndim else 3)
+        start, stop = self.count, self.count + len(positions)
+        self._reserve(stop)
+        self._kinds[start:stop] = ANNOTATION_KINDS.index(kind)
+        self._slices[start:stop] = slice_indices
+        self._positions[start:stop] = 0
+        self._positions[start:stop, :positions.shape[1]] = positions
+        ids = np.arange(self.next_id, self.next_id + len(positions), dtype=np.int64)
+        self._ids[start:stop] = ids
+        self.next_id += len(positions)
+        self.count = stop
+        for row in range(start, stop):
+            self.rows[int(self._ids[row])] = row
+            self._index(row)
+        return ids
+
+    def add(self, kind, slice_index, x, y, z=0.0):
+        return int(self.add_many(kind, [slice_index], [(x, y, z)])[0])
+
+    def remove(self, annotation_id):
+        row = self.rows.pop(annotation_id)
+        last = self.count - 1
+        slice_index = int(self._slices[row])
+        self.slice_rows[slice_index].remove(row)
+        self._slice_cache.pop(slice_index, None)
+        if row != last:
+            moved_slice = int(self._slices[last])
+            moved_rows = self.slice_rows[moved_slice]
+            moved_rows[moved_rows.index(last)] = row
+            self._slice_cache.pop(moved_slice, None)
+            for name, _, _ in COLUMNS:
+                buffer = getattr(self, '_' + name)
+                buffer[row] = buffer[last]
+            self.rows[int(self._ids[row])] = row
+        self.count = last
+
+    def clear(self, kind=None):
+        if kind is None:
+            self.__init__()
+            return
+        for annotation_id in self.column('ids')[self.column('kinds') == ANNOTATION_KINDS.index(kind)].tolist():
+            self.remove(annotation_id)
+
+    def on_slice(self, slice_index):
+        # Rows on one slice; the array is cached until that slice changes
+        rows = self._slice_cache.get(slice_index)
+        if rows is None:
+            rows = np.array(self.slice_rows.get(slice_index, ()), dtype=np.int64)
+            self._slice_cache[slice_index] = rows
+        return rows
+
+    def points(self, slice_index, kind='mark'):
+        # (n, 3) positions of one kind on one slice
+        rows = self.on_slice(slice_index)
+        rows = rows[self._kinds[rows] == ANNOTATION_KINDS.index(kind)]
+        return self._positions[rows]
+
+    def positions(self, kind):
+        return self.column('positions')[self.column('kinds') == ANNOTATION_KINDS.index(kind)]
+
+    def save(self, file_path):
+        # Uncompressed columnar .npz, written under a temporary name and renamed once complete
+        start_time = time.perf_counter()
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        with open(file_path + '.part', 'wb') as f:
+            np.savez(f, version=FORMAT_VERSION, next_id=self.next_id,
+                     **{name: self.column(name) for name, _, _ in COLUMNS})
+        os.replace(file_path + '.part', file_path)
+        print(f"Saved {self.count} annotations to {file_path} ({os.path.getsize(file_path) / 1024:.0f} KB) "
+              f"in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+    @classmethod
+    def load(cls, file_path):
+        # An empty store when the file does not exist yet
+        store = cls()
+        if not os.path.exists(file_path):
+            return store
+        start_time = time.perf_counter()
+        with np.load(file_path) as data:
+            if int(data['version']) != FORMAT_VERSION:
+                raise ValueError(f"Unsupported annotation file version {int(data['version'])} in {file_path}")
+            store._reserve(len(data['ids']))
+            store.count = len(data['ids'])
+            for name, _, _ in COLUMNS:
+                getattr(store, '_' + name)[:store.count] = data[name]
+            store.next_id = int(data['next_id'])
+        # Rebuild the indexes in bulk: rows grouped by slice in one sort
+        store.rows = dict(zip(store.column('ids').tolist(), range(store.count)))
+        slices = store.column('slices')
+        order = np.argsort(slices, kind='stable')
+        boundaries = np.flatnonzero(np.diff(slices[order])) + 1
+        for rows in np.split(order, boundaries) if store.count else ():
+            store.slice_rows[int(slices[rows[0]])] = rows.tolist()
+        print(f"Loaded {store.count} annotations from {file_path} in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+        return store
+
+
+def main():
+    # python annotation_store.py [annotations] [slices]: per-slice fetch against scanning a list, save and load
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    slices = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    rng = np.random.default_rng(0)
+    slice_indices = rng.integers(0, slices, total)
+    pixels = rng.uniform(0, 512, (total, 2))
+
+    store = AnnotationStore()
+    start_time = time.perf_counter()
+    store.add_many('mark', slice_indices, pixels)
+    add_time = time.perf_counter() - start_time
+    as_list = [(int(s), float(x), float(y)) for s, (x, y) in zip(slice_indices, pixels)]
+
+    start_time = time.perf_counter()
+    for slice_index in range(slices):
+        store.points(slice_index)
+    fetch_time = (time.perf_counter() - start_time) / slices
+    start_time = time.perf_counter()
+    for slice_index in range(slices):
+        [(x, y) for s, x, y in as_list if s == slice_index]
+    scan_time = (time.perf_counter() - start_time) / slices
+
+    file_path = os.path.join(os.environ.get('TMPDIR', '/tmp'), 'annotation_store_bench.npz')
+    store.save(file_path)
+    loaded = AnnotationStore.load(file_path)
+    same = all(np.array_equal(np.sort(loaded.points(s), axis=0), np.sort(store.points(s), axis=0))
+               for s in range(slices))
+    os.remove(file_path)
+    print(f"{total} annotations on {slices} slices: added in {add_time * 1000:.1f} ms, slice fetch "
+          f"{fetch_time * 1e6:.0f} us (list scan {scan_time * 1e6:.0f} us), round trip identical: {same}")
+
+
+if __name__ == "__main__":
+    main()
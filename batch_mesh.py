@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from series_loader import load_series
+from volume_cache import series_key
+from vtk_bridge import volume_to_vtk_image
+from surface_extraction import extract_surface, SURFACE_ENGINES, DEFAULT_ENGINE
+from mesh_export import export_mesh
+
+SURFACE_FILENAME = "surface.stl"
+SIDECAR_FILENAME = "surface.json"
+REPORT_FILENAME = "report.jsonl"
+
+
+def looks_like_dicom(file_path):
+    if file_path.lower().endswith('.dcm'):
+        return True
+    try:
+        with open(file_path, 'rb') as f:
+            f.seek(128)
+            return f.read(4) == b'DICM'
+    except OSError:
+        return False
+
+
+def find_series_directories(root_path):
+    # A series directory is any folder that directly holds DICOM files
+    series_directories = []
+    for directory_path, directory_names, filenames in os.walk(root_path):
+        directory_names.sort()
+        for filename in sorted(filenames):
+            if not filename.startswith('.') and looks_like_dicom(os.path.join(directory_path, filename)):
+                series_directories.append(directory_path)
+                break
+    return series_directories
+
+
+def output_directory(root_path, output_path, directory_path):
+    return os.path.join(output_path, os.path.relpath(directory_path, root_path))
+
+
+def is_up_to_date(directory_path, series_output, threshold):
+    # Outputs are current when the sidecar matches the series fingerprint and the threshold used
+    sidecar_path = os.path.join(series_output, SIDECAR_FILENAME)
+    if not (os.path.exists(sidecar_path) and os.path.exists(os.path.join(series_output, SURFACE_FILENAME))):
+        return False
+    with open(sidecar_path) as f:
+        sidecar = json.load(f)
+    return sidecar.get('series_key') == series_key(directory_path, None) and sidecar.get('threshold') == threshold
+
+
+def process_series(directory_path, series_output, threshold, engine=None):
+    timings = {}
+    start_time = time.perf_counter()
+    fingerprint = series_key(directory_path, None)
+
+    # One decode and extraction thread per series: the pool already keeps every core busy
+    volume_data, series_index = load_series(directory_path, workers=1, use_cache=False)
+    timings['load'] = time.perf_counter() - start_time
+
+    stage_time = time.perf_counter()
+    surface = extract_surface(volume_to_vtk_image(volume_data, series_index), threshold, engine=engine, threads=1)
+    timings['extract'] = time.perf_counter() - stage_time
+
+    # Written in chunks under a temporary name, so an interrupted run never leaves a mesh that looks complete
+    stage_time = time.perf_counter()
+    os.makedirs(series_output, exist_ok=True)
+    surface_path = os.path.join(series_output, SURFACE_FILENAME)
+    export_mesh(surface, surface_path, verbose=False)
+    timings['write'] = time.perf_counter() - stage_time
+    timings['total'] = time.perf_counter() - start_time
+
+    result = {
+        'series': directory_path,
+        'series_instance_uid': series_index.series_instance_uid,
+        'series_key': fingerprint,
+        'threshold': threshold,
+        'engine': engine or DEFAULT_ENGINE,
+        'slices': len(series_index),
+        'shape': list(series_index.shape),
+        'points': surface.GetNumberOfPoints(),
+        'triangles': surface.GetNumberOfCells(),
+        'mesh_bytes': os.path.getsize(surface_path),
+        'seconds': timings,
+    }
+    with open(os.path.join(series_output, SIDECAR_FILENAME), 'w') as f:
+        json.dump(result, f, indent=2)
+    return result
+
+
+def run_batch(root_path, output_path, threshold=1500, jobs=None, force=False, engine=None):
+    series_directories = find_series_directories(root_path)
+    os.makedirs(output_path, exist_ok=True)
+
+    pending = []
+    for directory_path in series_directories:
+        series_output = output_directory(root_path, output_path, directory_path)
+        if not force and is_up_to_date(directory_path, series_output, threshold):
+            print(f"Up to date: {directory_path}")
+            continue
+        pending.append((directory_path, series_output))
+    print(f"Found {len(series_directories)} series, {len(pending)} to process")
+
+    # The report is appended as each series finishes, so an interrupted run keeps what it completed
+    report_path = os.path.join(output_path, REPORT_FILENAME)
+    with ProcessPoolExecutor(max_workers=jobs) as executor, open(report_path, 'a') as report:
+        futures = {executor.submit(process_series, directory_path, series_output, threshold, engine): directory_path
+                   for directory_path, series_output in pending}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'series': futures[future], 'error': str(e)}
+                print(f"Failed: {futures[future]}: {e}")
+            else:
+                print(f"Done: {result['series']} ({result['triangles']} triangles, "
+                      f"{result['mesh_bytes'] / (1024 * 1024):.1f} MB, {result['seconds']['total']:.1f}s)")
+            report.write(json.dumps(result) + '\n')
+            report.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract dental surface meshes from every DICOM series under a folder")
+    parser.add_argument('root', help="study tree to scan for DICOM series")
+    parser.add_argument('output', help="folder for meshes and the report; mirrors the study tree")
+    parser.add_argument('--threshold', type=float, default=1500, help="isosurface value (default: 1500)")
+    parser.add_argument('--jobs', type=int, default=None, help="series processed in parallel (default: CPU count)")
+    parser.add_argument('--engine', choices=SURFACE_ENGINES, default=None,
+                        help=f"surface extraction engine (default: {DEFAULT_ENGINE})")
+    parser.add_argument('--force', action='store_true', help="reprocess series whose outputs are up to date")
+    args = parser.parse_args()
+
+    run_batch(args.root, args.output, threshold=args.threshold, jobs=args.jobs, force=args.force, engine=args.engine)
+
+
+if __name__ == "__main__":
+    main()
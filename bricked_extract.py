@@ -0,0 +1,159 @@
+import os
+import sys
+import mmap
+import time
+import itertools
+import multiprocessing
+import vtk
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from vtk.util import numpy_support
+from vtk_bridge import volume_to_vtk_image
+from surface_extraction import extract_surface, phantom
+from volume_store import memory_stage
+
+# Edge length in voxels of a brick; a 128^3 int16 brick is 4 MB
+DEFAULT_BRICK_SIZE = 128
+
+
+def brick_bounds(shape, brick_size):
+    # (z0, z1, y0, y1, x0, x1) per brick. Neighbouring bricks share their boundary voxel plane,
+    # so both sides compute identical vertices along the seam.
+    ranges = []
+    for length in shape:
+        starts = list(range(0, max(length - 1, 1), brick_size))
+        ranges.append([(start, min(start + brick_size, length - 1) + 1) for start in starts])
+    return [z + y + x for z, y, x in itertools.product(*ranges)]
+
+
+def memmap_source(volume_data):
+    # Workers can map the file themselves when the volume is a whole, named, on-disk memmap
+    if (isinstance(volume_data, np.memmap) and isinstance(volume_data.base, mmap.mmap) and
+            volume_data.filename and os.path.exists(volume_data.filename) and volume_data.flags.c_contiguous):
+        return volume_data.filename, volume_data.offset, volume_data.dtype.str, volume_data.shape
+    return None
+
+
+def _extract_brick(source, bounds, spacing, origin, surface_value, engine):
+    # source is either a memmap description or the brick itself. Returns float32 points and
+    # int64 triangle indices in world coordinates.
+    z0, z1, y0, y1, x0, x1 = bounds
+    if isinstance(source, tuple):
+        filename, offset, dtype, shape = source
+        volume_data = np.memmap(filename, mode='r', dtype=dtype, shape=shape, offset=offset)
+        brick = np.ascontiguousarray(volume_data[z0:z1, y0:y1, x0:x1])
+        del volume_data
+    else:
+        brick = source
+
+    brick_origin = (origin[0] + x0 * spacing[0], origin[1] + y0 * spacing[1], origin[2] + z0 * spacing[2])
+    surface = extract_surface(volume_to_vtk_image(brick, spacing=spacing, origin=brick_origin), surface_value,
+                              engine=engine, threads=1, verbose=False)
+    if surface.GetNumberOfCells() == 0:
+        return np.empty((0, 3), dtype=np.float32), np.empty((0, 3), dtype=np.int64)
+
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).astype(np.float32)
+    connectivity = numpy_support.vtk_to_numpy(surface.GetPolys().GetConnectivityArray())
+    return points, connectivity.astype(np.int64).reshape(-1, 3)
+
+
+def merge_pieces(pieces):
+    # Concatenate the brick meshes and weld vertices with identical coordinates, which closes the seams
+    offsets = np.cumsum([0] + [len(points) for points, _ in pieces])
+    points = np.concatenate([points for points, _ in pieces])
+    triangles = np.concatenate([triangles + offset for (_, triangles), offset in zip(pieces, offsets)])
+
+    keys = np.ascontiguousarray(points).view(np.dtype((np.void, points.dtype.itemsize * 3))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return points[first], inverse.reshape(-1)[triangles]
+
+
+def to_polydata(points, triangles, compute_normals=True):
+    surface = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(points, deep=True))
+    surface.SetPoints(vtk_points)
+
+    cells = vtk.vtkCellArray()
+    offsets = np.arange(0, 3 * len(triangles) + 1, 3, dtype=np.int64)
+    cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets, deep=True),
+                  numpy_support.numpy_to_vtkIdTypeArray(triangles.astype(np.int64).reshape(-1), deep=True))
+    surface.SetPolys(cells)
+
+    if not compute_normals:
+        return surface
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputData(surface)
+    normals.SplittingOff()
+    normals.ConsistencyOff()
+    normals.Update()
+    return normals.GetOutput()
+
+
+def extract_bricked(volume_data, surface_value, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0),
+                    brick_size=DEFAULT_BRICK_SIZE, workers=None, engine=None, compute_normals=True):
+    # Isosurface of a volume of any size: bricks are extracted in a process pool and welded into one mesh.
+    # Memory in the workers is bounded by the brick size. Bricks of an in-memory or unnamed volume are
+    # sliced here, with at most two per worker in flight.
+    start_time = time.perf_counter()
+    bricks = brick_bounds(volume_data.shape, brick_size)
+    source = memmap_source(volume_data)
+    workers = workers or os.cpu_count() or 1
+
+    pieces = [None] * len(bricks)
+    # Spawned rather than forked: a fork taken while VTK's or Qt's threads hold locks can deadlock the workers
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        in_flight = {}
+        for i, bounds in enumerate(bricks):
+            if len(in_flight) >= 2 * workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pieces[in_flight.pop(future)] = future.result()
+            z0, z1, y0, y1, x0, x1 = bounds
+            brick_source = source or np.ascontiguousarray(volume_data[z0:z1, y0:y1, x0:x1])
+            in_flight[executor.submit(_extract_brick, brick_source, bounds, spacing, origin, surface_value,
+                                      engine)] = i
+        for future in list(in_flight):
+            pieces[in_flight.pop(future)] = future.result()
+    extract_time = time.perf_counter() - start_time
+
+    points, triangles = merge_pieces(pieces)
+    surface = to_polydata(points, triangles, compute_normals)
+    print(f"[bricked] {len(bricks)} bricks of {brick_size}^3 with {workers} processes "
+          f"({'memmap' if source else 'streamed'}): {surface.GetNumberOfCells()} triangles, "
+          f"{surface.GetNumberOfPoints()} points, extract {extract_time:.2f}s, "
+          f"total {time.perf_counter() - start_time:.2f}s")
+    return surface
+
+
+def boundary_edges(surface):
+    feature_edges = vtk.vtkFeatureEdges()
+    feature_edges.SetInputData(surface)
+    feature_edges.BoundaryEdgesOn()
+    feature_edges.FeatureEdgesOff()
+    feature_edges.NonManifoldEdgesOff()
+    feature_edges.ManifoldEdgesOff()
+    feature_edges.Update()
+    return feature_edges.GetOutput().GetNumberOfCells()
+
+
+def main():
+    # python bricked_extract.py [volume.npy | phantom size] [brick size] [workers]
+    source = sys.argv[1] if len(sys.argv) > 1 else '256'
+    brick_size = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BRICK_SIZE
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    if source.endswith('.npy'):
+        volume_data = np.load(source, mmap_mode='r')
+    else:
+        volume_data = phantom(int(source))
+
+    with memory_stage('bricked extraction'):
+        bricked = extract_bricked(volume_data, 1500, brick_size=brick_size, workers=workers)
+    with memory_stage('whole-volume extraction'):
+        whole = extract_surface(volume_to_vtk_image(np.asarray(volume_data)), 1500)
+    print(f"Open boundary edges: bricked {boundary_edges(bricked)}, whole volume {boundary_edges(whole)}")
+
+
+if __name__ == "__main__":
+    main()
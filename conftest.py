@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import pytest
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+# At the repository root so pytest puts the flat modules on sys.path for the tests
+
+
+def write_series(directory_path, volume_data, spacing=(0.3, 0.3, 0.5), origin=(-10.0, 20.0, 0.0)):
+    # One uncompressed CT slice per file, named so that filename order differs from slice order
+    os.makedirs(directory_path, exist_ok=True)
+    series_uid = generate_uid()
+    for i, pixel_array in enumerate(volume_data):
+        ds = Dataset()
+        ds.file_meta = FileMetaDataset()
+        ds.file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.2'
+        ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds.SOPClassUID = ds.file_meta.MediaStorageSOPClassUID
+        ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+        ds.StudyInstanceUID = '1.2.3'
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = 'CT'
+        ds.InstanceNumber = i + 1
+        ds.ImagePositionPatient = [origin[0], origin[1], origin[2] + i * spacing[2]]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [spacing[1], spacing[0]]
+        ds.SliceThickness = spacing[2]
+        ds.Rows, ds.Columns = pixel_array.shape
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.BitsAllocated = ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1 if pixel_array.dtype == np.int16 else 0
+        ds.PixelData = np.ascontiguousarray(pixel_array).tobytes()
+        ds.save_as(os.path.join(directory_path, f"img_{(i * 7919) % 1000:04d}.dcm"), enforce_file_format=True)
+    return series_uid
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path, monkeypatch):
+    # Volume cache and annotations never touch the user's ~/.cache
+    monkeypatch.setenv('DENTAL_VOLUME_CACHE', str(tmp_path / 'volumes'))
+    monkeypatch.setenv('DENTAL_ANNOTATIONS', str(tmp_path / 'annotations'))
+
+
+@pytest.fixture
+def dicom_series(tmp_path):
+    # (folder, expected volume) for a small uint16 series
+    volume_data = (np.random.default_rng(0).integers(0, 3000, (12, 24, 20))
+                   + np.arange(12)[:, None, None]).astype(np.uint16)
+    directory_path = str(tmp_path / 'series')
+    write_series(directory_path, volume_data)
+    return directory_path, volume_data
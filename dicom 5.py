@@ -1,35 +1,17 @@
-import os
-import pydicom
 import vtk
-import numpy as np
+from series_loader import load_series
+from vtk_bridge import volume_to_vtk_image
+from surface_extraction import surface_filter
 
 def load_dicom_series(folder_path):
-    dicom_files = [f for f in os.listdir(folder_path) if f.endswith(".dcm")]
-    dicom_files.sort()
+    volume_data, series_index = load_series(folder_path)
 
-    first_dcm_file = pydicom.read_file(os.path.join(folder_path, dicom_files[0]))
-    rows, cols = first_dcm_file.Rows, first_dcm_file.Columns
-
-    volume_data = np.zeros((len(dicom_files), rows, cols), dtype=np.int16)
-
-    for i, filename in enumerate(dicom_files):
-        file_path = os.path.join(folder_path, filename)
-        dcm_file = pydicom.read_file(file_path)
-        volume_data[i, :, :] = dcm_file.pixel_array
-
-    vtk_volume = vtk.vtkImageData()
-    vtk_volume.SetDimensions(cols, rows, len(dicom_files))
-    vtk_volume.AllocateScalars(vtk.VTK_SHORT, 1)
-
-    vtk_np_array_flat = volume_data.ravel()
-    vtk_data_array = vtk.vtkShortArray()
-    vtk_data_array.SetArray(vtk_np_array_flat, len(vtk_np_array_flat), 1)
-    vtk_volume.GetPointData().SetScalars(vtk_data_array)
+    vtk_volume = volume_to_vtk_image(volume_data, series_index)
 
     return vtk_volume
 
 def create_marching_cubes(vtk_volume, threshold_value):
-    marching_cubes = vtk.vtkMarchingCubes()
+    marching_cubes = surface_filter()
     marching_cubes.SetInputData(vtk_volume)
     marching_cubes.SetValue(0, threshold_value)
     return marching_cubes
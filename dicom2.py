@@ -1,70 +1,55 @@
-import os
-import pydicom
 import vtk
-import numpy as np
+from series_loader import load_series
+from vtk_bridge import volume_to_vtk_image
+from jaw_roi import detect_jaw_roi, crop_volume, roi_origin
 
-directory_path = "/Users/shikarichacha/Downloads/3d segmentation"
 
-# Collect all DICOM files in the directory
-dicom_files = [f for f in os.listdir(directory_path) if f.endswith(".dcm")]
+def main():
+    directory_path = "/Users/shikarichacha/Downloads/3d segmentation"
 
-# Sort the files based on their numerical order (assuming filenames contain numbers)
-dicom_files.sort(key=lambda x: int(x.split('Slice')[1].split('.dcm')[0]))
+    # Index the series from headers, then decode all DICOM files in parallel into a 3D array
+    volume_data, series_index = load_series(directory_path)
 
-# Read the first DICOM file to get the dimensions
-first_dcm_file = pydicom.read_file(os.path.join(directory_path, dicom_files[0]))
-rows, cols = first_dcm_file.Rows, first_dcm_file.Columns
+    # Render only the jaws: air, spine and skull outside the detected box are never sent to the GPU
+    jaw_roi = detect_jaw_roi(volume_data, series_index.spacing)
 
-# Create a 3D array to store the pixel data from all DICOM files
-volume_data = np.zeros((len(dicom_files), rows, cols), dtype=np.uint16)
+    # Wrap the cropped volume for VTK, with spacing from the headers and the origin moved to the box corner
+    vtk_volume = volume_to_vtk_image(crop_volume(volume_data, jaw_roi), spacing=series_index.spacing,
+                                     origin=roi_origin(series_index.origin, series_index.spacing, jaw_roi))
 
-# Iterate over all DICOM files
-for i, filename in enumerate(dicom_files):
-    file_path = os.path.join(directory_path, filename)
+    # Create a vtkVolumeRayCastMapper
+    volume_mapper = vtk.vtkGPUVolumeRayCastMapper()
+    volume_mapper.SetInputData(vtk_volume)
 
-    # Read DICOM file
-    dcm_file = pydicom.read_file(file_path)
-    volume_data[i, :, :] = dcm_file.pixel_array
+    # Create a vtkVolume
+    volume_actor = vtk.vtkVolume()
+    volume_actor.SetMapper(volume_mapper)
 
-# Create a VTK volume
-vtk_volume = vtk.vtkImageData()
-vtk_volume.SetDimensions(cols, rows, len(dicom_files))
-vtk_volume.AllocateScalars(vtk.VTK_UNSIGNED_SHORT, 1)
+    # Create a vtkRenderer
+    renderer = vtk.vtkRenderer()
+    renderer.SetBackground(1, 1, 1)  # Set background color to white
 
-# Flatten and copy the pixel data to VTK volume
-vtk_np_array_flat = volume_data.ravel()
-vtk_data_array = vtk.vtkUnsignedShortArray()
-vtk_data_array.SetArray(vtk_np_array_flat, len(vtk_np_array_flat), 1)
-vtk_volume.GetPointData().SetScalars(vtk_data_array)
+    # Create a vtkRenderWindow
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetWindowName("Tooth 3D Rendering")
+    render_window.SetSize(800, 800)
+    render_window.AddRenderer(renderer)
 
-# Create a vtkVolumeRayCastMapper
-volume_mapper = vtk.vtkGPUVolumeRayCastMapper()
-volume_mapper.SetInputData(vtk_volume)
+    # Create a vtkRenderWindowInteractor
+    render_window_interactor = vtk.vtkRenderWindowInteractor()
+    render_window_interactor.SetRenderWindow(render_window)
 
-# Create a vtkVolume
-volume_actor = vtk.vtkVolume()
-volume_actor.SetMapper(volume_mapper)
+    # Add the volume actor to the renderer
+    renderer.AddActor(volume_actor)
 
-# Create a vtkRenderer
-renderer = vtk.vtkRenderer()
-renderer.SetBackground(1, 1, 1)  # Set background color to white
+    # Set up a camera to view the entire volume
+    renderer.ResetCamera()
 
-# Create a vtkRenderWindow
-render_window = vtk.vtkRenderWindow()
-render_window.SetWindowName("Tooth 3D Rendering")
-render_window.SetSize(800, 800)
-render_window.AddRenderer(renderer)
+    # Start the rendering loop
+    render_window.Render()
+    render_window_interactor.Start()
 
-# Create a vtkRenderWindowInteractor
-render_window_interactor = vtk.vtkRenderWindowInteractor()
-render_window_interactor.SetRenderWindow(render_window)
 
-# Add the volume actor to the renderer
-renderer.AddActor(volume_actor)
-
-# Set up a camera to view the entire volume
-renderer.ResetCamera()
-
-# Start the rendering loop
-render_window.Render()
-render_window_interactor.Start()
+# Guarded so worker processes that import this script do not load and render the series again
+if __name__ == "__main__":
+    main()
@@ -1,106 +1,65 @@
-import os
-import pydicom
 import vtk
-import numpy as np
+from series_loader import load_series
+from jaw_roi import detect_jaw_roi, crop_volume, roi_origin
+from label_surfaces import LABELS, classify_labels, extract_label_surfaces, label_actors
 
-directory_path = "/Users/shikarichacha/Downloads/3d segmentation"
 
-# Collect all DICOM files in the directory
-dicom_files = [f for f in os.listdir(directory_path) if f.endswith(".dcm")]
+def main():
+    directory_path = "/Users/shikarichacha/Downloads/3d segmentation"
 
-# Sort the files based on their numerical order (assuming filenames contain numbers)
-dicom_files.sort(key=lambda x: int(x.split('Slice')[1].split('.dcm')[0]))
+    # Index the series from headers, then decode all DICOM files in parallel into a 3D array
+    volume_data, series_index = load_series(directory_path)
 
-# Read the first DICOM file to get the dimensions
-first_dcm_file = pydicom.read_file(os.path.join(directory_path, dicom_files[0]))
-rows, cols = first_dcm_file.Rows, first_dcm_file.Columns
+    # Classify only the jaws: air, spine and skull outside the detected box are never labelled
+    jaw_roi = detect_jaw_roi(volume_data, series_index.spacing)
 
-# Create a 3D array to store the pixel data from all DICOM files
-volume_data = np.zeros((len(dicom_files), rows, cols), dtype=np.uint16)
+    # Classify every voxel once into bone, tooth, canal and suspected defect (adjust the values to your DICOM data)
+    label_volume = classify_labels(crop_volume(volume_data, jaw_roi), series_index.spacing, bone_value=1500,
+                                   tooth_value=2200)
 
-# Iterate over all DICOM files
-for i, filename in enumerate(dicom_files):
-    file_path = os.path.join(directory_path, filename)
+    # Extract all label surfaces in a single discrete flying-edges pass, one actor per label
+    surfaces = extract_label_surfaces(label_volume, series_index.spacing,
+                                      roi_origin(series_index.origin, series_index.spacing, jaw_roi))
+    actors = label_actors(surfaces)
 
-    # Read DICOM file
-    dcm_file = pydicom.read_file(file_path)
-    volume_data[i, :, :] = dcm_file.pixel_array
+    # Create a vtkRenderer
+    renderer = vtk.vtkRenderer()
+    renderer.SetBackground(1, 1, 1)  # Set background color to white
+    for actor in actors.values():
+        renderer.AddActor(actor)
 
-# Create a VTK volume
-vtk_volume = vtk.vtkImageData()
-vtk_volume.SetDimensions(cols, rows, len(dicom_files))
-vtk_volume.AllocateScalars(vtk.VTK_UNSIGNED_SHORT, 1)
+    # Create a vtkRenderWindow
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetWindowName("Dental 3D Rendering")
+    render_window.SetSize(800, 800)
+    render_window.AddRenderer(renderer)
 
-# Flatten and copy the pixel data to VTK volume
-vtk_np_array_flat = volume_data.ravel()
-vtk_data_array = vtk.vtkUnsignedShortArray()
-vtk_data_array.SetArray(vtk_np_array_flat, len(vtk_np_array_flat), 1)
-vtk_volume.GetPointData().SetScalars(vtk_data_array)
+    # Create a vtkRenderWindowInteractor
+    render_window_interactor = vtk.vtkRenderWindowInteractor()
+    render_window_interactor.SetRenderWindow(render_window)
 
-# Create a vtkMarchingCubes to extract tooth structures
-marching_cubes = vtk.vtkMarchingCubes()
-marching_cubes.SetInputData(vtk_volume)
-marching_cubes.SetValue(0, 1500)  # Adjust this threshold value based on your DICOM data
+    # Keys 1-4 show or hide a label; the surfaces are already extracted, so toggling only re-renders
+    label_keys = {str(i + 1): name for i, name in enumerate(LABELS)}
 
-# Create a vtkPolyDataMapper
-mapper = vtk.vtkPolyDataMapper()
-mapper.SetInputConnection(marching_cubes.GetOutputPort())
+    def toggle_label(caller, event):
+        name = label_keys.get(caller.GetKeySym())
+        if name is None:
+            return
+        actors[name].SetVisibility(not actors[name].GetVisibility())
+        print(f"{name}: {'shown' if actors[name].GetVisibility() else 'hidden'}")
+        render_window.Render()
 
-# Create a vtkActor
-actor = vtk.vtkActor()
-actor.SetMapper(mapper)
+    render_window_interactor.AddObserver('KeyPressEvent', toggle_label)
+    print("Toggle labels with " + ", ".join(f"{key} = {name}" for key, name in label_keys.items()))
 
-# Create a vtkRenderer
-renderer = vtk.vtkRenderer()
-renderer.SetBackground(1, 1, 1)  # Set background color to white
+    # Set up a camera to view the entire volume
+    renderer.ResetCamera()
 
-# Create a vtkRenderWindow
-render_window = vtk.vtkRenderWindow()
-render_window.SetWindowName("Dental 3D Rendering")
-render_window.SetSize(800, 800)
-render_window.AddRenderer(renderer)
+    # Start the rendering loop
+    render_window.Render()
+    render_window_interactor.Start()
 
-# Create a vtkImageThreshold to identify potential fractures or missing teeth
-threshold_filter = vtk.vtkImageThreshold()
-threshold_filter.SetInputData(vtk_volume)
-threshold_filter.ThresholdByLower(1500)  # Adjust this threshold value based on your DICOM data
-threshold_filter.ReplaceInOn()
-threshold_filter.SetInValue(0)
-threshold_filter.ReplaceOutOn()
-threshold_filter.SetOutValue(1)
-threshold_filter.Update()
 
-# Create a vtkMarchingCubes to extract the defective structures
-defective_marching_cubes = vtk.vtkMarchingCubes()
-defective_marching_cubes.SetInputConnection(threshold_filter.GetOutputPort())
-defective_marching_cubes.SetValue(0, 1)
-
-# Create a vtkPolyDataMapper for the defective structures
-defective_mapper = vtk.vtkPolyDataMapper()
-defective_mapper.SetInputConnection(defective_marching_cubes.GetOutputPort())
-
-# Create a vtkActor for the defective structures and set its color to red
-defective_actor = vtk.vtkActor()
-defective_actor.SetMapper(defective_mapper)
-defective_actor.GetProperty().SetColor(1, 0, 0)  # RGB color for red
-
-# Add the defective actor to the renderer
-renderer.AddActor(defective_actor)
-
-# The rest of your VTK pipeline goes here...
-
-
-
-# Create a vtkRenderWindowInteractor
-render_window_interactor = vtk.vtkRenderWindowInteractor()
-render_window_interactor.SetRenderWindow(render_window)
-
-# Add the actor to the renderer
-renderer.AddActor(actor)
-
-# Set up a camera to view the entire volume
-renderer.ResetCamera()
-
-# Start the rendering loop
-render_window.Render()
-render_window_interactor.Start()
+# Guarded so worker processes that import this script do not load and render the series again
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,473 @@
+import os
+import re
+import json
+import hashlib
+import time
+import queue
+import shutil
+import tempfile
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pydicom
+from pydicom.errors import InvalidDicomError
+from PyQt5.QtCore import QThread, pyqtSignal
+from series_index import list_series_files
+from series_watcher import GrowingSeries
+
+DEFAULT_RETRIEVE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "dental3d", "retrieved")
+INSTANCE_TAGS = ['StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID', 'SOPClassUID', 'PatientID',
+                 'PatientName', 'StudyDate', 'Modality', 'SeriesDescription', 'InstanceNumber']
+UID_PATTERN = re.compile(r'[0-9][0-9.]{0,63}')
+
+
+def uid_file_name(uid):
+    # UIDs come from the server. Anything that is not a well-formed UID is hashed so it cannot name a path
+    # outside the destination folder.
+    uid = str(uid)
+    if UID_PATTERN.fullmatch(uid):
+        return uid
+    return 'x' + hashlib.sha1(uid.encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+def retrieve_directory(series_uid):
+    return os.path.join(os.environ.get('DENTAL_RETRIEVE_DIR', DEFAULT_RETRIEVE_DIR), uid_file_name(series_uid))
+
+
+def write_instance(file_path, data):
+    # Written under a hidden name and renamed, so folder watchers never see a partial file
+    temp_path = os.path.join(os.path.dirname(file_path), '.' + os.path.basename(file_path) + '.part')
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, file_path)
+
+
+def multipart_parts(content_type, body):
+    # Split a multipart/related WADO-RS response into its parts
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not match:
+        return [body]
+    parts = []
+    for chunk in body.split(b'--' + match.group(1).encode())[1:]:
+        if chunk.startswith(b'--'):
+            break
+        _, _, content = chunk.partition(b'\r\n\r\n')
+        parts.append(content[:-2] if content.endswith(b'\r\n') else content)
+    return parts
+
+
+def json_value(item, keyword):
+    return item.get(f"{pydicom.datadict.tag_for_keyword(keyword):08X}", {}).get('Value', [''])[0]
+
+
+def bounded_map(fetch, items, workers):
+    # Runs fetch over items with at most `workers` in flight, yielding results as they complete
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(fetch, item) for item in items]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class DicomWebClient:
+    # QIDO-RS search and WADO-RS retrieval over one keep-alive HTTP connection per worker thread
+    def __init__(self, base_url, workers=4, timeout=60):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.workers = workers
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            connection = connection_class(self.netloc, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _get(self, path, accept):
+        # A keep-alive connection the server has closed is reopened once before giving up
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request('GET', self.prefix + path, headers={'Accept': accept})
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+                continue
+            if response.status != 200:
+                raise IOError(f"GET {path} returned {response.status} {response.reason}")
+            return response.getheader('Content-Type', ''), body
+
+    def search_series(self, **filters):
+        query = f"?{urlencode(filters)}" if filters else ""
+        _, body = self._get(f"/series{query}", 'application/dicom+json')
+        return [{keyword: json_value(item, keyword) for keyword in
+                 ('StudyInstanceUID', 'SeriesInstanceUID', 'PatientID', 'Modality', 'SeriesDescription')}
+                for item in json.loads(body or b'[]')]
+
+    def search_instances(self, study_uid, series_uid):
+        _, body = self._get(f"/studies/{study_uid}/series/{series_uid}/instances", 'application/dicom+json')
+        return [json_value(item, 'SOPInstanceUID') for item in json.loads(body or b'[]')]
+
+    def retrieve_instance(self, study_uid, series_uid, sop_uid):
+        content_type, body = self._get(f"/studies/{study_uid}/series/{series_uid}/instances/{sop_uid}",
+                                       'multipart/related; type="application/dicom"')
+        return multipart_parts(content_type, body)[0]
+
+    def retrieve_series(self, study_uid, series_uid, destination=None):
+        # Yields each instance's file path as soon as it is on disk
+        destination = destination or retrieve_directory(series_uid)
+        os.makedirs(destination, exist_ok=True)
+        sop_uids = self.search_instances(study_uid, series_uid)
+
+        def fetch(sop_uid):
+            file_path = os.path.join(destination, uid_file_name(sop_uid) + '.dcm')
+            if not os.path.exists(file_path):
+                write_instance(file_path, self.retrieve_instance(study_uid, series_uid, sop_uid))
+            return file_path
+
+        yield from bounded_map(fetch, sop_uids, self.workers)
+
+
+class DimseClient:
+    # C-FIND to list a series' instances, then C-MOVE spread over a bounded number of associations.
+    # Instances come back over C-STORE to a storage SCP this client runs on store_port.
+    def __init__(self, host, port, called_ae='ANY-SCP', calling_ae='DENTAL3D', store_port=11113, workers=4,
+                 timeout=60):
+        self.host = host
+        self.port = port
+        self.called_ae = called_ae
+        self.calling_ae = calling_ae
+        self.store_port = store_port
+        self.workers = workers
+        self.timeout = timeout
+
+    def _application_entity(self):
+        from pynetdicom import AE
+        from pynetdicom.sop_class import StudyRootQueryRetrieveInformationModelFind, \
+            StudyRootQueryRetrieveInformationModelMove
+        ae = AE(ae_title=self.calling_ae)
+        ae.acse_timeout = ae.dimse_timeout = ae.network_timeout = self.timeout
+        ae.add_requested_context(StudyRootQueryRetrieveInformationModelFind)
+        ae.add_requested_context(StudyRootQueryRetrieveInformationModelMove)
+        return ae
+
+    def _associate(self, ae):
+        association = ae.associate(self.host, self.port, ae_title=self.called_ae)
+        if not association.is_established:
+            raise ConnectionError(f"Association with {self.called_ae}@{self.host}:{self.port} was rejected")
+        return association
+
+    def search_instances(self, study_uid, series_uid):
+        from pynetdicom.sop_class import StudyRootQueryRetrieveInformationModelFind
+        identifier = pydicom.Dataset()
+        identifier.QueryRetrieveLevel = 'IMAGE'
+        identifier.StudyInstanceUID = study_uid
+        identifier.SeriesInstanceUID = series_uid
+        identifier.SOPInstanceUID = ''
+
+        association = self._associate(self._application_entity())
+        sop_uids = []
+        try:
+            for status, dataset in association.send_c_find(identifier, StudyRootQueryRetrieveInformationModelFind):
+                if status and status.Status in (0xFF00, 0xFF01) and dataset is not None:
+                    sop_uids.append(str(dataset.SOPInstanceUID))
+        finally:
+            association.release()
+        return sop_uids
+
+    def retrieve_series(self, study_uid, series_uid, destination=None):
+        from pynetdicom import AE, evt, AllStoragePresentationContexts, ALL_TRANSFER_SYNTAXES
+        from pynetdicom.sop_class import StudyRootQueryRetrieveInformationModelMove
+        destination = destination or retrieve_directory(series_uid)
+        os.makedirs(destination, exist_ok=True)
+        sop_uids = self.search_instances(study_uid, series_uid)
+        arrived = queue.Queue()
+
+        def handle_store(event):
+            file_path = os.path.join(destination, uid_file_name(event.request.AffectedSOPInstanceUID) + '.dcm')
+            write_instance(file_path, event.encoded_dataset())
+            arrived.put(file_path)
+            return 0x0000
+
+        # Accept every storage class in whatever transfer syntax the archive holds, so nothing is transcoded
+        store_ae = AE(ae_title=self.calling_ae)
+        for context in AllStoragePresentationContexts:
+            store_ae.add_supported_context(context.abstract_syntax, ALL_TRANSFER_SYNTAXES)
+        server = store_ae.start_server(('', self.store_port), block=False,
+                                       evt_handlers=[(evt.EVT_C_STORE, handle_store)])
+
+        def move(batch):
+            identifier = pydicom.Dataset()
+            identifier.QueryRetrieveLevel = 'IMAGE'
+            identifier.StudyInstanceUID = study_uid
+            identifier.SeriesInstanceUID = series_uid
+            identifier.SOPInstanceUID = batch
+            association = self._associate(self._application_entity())
+            try:
+                for status, _ in association.send_c_move(identifier, self.calling_ae,
+                                                         StudyRootQueryRetrieveInformationModelMove):
+                    if status and status.Status not in (0x0000, 0xFF00):
+                        print(f"C-MOVE returned status 0x{status.Status:04X}")
+            finally:
+                association.release()
+
+        batches = [sop_uids[i::self.workers] for i in range(self.workers) if sop_uids[i::self.workers]]
+        executor = ThreadPoolExecutor(max_workers=max(len(batches), 1))
+        moves = [executor.submit(move, batch) for batch in batches]
+        try:
+            received = 0
+            while received < len(sop_uids):
+                try:
+                    yield arrived.get(timeout=0.5)
+                    received += 1
+                except queue.Empty:
+                    if all(m.done() for m in moves) and arrived.empty():
+                        for m in moves:
+                            m.result()
+                        print(f"C-MOVE finished with {len(sop_uids) - received} instance(s) not received")
+                        break
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            server.shutdown()
+
+
+def client_for(source, workers=4, **options):
+    # http(s)://host/path is a DICOMweb root; dimse://AETITLE@host:port is a DIMSE archive
+    parts = urlsplit(source)
+    if parts.scheme == 'dimse':
+        return DimseClient(parts.hostname, parts.port or 104, called_ae=parts.username or 'ANY-SCP',
+                           workers=workers, **options)
+    return DicomWebClient(source, workers=workers, **options)
+
+
+def retrieve_into_series(client, study_uid, series_uid, destination=None):
+    # Decode each instance on this thread while the pool keeps downloading the next ones
+    destination = destination or retrieve_directory(series_uid)
+    series = GrowingSeries(destination)
+    start_time = time.perf_counter()
+    received_bytes = 0
+    for file_path in client.retrieve_series(study_uid, series_uid, destination):
+        received_bytes += os.path.getsize(file_path)
+        series.add(file_path)
+    elapsed = time.perf_counter() - start_time
+    print(f"Retrieved {len(series)} instances with {client.workers} connections in {elapsed:.2f}s "
+          f"({len(series) / elapsed:.1f} instances/s, {received_bytes / (1024 * 1024) / elapsed:.1f} MB/s)")
+    return series
+
+
+class RetrievalThread(QThread):
+    # Retrieves a series into a folder off the GUI thread, e.g. while a SeriesWatcher ingests the folder
+    instanceRetrieved = pyqtSignal(str)
+    retrievalFinished = pyqtSignal(int)
+    retrievalFailed = pyqtSignal(str)
+
+    def __init__(self, client, study_uid, series_uid, destination, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self.study_uid = study_uid
+        self.series_uid = series_uid
+        self.destination = destination
+
+    def run(self):
+        count = 0
+        try:
+            retrieval = self.client.retrieve_series(self.study_uid, self.series_uid, self.destination)
+            for file_path in retrieval:
+                if self.isInterruptionRequested():
+                    retrieval.close()
+                    break
+                count += 1
+                self.instanceRetrieved.emit(file_path)
+        except Exception as e:
+            self.retrievalFailed.emit(f"Error retrieving series {self.series_uid}: {e}")
+            return
+        self.retrievalFinished.emit(count)
+
+
+def index_instances(directory_path):
+    instances = {}
+    for file_path in list_series_files(directory_path):
+        try:
+            header = pydicom.dcmread(file_path, stop_before_pixels=True, specific_tags=INSTANCE_TAGS)
+        except (InvalidDicomError, OSError):
+            continue
+        if 'SOPInstanceUID' in header:
+            instances[str(header.SOPInstanceUID)] = (file_path, header)
+    return instances
+
+
+def dicom_json(header, keywords):
+    return {f"{pydicom.datadict.tag_for_keyword(k):08X}": {'vr': pydicom.datadict.dictionary_VR(k),
+                                                             'Value': [str(header.get(k, ''))]}
+            for k in keywords}
+
+
+def serve_dicomweb(directory_path, port=8042, latency=0.0):
+    # Minimal QIDO-RS/WADO-RS stand-in serving one folder, for testing and benchmarks.
+    # latency adds a per-request delay to mimic the round trip to a remote archive.
+    instances = index_instances(directory_path)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, content_type, body):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            time.sleep(latency)
+            path = urlsplit(self.path).path.rstrip('/').split('/')
+            if path[-1] == 'series':
+                series = {str(h.SeriesInstanceUID): h for _, h in instances.values()}
+                body = [dicom_json(h, ['StudyInstanceUID', 'SeriesInstanceUID', 'PatientID', 'Modality',
+                                       'SeriesDescription']) for h in series.values()]
+                self._send('application/dicom+json', json.dumps(body).encode())
+            elif path[-1] == 'instances':
+                body = [dicom_json(h, ['SOPInstanceUID', 'InstanceNumber']) for _, h in instances.values()
+                        if str(h.SeriesInstanceUID) == path[-2]]
+                self._send('application/dicom+json', json.dumps(body).encode())
+            elif len(path) > 1 and path[-2] == 'instances' and path[-1] in instances:
+                with open(instances[path[-1]][0], 'rb') as f:
+                    data = f.read()
+                boundary = 'DENTAL3DBOUNDARY'
+                body = (f'--{boundary}\r\nContent-Type: application/dicom\r\n\r\n'.encode() + data +
+                        f'\r\n--{boundary}--\r\n'.encode())
+                self._send(f'multipart/related; type="application/dicom"; boundary={boundary}', body)
+            else:
+                self.send_error(404)
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_dimse(directory_path, port=11112, ae_title='ANY-SCP', destinations=None, latency=0.0):
+    # Minimal C-FIND/C-MOVE stand-in serving one folder; destinations maps move AE titles to (host, port)
+    from pynetdicom import AE, evt, build_context
+    from pynetdicom.sop_class import StudyRootQueryRetrieveInformationModelFind, \
+        StudyRootQueryRetrieveInformationModelMove
+    instances = index_instances(directory_path)
+    destinations = destinations or {'DENTAL3D': ('127.0.0.1', 11113)}
+
+    def matches(identifier, header):
+        return all(str(identifier.get(k, '')) in ('', str(header.get(k, '')))
+                   for k in ('StudyInstanceUID', 'SeriesInstanceUID'))
+
+    def handle_find(event):
+        for file_path, header in instances.values():
+            if matches(event.identifier, header):
+                response = pydicom.Dataset()
+                response.QueryRetrieveLevel = 'IMAGE'
+                response.StudyInstanceUID = header.StudyInstanceUID
+                response.SeriesInstanceUID = header.SeriesInstanceUID
+                response.SOPInstanceUID = header.SOPInstanceUID
+                yield 0xFF00, response
+
+    def handle_move(event):
+        if event.move_destination.strip() not in destinations:
+            yield None, None
+            return
+        yield destinations[event.move_destination.strip()]
+        requested = event.identifier.get('SOPInstanceUID', '')
+        requested = set(requested if isinstance(requested, pydicom.multival.MultiValue) else [requested]) - {''}
+        selected = [path for sop_uid, (path, header) in instances.items()
+                    if matches(event.identifier, header) and (not requested or sop_uid in requested)]
+        yield len(selected)
+        for file_path in selected:
+            time.sleep(latency)
+            yield 0xFF00, pydicom.dcmread(file_path)
+
+    ae = AE(ae_title=ae_title)
+    ae.add_supported_context(StudyRootQueryRetrieveInformationModelFind)
+    ae.add_supported_context(StudyRootQueryRetrieveInformationModelMove)
+    # Offer the storage classes and transfer syntaxes the folder actually holds when moving instances out
+    contexts = set()
+    for file_path, header in instances.values():
+        contexts.add((str(header.SOPClassUID), str(header.file_meta.TransferSyntaxUID)))
+    ae.requested_contexts = [build_context(sop_class, transfer_syntax) for sop_class, transfer_syntax in contexts]
+    return ae.start_server(('127.0.0.1', port), block=False,
+                           evt_handlers=[(evt.EVT_C_FIND, handle_find), (evt.EVT_C_MOVE, handle_move)])
+
+
+def benchmark(source, study_uid, series_uid, worker_counts):
+    # Instances/s at each concurrency level, decoding into a growing volume as instances arrive
+    for workers in worker_counts:
+        destination = tempfile.mkdtemp(prefix='dental3d-retrieve-')
+        try:
+            retrieve_into_series(client_for(source, workers=workers), study_uid, series_uid, destination)
+        finally:
+            shutil.rmtree(destination, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieve DICOM series over DICOMweb or DIMSE")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    retrieve_parser = subparsers.add_parser('retrieve', help="retrieve one series into a local folder")
+    retrieve_parser.add_argument('source', help="http(s)://host/dicom-web or dimse://AETITLE@host:port")
+    retrieve_parser.add_argument('study_uid')
+    retrieve_parser.add_argument('series_uid')
+    retrieve_parser.add_argument('--output', default=None, help=f"folder (default: under {DEFAULT_RETRIEVE_DIR})")
+    retrieve_parser.add_argument('--workers', type=int, default=4, help="concurrent connections (default: 4)")
+
+    serve_parser = subparsers.add_parser('serve', help="serve a folder as a stand-in archive")
+    serve_parser.add_argument('directory')
+    serve_parser.add_argument('--dimse', action='store_true', help="serve C-FIND/C-MOVE instead of DICOMweb")
+    serve_parser.add_argument('--port', type=int, default=None)
+    serve_parser.add_argument('--latency', type=float, default=0.0, help="seconds added per request")
+
+    bench_parser = subparsers.add_parser('bench', help="instances/s at several concurrency levels")
+    bench_parser.add_argument('directory', help="folder holding one series, served by a local stand-in")
+    bench_parser.add_argument('--dimse', action='store_true')
+    bench_parser.add_argument('--latency', type=float, default=0.02, help="seconds added per request")
+    bench_parser.add_argument('--workers', default='1,2,4,8', help="comma-separated concurrency levels")
+    args = parser.parse_args()
+
+    if args.command == 'retrieve':
+        retrieve_into_series(client_for(args.source, workers=args.workers), args.study_uid, args.series_uid,
+                             args.output)
+    elif args.command == 'serve':
+        if args.dimse:
+            serve_dimse(args.directory, port=args.port or 11112, latency=args.latency)
+            print(f"Serving {args.directory} as ANY-SCP on port {args.port or 11112}")
+        else:
+            serve_dicomweb(args.directory, port=args.port or 8042, latency=args.latency)
+            print(f"Serving {args.directory} at http://127.0.0.1:{args.port or 8042}/dicom-web")
+        threading.Event().wait()
+    else:
+        _, header = next(iter(index_instances(args.directory).values()))
+        if args.dimse:
+            server = serve_dimse(args.directory, latency=args.latency)
+            source = 'dimse://ANY-SCP@127.0.0.1:11112'
+        else:
+            server = serve_dicomweb(args.directory, latency=args.latency)
+            source = 'http://127.0.0.1:8042/dicom-web'
+        benchmark(source, str(header.StudyInstanceUID), str(header.SeriesInstanceUID),
+                  [int(w) for w in args.workers.split(',')])
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import sys
+import time
+import numpy as np
+from surface_extraction import extract_surface, phantom
+from vtk_bridge import volume_to_vtk_image
+
+
+def full_roi(shape):
+    return (0, shape[0], 0, shape[1], 0, shape[2])
+
+
+def _mass_bounds(profile, tail=0.005):
+    # Index range holding all but `tail` of the profile's mass at each end, so stray bright voxels are ignored
+    cumulative = np.cumsum(profile, dtype=np.float64)
+    total = cumulative[-1]
+    return int(np.searchsorted(cumulative, total * tail)), int(np.searchsorted(cumulative, total * (1 - tail)))
+
+
+def detect_jaw_roi(volume_data, spacing=(1.0, 1.0, 1.0), factor=4, tooth_percentile=99.5, min_value=1500,
+                   jaw_margin_mm=25.0, margin_mm=10.0):
+    # Bounding box (z0, z1, y0, y1, x0, x1) of the jaws, in voxels with exclusive ends. Teeth are the densest
+    # structure in the field of view: they are found in maximum intensity projections of a strided copy of
+    # the volume, then the box is grown by jaw_margin_mm above and below and margin_mm around.
+    start_time = time.perf_counter()
+    coarse = np.asarray(volume_data[::factor, ::factor, ::factor])
+    tooth_value = max(min_value, float(np.percentile(coarse, tooth_percentile)))
+
+    axial = coarse.max(axis=0) >= tooth_value
+    if not axial.any():
+        print("Jaw ROI: no tooth-density voxels found, keeping the whole volume")
+        return full_roi(volume_data.shape)
+    y0, y1 = _mass_bounds(axial.sum(axis=1))
+    x0, x1 = _mass_bounds(axial.sum(axis=0))
+    coronal = coarse[:, y0:y1 + 1, x0:x1 + 1].max(axis=1) >= tooth_value
+    z0, z1 = _mass_bounds(coronal.sum(axis=1))
+
+    # Back to full-resolution voxels, widened by the margins and clamped to the volume
+    x_spacing, y_spacing, z_spacing = spacing
+    grow = (int(round(jaw_margin_mm / z_spacing)), int(round(margin_mm / y_spacing)),
+            int(round(margin_mm / x_spacing)))
+    roi = []
+    for (start, stop), extra, length in zip(((z0, z1), (y0, y1), (x0, x1)), grow, volume_data.shape):
+        roi += [max(0, start * factor - extra), min(length, (stop + 1) * factor + extra)]
+    roi = tuple(roi)
+
+    print(f"Jaw ROI {roi} keeps {roi_voxels(roi) / volume_data.size:.0%} of the voxels "
+          f"(found in {time.perf_counter() - start_time:.2f}s)")
+    return roi
+
+
+def roi_voxels(roi):
+    z0, z1, y0, y1, x0, x1 = roi
+    return (z1 - z0) * (y1 - y0) * (x1 - x0)
+
+
+def crop_volume(volume_data, roi):
+    z0, z1, y0, y1, x0, x1 = roi
+    return volume_data[z0:z1, y0:y1, x0:x1]
+
+
+def roi_origin(origin, spacing, roi):
+    # World position of the ROI's first voxel; spacing and origin are in VTK (x, y, z) order
+    z0, _, y0, _, x0, _ = roi
+    return (origin[0] + x0 * spacing[0], origin[1] + y0 * spacing[1], origin[2] + z0 * spacing[2])
+
+
+def roi_from_bounds(bounds, origin, spacing, shape):
+    # Voxel ROI covering world bounds (xmin, xmax, ymin, ymax, zmin, zmax), e.g. from a box widget
+    roi = []
+    for axis, length in zip((2, 1, 0), shape):
+        # The small slack keeps bounds that sit exactly on a voxel from rounding to its neighbour
+        low = int(np.floor((bounds[2 * axis] - origin[axis]) / spacing[axis] + 1e-6))
+        high = int(np.ceil((bounds[2 * axis + 1] - origin[axis]) / spacing[axis] - 1e-6)) + 1
+        roi += [min(max(low, 0), length - 1), max(min(high, length), 1)]
+    return tuple(roi)
+
+
+def roi_bounds(roi, origin, spacing):
+    # World bounds (xmin, xmax, ymin, ymax, zmin, zmax) of a voxel ROI
+    z0, z1, y0, y1, x0, x1 = roi
+    return (origin[0] + x0 * spacing[0], origin[0] + (x1 - 1) * spacing[0],
+            origin[1] + y0 * spacing[1], origin[1] + (y1 - 1) * spacing[1],
+            origin[2] + z0 * spacing[2], origin[2] + (z1 - 1) * spacing[2])
+
+
+def main():
+    # python jaw_roi.py [phantom size]: extraction time and mesh size with and without the ROI
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    spacing = (0.3, 0.3, 0.3)
+    # The jaw phantom in the lower front of a larger field of view, with a spine column behind it
+    fov = size * 3 // 2
+    volume_data = np.full((fov, fov, fov), -200, dtype=np.int16)
+    volume_data[:size, :size, (fov - size) // 2:(fov - size) // 2 + size] = phantom(size)
+    z, y, x = np.ogrid[0:fov, 0:fov, 0:fov]
+    volume_data[np.broadcast_to(np.hypot(y - fov * 0.85, x - fov / 2) < fov * 0.06, volume_data.shape)] = 1600
+
+    start_time = time.perf_counter()
+    whole = extract_surface(volume_to_vtk_image(volume_data, spacing=spacing), 1500, verbose=False)
+    whole_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    roi = detect_jaw_roi(volume_data, spacing)
+    cropped = extract_surface(volume_to_vtk_image(crop_volume(volume_data, roi), spacing=spacing,
+                                                  origin=roi_origin((0.0, 0.0, 0.0), spacing, roi)),
+                              1500, verbose=False)
+    roi_time = time.perf_counter() - start_time
+
+    print(f"whole volume: {whole.GetNumberOfCells()} triangles in {whole_time:.2f}s")
+    print(f"jaw ROI: {cropped.GetNumberOfCells()} triangles in {roi_time:.2f}s including detection")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import sys
+import time
+import vtk
+import numpy as np
+from vtk.util import numpy_support
+
+MARKER_COLOR = (255, 255, 0)
+MARKER_RADIUS = 5.0
+
+
+class MarkerLayer:
+    # Every marker as one actor: a glyph mapper instances a sphere at each row of a points array and draws
+    # them all in one call. Adding, moving or removing markers only rewrites rows of the NumPy buffers the
+    # VTK arrays wrap. Marker ids stay valid across removals; rows are compacted by moving the last one in.
+    def __init__(self, renderer, radius=MARKER_RADIUS, color=MARKER_COLOR, resolution=8, attached=True):
+        self.renderer = renderer
+        self.radius = radius
+        self.color = color
+        self.count = 0
+        self.next_id = 0
+        self.rows = {}
+        self._positions = np.empty((0, 3), dtype=np.float32)
+        self._colors = np.empty((0, 3), dtype=np.uint8)
+        self._scales = np.empty(0, dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+
+        sphere = vtk.vtkSphereSource()
+        sphere.SetRadius(1.0)
+        sphere.SetThetaResolution(resolution)
+        sphere.SetPhiResolution(resolution)
+        self.polydata = vtk.vtkPolyData()
+        self.mapper = vtk.vtkGlyph3DMapper()
+        self.mapper.SetInputData(self.polydata)
+        self.mapper.SetSourceConnection(sphere.GetOutputPort())
+        self.mapper.ScalingOn()
+        self.mapper.SetScaleModeToScaleByMagnitude()
+        self.mapper.SetScaleArray('scale')
+        self.mapper.SetScalarModeToUsePointFieldData()
+        self.mapper.SelectColorArray('color')
+        self.mapper.SetColorModeToDirectScalars()
+        self.actor = vtk.vtkActor()
+        self.actor.SetMapper(self.mapper)
+        self.actor.PickableOff()
+        # The actor joins the renderer with the first marker once attached; a layer created with attached=False
+        # keeps its markers undrawn until attach(), e.g. until the surface they sit on is shown
+        self.attached = attached
+        self.in_renderer = False
+        self._publish()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def positions(self):
+        return self._positions[:self.count]
+
+    @property
+    def ids(self):
+        return self._ids[:self.count]
+
+    def _reserve(self, count):
+        # Buffers grow geometrically, so adding markers one by one stays amortized O(1)
+        if count <= len(self._positions):
+            return
+        capacity = max(count, 2 * len(self._positions), 64)
+        for name in ('_positions', '_colors', '_scales', '_ids'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def _publish(self):
+        # Rewrap the live rows; the VTK arrays share the NumPy memory, nothing is copied
+        points = vtk.vtkPoints()
+        points.SetData(numpy_support.numpy_to_vtk(self._positions[:self.count], deep=False))
+        self.polydata.SetPoints(points)
+        point_data = self.polydata.GetPointData()
+        for name, values in (('color', self._colors), ('scale', self._scales)):
+            array = numpy_support.numpy_to_vtk(values[:self.count], deep=False)
+            array.SetName(name)
+            point_data.AddArray(array)
+        self.polydata.Modified()
+        if self.count and self.attached and not self.in_renderer:
+            self.renderer.AddActor(self.actor)
+            self.in_renderer = True
+
+    def attach(self):
+        self.attached = True
+        self._publish()
+
+    def addMarkers(self, positions, colors=None, radii=None):
+        # Adds a batch of markers and returns their ids
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        start, stop = self.count, self.count + len(positions)
+        self._reserve(stop)
+        self._positions[start:stop] = positions
+        self._colors[start:stop] = self.color if colors is None else colors
+        self._scales[start:stop] = self.radius if radii is None else radii
+        ids = np.arange(self.next_id, self.next_id + len(positions), dtype=np.int64)
+        self._ids[start:stop] = ids
+        self.rows.update(zip(ids.tolist(), range(start, stop)))
+        self.next_id += len(positions)
+        self.count = stop
+        self._publish()
+        return ids
+
+    def addMarker(self, position, color=None, radius=None):
+        return int(self.addMarkers([position], None if color is None else [color],
+                                   None if radius is None else [radius])[0])
+
+    def moveMarker(self, marker_id, position):
+        self._positions[self.rows[marker_id]] = position
+        self.polydata.GetPoints().Modified()
+        self.polydata.Modified()
+
+    def setMarkerColor(self, marker_id, color):
+        self._colors[self.rows[marker_id]] = color
+        self.polydata.GetPointData().GetArray('color').Modified()
+        self.polydata.Modified()
+
+    def removeMarker(self, marker_id):
+        row = self.rows.pop(marker_id)
+        last = self.count - 1
+        if row != last:
+            for name in ('_positions', '_colors', '_scales', '_ids'):
+                buffer = getattr(self, name)
+                buffer[row] = buffer[last]
+            self.rows[int(self._ids[row])] = row
+        self.count = last
+        self._publish()
+
+    def clear(self):
+        self.rows.clear()
+        self.count = 0
+        self._publish()
+
+
+def render_time(render_window, renderer, frames=20):
+    renderer.ResetCamera()
+    render_window.Render()
+    start_time = time.perf_counter()
+    for _ in range(frames):
+        renderer.GetActiveCamera().Azimuth(360.0 / frames)
+        render_window.Render()
+    return (time.perf_counter() - start_time) / frames
+
+
+def main():
+    # python marker_layer.py [markers]: one sphere actor per marker against the glyph layer
+    markers = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    positions = np.random.default_rng(0).uniform(0, 100, (markers, 3))
+
+    results = {}
+    for mode in ('actor per marker', 'glyph layer'):
+        renderer = vtk.vtkRenderer()
+        render_window = vtk.vtkRenderWindow()
+        render_window.SetOffScreenRendering(1)
+        render_window.SetSize(300, 300)
+        render_window.AddRenderer(renderer)
+        start_time = time.perf_counter()
+        if mode == 'glyph layer':
+            layer = MarkerLayer(renderer)
+            for position in positions:
+                layer.addMarker(position)
+        else:
+            for position in positions:
+                marker = vtk.vtkSphereSource()
+                marker.SetCenter(*position)
+                marker.SetRadius(MARKER_RADIUS)
+                marker_mapper = vtk.vtkPolyDataMapper()
+                marker_mapper.SetInputConnection(marker.GetOutputPort())
+                marker_actor = vtk.vtkActor()
+                marker_actor.SetMapper(marker_mapper)
+                renderer.AddActor(marker_actor)
+        build_time = time.perf_counter() - start_time
+        results[mode] = (build_time, render_time(render_window, renderer))
+        render_window.Finalize()
+
+    start_time = time.perf_counter()
+    for marker_id in range(0, markers, 2):
+        layer.removeMarker(marker_id)
+    remove_time = (time.perf_counter() - start_time) / (markers // 2)
+    for mode, (build_time, frame) in results.items():
+        print(f"{mode}: {markers} markers added in {build_time:.2f}s, frame {frame * 1000:.1f} ms")
+    print(f"glyph layer: remove {remove_time * 1e6:.0f} us per marker, {len(layer)} left")
+
+
+if __name__ == "__main__":
+    main()
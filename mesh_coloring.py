@@ -0,0 +1,200 @@
+import sys
+import time
+import vtk
+import numpy as np
+from vtk.util import numpy_support
+from vtk_bridge import volume_to_vtk_image
+from surface_extraction import extract_surface, phantom
+
+DEFAULT_COLOR = (255, 255, 255)
+HIGHLIGHT_COLOR = (255, 255, 0)
+# Above this many sphere regions the points are bucketed into a grid instead of testing every point per sphere
+GRID_REGIONS = 8
+
+
+class BoxRegion:
+    # Axis-aligned box (xmin, xmax, ymin, ymax, zmin, zmax) in world coordinates; use +-np.inf to leave an axis open
+    def __init__(self, bounds, color=HIGHLIGHT_COLOR):
+        self.bounds = np.asarray(bounds, dtype=np.float64).reshape(3, 2)
+        self.color = color
+
+    def contains(self, points):
+        inside = np.ones(len(points), dtype=bool)
+        for axis, (low, high) in enumerate(self.bounds):
+            if np.isfinite(low):
+                inside &= points[:, axis] >= low
+            if np.isfinite(high):
+                inside &= points[:, axis] <= high
+        return inside
+
+
+class SphereRegion:
+    def __init__(self, center, radius, color=HIGHLIGHT_COLOR):
+        self.center = np.asarray(center, dtype=np.float64)
+        self.radius = float(radius)
+        self.color = color
+
+    def contains(self, points):
+        offsets = points - self.center.astype(points.dtype)
+        return np.einsum('ij,ij->i', offsets, offsets) <= self.radius ** 2
+
+
+class LabelRegion:
+    # Colors points by the label volume voxel they fall in, e.g. from label_surfaces.classify_labels.
+    # colors maps label value -> RGB; every label is classified in the same single lookup.
+    def __init__(self, label_volume, colors, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0)):
+        self.label_volume = label_volume
+        self.colors = colors
+        self.spacing = np.asarray(spacing, dtype=np.float64)
+        self.origin = np.asarray(origin, dtype=np.float64)
+
+    def labels(self, points):
+        # Nearest voxel per point; points outside the volume get label 0
+        voxels = np.rint((points - self.origin) / self.spacing).astype(np.int64)
+        shape = np.array(self.label_volume.shape[::-1])
+        inside = np.all((voxels >= 0) & (voxels < shape), axis=1)
+        labels = np.zeros(len(points), dtype=self.label_volume.dtype)
+        x, y, z = voxels[inside].T
+        labels[inside] = self.label_volume[z, y, x]
+        return labels
+
+
+class _PointGrid:
+    # Points bucketed into cubic cells and sorted by cell, so a sphere query only tests the cells it overlaps
+    def __init__(self, points, cell_size):
+        self.points = points
+        self.cell_size = cell_size
+        self.lower = points.min(axis=0).astype(np.float64)
+        cells = ((points - self.lower) / cell_size).astype(np.int64)
+        self.dims = cells.max(axis=0) + 1
+        keys = (cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2]
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def query(self, region):
+        low = np.maximum(((region.center - region.radius - self.lower) // self.cell_size).astype(np.int64), 0)
+        high = np.minimum(((region.center + region.radius - self.lower) // self.cell_size).astype(np.int64),
+                          self.dims - 1)
+        if np.any(low > high):
+            return np.empty(0, dtype=np.int64)
+        # Cells along z are contiguous in key order, so each (x, y) column is one slice of the sorted points
+        pieces = []
+        for x in range(low[0], high[0] + 1):
+            for y in range(low[1], high[1] + 1):
+                base = (x * self.dims[1] + y) * self.dims[2]
+                start, stop = np.searchsorted(self.keys, (base + low[2], base + high[2] + 1))
+                pieces.append(self.order[start:stop])
+        candidates = np.concatenate(pieces)
+        return candidates[region.contains(self.points[candidates])]
+
+
+class RegionColoring:
+    # Per-point colors for a surface. The VTK color array wraps a NumPy buffer without copying, so
+    # recoloring with new regions rewrites it in place and only needs a render.
+    def __init__(self, surface, base_color=DEFAULT_COLOR):
+        self.surface = surface
+        self.base_color = base_color
+        self.points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData()) \
+            if surface.GetNumberOfPoints() else np.empty((0, 3), dtype=np.float32)
+        self.colors = np.empty((len(self.points), 3), dtype=np.uint8)
+        self.color_array = numpy_support.numpy_to_vtk(self.colors, deep=False, array_type=vtk.VTK_UNSIGNED_CHAR)
+        self.color_array.SetName("Colors")
+        surface.GetPointData().SetScalars(self.color_array)
+        self._grid = None
+
+    def _grid_for(self, spheres):
+        # Cells about the size of the typical sphere; rebuilt only when that size changes a lot
+        cell_size = max(float(np.median([s.radius for s in spheres])), 1e-6)
+        if self._grid is None or not 0.5 <= self._grid.cell_size / cell_size <= 2:
+            self._grid = _PointGrid(self.points, cell_size)
+        return self._grid
+
+    def apply(self, regions, verbose=False):
+        # Regions earlier in the list win where they overlap
+        start_time = time.perf_counter()
+        self.colors[:] = self.base_color
+        if len(self.points):
+            spheres = [r for r in regions if isinstance(r, SphereRegion)]
+            grid = self._grid_for(spheres) if len(spheres) >= GRID_REGIONS else None
+            for region in reversed(regions):
+                if isinstance(region, LabelRegion):
+                    labels = region.labels(self.points)
+                    for value, color in region.colors.items():
+                        self.colors[labels == value] = color
+                elif grid is not None and isinstance(region, SphereRegion):
+                    self.colors[grid.query(region)] = region.color
+                else:
+                    self.colors[region.contains(self.points)] = region.color
+        self.color_array.Modified()
+        self.surface.GetPointData().Modified()
+        if verbose:
+            print(f"Colored {len(self.points)} points by {len(regions)} regions in "
+                  f"{(time.perf_counter() - start_time) * 1000:.1f} ms")
+        return self
+
+
+def color_regions(surface, regions, base_color=DEFAULT_COLOR, verbose=False):
+    return RegionColoring(surface, base_color).apply(regions, verbose)
+
+
+def _loop_coloring(surface, regions):
+    # The per-point Python loop this module replaces, kept for the benchmark
+    color_array = vtk.vtkUnsignedCharArray()
+    color_array.SetNumberOfComponents(3)
+    for i in range(surface.GetNumberOfPoints()):
+        color = DEFAULT_COLOR
+        point = surface.GetPoint(i)
+        for region in regions:
+            (x_min, x_max), (y_min, y_max), (z_min, z_max) = region.bounds
+            if x_min <= point[0] <= x_max and y_min <= point[1] <= y_max and z_min <= point[2] <= z_max:
+                color = region.color
+                break
+        color_array.InsertNextTuple(color)
+    return color_array
+
+
+def main():
+    # python mesh_coloring.py [phantom size]: per-point loop against vectorized boxes, many spheres and labels
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    spacing = (0.3, 0.3, 0.3)
+    volume_data = phantom(size)
+    surface = extract_surface(volume_to_vtk_image(volume_data, spacing=spacing), 1500)
+    extent = size * spacing[0]
+
+    boxes = [BoxRegion((extent * f - 5, extent * f + 5, extent * 0.3 - 5, extent * 0.3 + 5, -np.inf, np.inf))
+             for f in (0.3, 0.5, 0.7)]
+    start_time = time.perf_counter()
+    _loop_coloring(surface, boxes)
+    loop_time = time.perf_counter() - start_time
+
+    coloring = RegionColoring(surface)
+    start_time = time.perf_counter()
+    coloring.apply(boxes)
+    box_time = time.perf_counter() - start_time
+    print(f"{len(boxes)} boxes over {surface.GetNumberOfPoints()} points: loop {loop_time:.2f}s, "
+          f"vectorized {box_time * 1000:.1f} ms")
+
+    rng = np.random.default_rng(0)
+    spheres = [SphereRegion(rng.uniform(0, extent, 3), 2.0) for _ in range(500)]
+    start_time = time.perf_counter()
+    coloring.apply(spheres)
+    grid_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    coloring.apply(spheres)
+    regrid_time = time.perf_counter() - start_time
+    reference = np.full_like(coloring.colors, 255)
+    for sphere in reversed(spheres):
+        reference[sphere.contains(coloring.points)] = sphere.color
+    print(f"{len(spheres)} spheres: first {grid_time * 1000:.1f} ms (builds the grid), recolor "
+          f"{regrid_time * 1000:.1f} ms, matches brute force: {np.array_equal(reference, coloring.colors)}")
+
+    labels = np.zeros(volume_data.shape, dtype=np.uint8)
+    labels[volume_data >= 1500] = 1
+    labels[volume_data >= 2200] = 2
+    start_time = time.perf_counter()
+    coloring.apply([LabelRegion(labels, {1: (230, 215, 180), 2: (255, 255, 0)}, spacing)])
+    print(f"label volume: {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
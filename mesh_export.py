@@ -0,0 +1,303 @@
+import os
+import sys
+import gzip
+import json
+import time
+import struct
+import argparse
+import vtk
+import numpy as np
+from vtk.util import numpy_support
+from vtk_bridge import volume_to_vtk_image
+from surface_extraction import extract_surface, phantom, SURFACE_ENGINES
+
+MESH_FORMATS = ('stl', 'ply', 'glb')
+# Triangles converted and written per chunk; a chunk of STL records is about 12 MB
+DEFAULT_CHUNK_TRIANGLES = 1 << 18
+
+# 50-byte binary STL facet: normal, three corners, attribute byte count
+STL_RECORD = np.dtype([('normal', '<f4', 3), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+PLY_FACE = np.dtype([('count', 'u1'), ('indices', '<i4', 3)])
+
+# glTF constants
+GLB_MAGIC = 0x46546C67
+GLB_JSON = 0x4E4F534A
+GLB_BIN = 0x004E4942
+GL_BYTE, GL_UNSIGNED_SHORT, GL_UNSIGNED_INT, GL_FLOAT = 5120, 5123, 5125, 5126
+GL_ARRAY_BUFFER, GL_ELEMENT_ARRAY_BUFFER = 34962, 34963
+QUANTIZED_MAX = 65535
+
+
+def mesh_format(file_path):
+    # Format from the extension; a trailing .gz gzip-compresses the file
+    name = file_path[:-3] if file_path.lower().endswith('.gz') else file_path
+    fmt = os.path.splitext(name)[1].lower().lstrip('.')
+    if fmt not in MESH_FORMATS:
+        raise ValueError(f"Unknown mesh format '{fmt}' for {file_path}, expected one of {MESH_FORMATS}")
+    return fmt
+
+
+def surface_arrays(surface):
+    # Views over the VTK buffers without copying: points (N, 3), triangles (T, 3) and point normals or None
+    polys = surface.GetPolys()
+    if surface.GetNumberOfCells() != surface.GetNumberOfPolys() or polys.IsHomogeneous() not in (3, 0):
+        triangulate = vtk.vtkTriangleFilter()
+        triangulate.SetInputData(surface)
+        triangulate.PassVertsOff()
+        triangulate.PassLinesOff()
+        triangulate.Update()
+        surface = triangulate.GetOutput()
+        polys = surface.GetPolys()
+
+    if surface.GetNumberOfPoints() == 0:
+        points = np.empty((0, 3), dtype=np.float32)
+    else:
+        points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+    triangles = numpy_support.vtk_to_numpy(polys.GetConnectivityArray()).reshape(-1, 3)
+    normals = surface.GetPointData().GetNormals()
+    return points, triangles, None if normals is None else numpy_support.vtk_to_numpy(normals)
+
+
+def _chunks(length, chunk):
+    for start in range(0, length, chunk):
+        yield start, min(start + chunk, length)
+
+
+def write_stl(stream, points, triangles, chunk_triangles=DEFAULT_CHUNK_TRIANGLES):
+    # The header must not start with "solid", or readers take the file for ASCII STL
+    stream.write(b'binary STL'.ljust(80, b' '))
+    stream.write(struct.pack('<I', len(triangles)))
+    for start, stop in _chunks(len(triangles), chunk_triangles):
+        corners = points[triangles[start:stop]]
+        normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        records = np.zeros(stop - start, dtype=STL_RECORD)
+        records['normal'] = normals / np.where(lengths > 0, lengths, 1)
+        records['vertices'] = corners
+        stream.write(records.data)
+
+
+def write_ply(stream, points, triangles, normals=None, chunk_triangles=DEFAULT_CHUNK_TRIANGLES):
+    header = ['ply', 'format binary_little_endian 1.0', 'comment dental3d surface, coordinates in mm',
+              f'element vertex {len(points)}', 'property float x', 'property float y', 'property float z']
+    if normals is not None:
+        header += ['property float nx', 'property float ny', 'property float nz']
+    header += [f'element face {len(triangles)}', 'property list uchar int vertex_indices', 'end_header']
+    stream.write(('\n'.join(header) + '\n').encode('ascii'))
+
+    for start, stop in _chunks(len(points), chunk_triangles):
+        if normals is None and points.dtype == np.float32:
+            # Already in the file layout, written straight from the VTK buffer
+            stream.write(np.ascontiguousarray(points[start:stop]).data)
+            continue
+        vertices = np.empty((stop - start, 3 if normals is None else 6), dtype='<f4')
+        vertices[:, :3] = points[start:stop]
+        if normals is not None:
+            vertices[:, 3:] = normals[start:stop]
+        stream.write(vertices.data)
+
+    for start, stop in _chunks(len(triangles), chunk_triangles):
+        faces = np.empty(stop - start, dtype=PLY_FACE)
+        faces['count'] = 3
+        faces['indices'] = triangles[start:stop]
+        stream.write(faces.data)
+
+
+def write_glb(stream, points, triangles, normals=None, quantize=False, chunk_triangles=DEFAULT_CHUNK_TRIANGLES):
+    # Binary glTF. Every section length is known up front, so the JSON chunk is written first and the
+    # binary chunk is streamed after it. Quantized files store positions as uint16 steps of the mesh extent
+    # and normals as int8 (KHR_mesh_quantization); the node transform maps them back to millimetres.
+    lower = points.min(axis=0).astype(np.float64) if len(points) else np.zeros(3)
+    upper = points.max(axis=0).astype(np.float64) if len(points) else np.zeros(3)
+    step = np.where(upper > lower, (upper - lower) / QUANTIZED_MAX, 1.0)
+    index_type, index_dtype = ((GL_UNSIGNED_INT, '<u4') if len(points) > QUANTIZED_MAX
+                               else (GL_UNSIGNED_SHORT, '<u2'))
+
+    # Quantized vertices are padded to 4-byte strides as glTF requires
+    position_stride = 8 if quantize else 12
+    normal_stride = 4 if quantize else 12
+    sections = [('POSITION', len(points) * position_stride, position_stride)]
+    if normals is not None:
+        sections.append(('NORMAL', len(points) * normal_stride, normal_stride))
+    index_bytes = len(triangles) * 3 * np.dtype(index_dtype).itemsize
+    sections.append(('indices', index_bytes + (-index_bytes) % 4, None))
+
+    buffer_views, offset = [], 0
+    for name, length, stride in sections:
+        view = {'buffer': 0, 'byteOffset': offset, 'byteLength': length,
+                'target': GL_ELEMENT_ARRAY_BUFFER if name == 'indices' else GL_ARRAY_BUFFER}
+        if stride is not None:
+            view['byteStride'] = stride
+        buffer_views.append(view)
+        offset += length
+
+    if quantize:
+        position = {'componentType': GL_UNSIGNED_SHORT, 'min': [0, 0, 0],
+                    'max': [int(round(v)) for v in (upper - lower) / step]}
+    else:
+        position = {'componentType': GL_FLOAT, 'min': lower.tolist(), 'max': upper.tolist()}
+    accessors = [dict(bufferView=0, count=len(points), type='VEC3', **position)]
+    attributes = {'POSITION': 0}
+    if normals is not None:
+        accessors.append({'bufferView': 1, 'count': len(points), 'type': 'VEC3',
+                          'componentType': GL_BYTE if quantize else GL_FLOAT, 'normalized': bool(quantize)})
+        attributes['NORMAL'] = 1
+    accessors.append({'bufferView': len(buffer_views) - 1, 'count': len(triangles) * 3, 'type': 'SCALAR',
+                      'componentType': index_type})
+
+    node = {'mesh': 0}
+    document = {'asset': {'version': '2.0', 'generator': 'dental3d mesh_export'}, 'scene': 0,
+                'scenes': [{'nodes': [0]}], 'nodes': [node],
+                'meshes': [{'primitives': [{'attributes': attributes, 'indices': len(accessors) - 1, 'mode': 4}]}],
+                'buffers': [{'byteLength': offset}], 'bufferViews': buffer_views, 'accessors': accessors}
+    if quantize:
+        node['translation'] = lower.tolist()
+        node['scale'] = step.tolist()
+        document['extensionsUsed'] = document['extensionsRequired'] = ['KHR_mesh_quantization']
+
+    json_chunk = json.dumps(document, separators=(',', ':')).encode('utf-8')
+    json_chunk += b' ' * (-len(json_chunk) % 4)
+    stream.write(struct.pack('<III', GLB_MAGIC, 2, 12 + 8 + len(json_chunk) + 8 + offset))
+    stream.write(struct.pack('<II', len(json_chunk), GLB_JSON))
+    stream.write(json_chunk)
+    stream.write(struct.pack('<II', offset, GLB_BIN))
+
+    for start, stop in _chunks(len(points), chunk_triangles):
+        if quantize:
+            vertices = np.zeros((stop - start, 4), dtype='<u2')
+            vertices[:, :3] = np.rint((points[start:stop] - lower) / step)
+        else:
+            vertices = np.ascontiguousarray(points[start:stop], dtype='<f4')
+        stream.write(vertices.data)
+    if normals is not None:
+        for start, stop in _chunks(len(points), chunk_triangles):
+            if quantize:
+                packed = np.zeros((stop - start, 4), dtype='i1')
+                packed[:, :3] = np.rint(np.clip(normals[start:stop], -1, 1) * 127)
+            else:
+                packed = np.ascontiguousarray(normals[start:stop], dtype='<f4')
+            stream.write(packed.data)
+    for start, stop in _chunks(len(triangles), chunk_triangles):
+        stream.write(np.ascontiguousarray(triangles[start:stop], dtype=index_dtype).data)
+    stream.write(b'\0' * (-index_bytes % 4))
+
+
+def export_mesh(surface, file_path, quantize=False, normals=True, compress_level=6,
+                chunk_triangles=DEFAULT_CHUNK_TRIANGLES, verbose=True):
+    # Writes the surface as binary STL, PLY or glb, chosen by extension, in chunks straight from the
+    # VTK buffers. A .gz suffix gzip-compresses the stream. The file appears under its name only once complete.
+    fmt = mesh_format(file_path)
+    if quantize and fmt != 'glb':
+        raise ValueError("Quantized vertices are only supported for glb")
+    start_time = time.perf_counter()
+    points, triangles, point_normals = surface_arrays(surface)
+    if not normals:
+        point_normals = None
+
+    part_path = file_path + '.part'
+    if file_path.lower().endswith('.gz'):
+        stream = gzip.open(part_path, 'wb', compresslevel=compress_level)
+    else:
+        stream = open(part_path, 'wb', buffering=1024 * 1024)
+    try:
+        with stream:
+            if fmt == 'stl':
+                write_stl(stream, points, triangles, chunk_triangles)
+            elif fmt == 'ply':
+                write_ply(stream, points, triangles, point_normals, chunk_triangles)
+            else:
+                write_glb(stream, points, triangles, point_normals, quantize, chunk_triangles)
+        os.replace(part_path, file_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    result = {'format': fmt, 'points': len(points), 'triangles': len(triangles),
+              'bytes': os.path.getsize(file_path), 'seconds': time.perf_counter() - start_time}
+    if verbose:
+        print(f"Exported {result['triangles']} triangles to {file_path} ({result['bytes'] / (1024 * 1024):.1f} MB"
+              f"{', quantized' if quantize else ''}) in {result['seconds']:.2f}s")
+    return result
+
+
+def vtk_export(surface, file_path):
+    # The VTK writer for the same format, for comparison
+    fmt = mesh_format(file_path)
+    if fmt == 'stl':
+        writer = vtk.vtkSTLWriter()
+        writer.SetFileTypeToBinary()
+        writer.SetInputData(surface)
+    elif fmt == 'ply':
+        writer = vtk.vtkPLYWriter()
+        writer.SetFileTypeToBinary()
+        writer.SetInputData(surface)
+    else:
+        render_window = vtk.vtkRenderWindow()
+        renderer = vtk.vtkRenderer()
+        mapper = vtk.vtkPolyDataMapper()
+        mapper.SetInputData(surface)
+        actor = vtk.vtkActor()
+        actor.SetMapper(mapper)
+        renderer.AddActor(actor)
+        render_window.AddRenderer(renderer)
+        writer = vtk.vtkGLTFExporter()
+        writer.SetRenderWindow(render_window)
+        writer.InlineDataOn()
+    writer.SetFileName(file_path)
+    start_time = time.perf_counter()
+    writer.Write()
+    return time.perf_counter() - start_time
+
+
+def load_source(source):
+    # A DICOM folder, a .npy volume or a phantom size; returns the volume, spacing and origin
+    if os.path.isdir(source):
+        from series_loader import load_series
+        volume_data, series_index = load_series(source)
+        return volume_data, series_index.spacing, series_index.origin
+    if source.endswith('.npy'):
+        return np.load(source, mmap_mode='r'), (1.0, 1.0, 1.0), (0.0, 0.0, 0.0)
+    return phantom(int(source)), (0.3, 0.3, 0.3), (0.0, 0.0, 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract a dental surface and export it for implant planning")
+    parser.add_argument('source', help="DICOM series folder, .npy volume or phantom size")
+    parser.add_argument('output', help="mesh file: .stl, .ply or .glb, optionally followed by .gz")
+    parser.add_argument('--threshold', type=float, default=1500, help="isosurface value (default: 1500)")
+    parser.add_argument('--engine', choices=SURFACE_ENGINES, default=None, help="surface extraction engine")
+    parser.add_argument('--roi', action='store_true', help="extract only the detected jaw region")
+    parser.add_argument('--quantize', action='store_true', help="uint16 positions and int8 normals (glb only)")
+    parser.add_argument('--no-normals', action='store_true', help="leave point normals out of PLY and glb files")
+    parser.add_argument('--compare', action='store_true', help="also time VTK's own writer for the format")
+    args = parser.parse_args()
+
+    volume_data, spacing, origin = load_source(args.source)
+    if args.roi:
+        from jaw_roi import detect_jaw_roi, crop_volume, roi_origin
+        roi = detect_jaw_roi(volume_data, spacing)
+        volume_data, origin = crop_volume(volume_data, roi), roi_origin(origin, spacing, roi)
+    surface = extract_surface(volume_to_vtk_image(np.asarray(volume_data), spacing=spacing, origin=origin),
+                              args.threshold, engine=args.engine)
+    if not args.no_normals and mesh_format(args.output) != 'stl':
+        normals = vtk.vtkPolyDataNormals()
+        normals.SetInputData(surface)
+        normals.SplittingOff()
+        normals.ConsistencyOff()
+        normals.Update()
+        surface = normals.GetOutput()
+
+    try:
+        export_mesh(surface, args.output, quantize=args.quantize, normals=not args.no_normals)
+    except ValueError as e:
+        sys.exit(str(e))
+    if args.compare and not args.output.lower().endswith('.gz'):
+        base, extension = os.path.splitext(args.output)
+        compare_path = f"{base}.vtk{extension}"
+        seconds = vtk_export(surface, compare_path)
+        print(f"VTK writer: {os.path.getsize(compare_path) / (1024 * 1024):.1f} MB in {seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
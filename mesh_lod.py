@@ -0,0 +1,168 @@
+import sys
+import time
+import vtk
+from vtk_bridge import volume_to_vtk_image
+from surface_extraction import extract_surface, phantom
+
+# Triangle budget for the mesh shown while the user rotates or zooms
+INTERACTIVE_TRIANGLES = 200000
+DECIMATION_METHODS = ('quadric', 'pro')
+
+
+def smooth_surface(surface, iterations=15, pass_band=0.1):
+    # Windowed-sinc smoothing removes the voxel staircase without shrinking the mesh
+    smoother = vtk.vtkWindowedSincPolyDataFilter()
+    smoother.SetInputData(surface)
+    smoother.SetNumberOfIterations(iterations)
+    smoother.SetPassBand(pass_band)
+    smoother.BoundarySmoothingOff()
+    smoother.FeatureEdgeSmoothingOff()
+    smoother.NonManifoldSmoothingOn()
+    smoother.NormalizeCoordinatesOn()
+    smoother.Update()
+
+    smoothed = vtk.vtkPolyData()
+    smoothed.ShallowCopy(smoother.GetOutput())
+    return smoothed
+
+
+def decimate_surface(surface, target_triangles, method='quadric'):
+    triangles = surface.GetNumberOfCells()
+    if triangles <= target_triangles:
+        return surface
+    if method not in DECIMATION_METHODS:
+        raise ValueError(f"Unknown decimation method '{method}', expected one of {DECIMATION_METHODS}")
+
+    if method == 'quadric':
+        decimator = vtk.vtkQuadricDecimation()
+        decimator.VolumePreservationOn()
+    else:
+        decimator = vtk.vtkDecimatePro()
+        decimator.PreserveTopologyOff()
+        decimator.SplittingOff()
+        decimator.BoundaryVertexDeletionOn()
+    decimator.SetInputData(surface)
+    decimator.SetTargetReduction(1.0 - target_triangles / triangles)
+    decimator.Update()
+
+    decimated = vtk.vtkPolyData()
+    decimated.ShallowCopy(decimator.GetOutput())
+    return decimated
+
+
+def build_lod(surface, target_triangles=INTERACTIVE_TRIANGLES, method='quadric', smooth_iterations=15,
+              verbose=True):
+    # The interactive level: optionally smoothed, then decimated to the triangle budget
+    start_time = time.perf_counter()
+    lod_surface = smooth_surface(surface, smooth_iterations) if smooth_iterations else surface
+    lod_surface = decimate_surface(lod_surface, target_triangles, method)
+
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputData(lod_surface)
+    normals.SplittingOff()
+    normals.Update()
+    lod_surface = normals.GetOutput()
+
+    if verbose:
+        print(f"[lod] {surface.GetNumberOfCells()} -> {lod_surface.GetNumberOfCells()} triangles ({method}, "
+              f"{smooth_iterations} smoothing iterations) in {time.perf_counter() - start_time:.2f}s")
+    return lod_surface
+
+
+class InteractionLod:
+    # Shows the interactive level while the camera is being moved and the full mesh once it stops
+    def __init__(self, interactor, actor):
+        self.interactor = interactor
+        self.actor = actor
+        self.full = None
+        self.interactive = None
+        self.interacting = False
+        self.observed_style = None
+        self._observers = []
+        # Checked before the style sees each press or wheel step, so a replaced style or a key switch between
+        # joystick and trackball is picked up before the interaction it starts
+        for event in ('LeftButtonPressEvent', 'MiddleButtonPressEvent', 'RightButtonPressEvent',
+                      'MouseWheelForwardEvent', 'MouseWheelBackwardEvent'):
+            self.interactor.AddObserver(event, self.observeStyle, 2.0)
+        self.observeStyle()
+
+    def observeStyle(self, caller=None, event=None):
+        # Interaction events come from the concrete style; a vtkInteractorStyleSwitch only forwards input to it
+        style = self.interactor.GetInteractorStyle()
+        if isinstance(style, vtk.vtkInteractorStyleSwitch):
+            style = style.GetCurrentStyle()
+        if style is self.observed_style:
+            return
+        for observer in self._observers:
+            self.observed_style.RemoveObserver(observer)
+        self.observed_style = style
+        self._observers = [style.AddObserver('StartInteractionEvent', self.onStartInteraction),
+                           style.AddObserver('EndInteractionEvent', self.onEndInteraction)] if style else []
+
+    def setLevels(self, full, interactive=None):
+        self.full = full
+        self.interactive = interactive
+        self._show()
+
+    def _show(self):
+        surface = self.interactive if self.interacting and self.interactive is not None else self.full
+        if surface is not None and self.actor.GetMapper().GetInput() is not surface:
+            self.actor.GetMapper().SetInputData(surface)
+
+    def onStartInteraction(self, caller=None, event=None):
+        self.interacting = True
+        self._show()
+
+    def onEndInteraction(self, caller=None, event=None):
+        self.interacting = False
+        self._show()
+        self.interactor.GetRenderWindow().Render()
+
+
+def frame_time(surface, frames=36):
+    # Average offscreen render time while orbiting the camera
+    mapper = vtk.vtkPolyDataMapper()
+    mapper.SetInputData(surface)
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+    renderer = vtk.vtkRenderer()
+    renderer.AddActor(actor)
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.SetSize(800, 800)
+    render_window.AddRenderer(renderer)
+    renderer.ResetCamera()
+    render_window.Render()
+
+    start_time = time.perf_counter()
+    for _ in range(frames):
+        renderer.GetActiveCamera().Azimuth(360.0 / frames)
+        render_window.Render()
+    render_window.Finalize()
+    return (time.perf_counter() - start_time) / frames
+
+
+def main():
+    # python mesh_lod.py [phantom size] [method]: triangles, processing time and frame time per level
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    method = sys.argv[2] if len(sys.argv) > 2 else 'quadric'
+
+    vtk_volume = volume_to_vtk_image(phantom(size), spacing=(0.3, 0.3, 0.3))
+    start_time = time.perf_counter()
+    surface = extract_surface(vtk_volume, 1500)
+    extraction_time = time.perf_counter() - start_time
+    print(f"full: {surface.GetNumberOfCells()} triangles, extraction {extraction_time:.2f}s, "
+          f"frame {frame_time(surface) * 1000:.1f} ms")
+
+    for target in (500000, 200000, 50000, 10000):
+        if target >= surface.GetNumberOfCells():
+            continue
+        start_time = time.perf_counter()
+        lod_surface = build_lod(surface, target, method, verbose=False)
+        lod_time = time.perf_counter() - start_time
+        print(f"{target}: {lod_surface.GetNumberOfCells()} triangles, smoothing + decimation {lod_time:.2f}s, "
+              f"frame {frame_time(lod_surface) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import time
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+from series_index import build_series_index
+from series_loader import decode_slices, open_cached_series, allocate_series_volume, is_compressed
+from vtk_bridge import volume_to_vtk_image
+from surface_extraction import extract_surface
+from bricked_extract import extract_bricked
+from jaw_roi import detect_jaw_roi, crop_volume, roi_origin
+from volume_store import memory_stage, OUT_OF_CORE_BYTES
+from volume_pyramid import VolumePyramid, INTERACTIVE_VOXELS
+
+
+def preview_order(num_slices, preview_slices):
+    # Every Nth slice first for the coarse preview, then the rest in ascending order
+    step = max(1, num_slices // max(1, preview_slices))
+    coarse = list(range(0, num_slices, step))
+    coarse_set = set(coarse)
+    return step, coarse, [i for i in range(num_slices) if i not in coarse_set]
+
+
+class ProgressiveSeriesLoader(QThread):
+    # Loads a series off the GUI thread: index, coarse preview, then the remaining slices.
+    # Slices can be read from the volume as soon as arrived[i] is set.
+    indexed = pyqtSignal(object, object)
+    previewReady = pyqtSignal(object, object)
+    progressChanged = pyqtSignal(int, int)
+    loadFinished = pyqtSignal(object, object, object)
+    loadFailed = pyqtSignal(str)
+
+    def __init__(self, directory_path, preview_slices=32, preview_downsample=4, surface_value=None,
+                 workers=None, use_cache=True, series_index=None, auto_roi=False, parent=None):
+        super().__init__(parent)
+        self.directory_path = directory_path
+        self.prebuilt_index = series_index
+        self.preview_slices = preview_slices
+        self.preview_downsample = preview_downsample
+        self.surface_value = surface_value
+        self.workers = workers
+        self.use_cache = use_cache
+        self.auto_roi = auto_roi
+        self.roi = None
+        self.volume_data = None
+        self.series_index = None
+        self.arrived = None
+        self.pyramid = None
+        self._last_progress = 0.0
+
+    def cancel(self):
+        self.requestInterruption()
+
+    def run(self):
+        try:
+            self._load()
+        except Exception as e:
+            self.loadFailed.emit(f"Error loading {self.directory_path}: {e}")
+
+    def _load(self):
+        volume_cache = key = None
+        if self.use_cache:
+            volume_cache, key, cached = open_cached_series(self.directory_path, series_index=self.prebuilt_index)
+            if cached is not None:
+                self.volume_data, self.series_index = cached
+                self.arrived = np.ones(len(self.series_index), dtype=bool)
+                self.pyramid = VolumePyramid(self.volume_data, self.series_index)
+                self.indexed.emit(self.volume_data, self.series_index)
+                self._emitPyramidPreview()
+                self._finish()
+                return
+
+        self.series_index = self.prebuilt_index
+        if self.series_index is None:
+            self.series_index = build_series_index(self.directory_path)
+        self.volume_data, cache_backed = allocate_series_volume(self.series_index, volume_cache=volume_cache, key=key)
+        self.arrived = np.zeros(len(self.series_index), dtype=bool)
+        self.use_processes = is_compressed(self.series_index.transfer_syntax)
+        self.indexed.emit(self.volume_data, self.series_index)
+
+        try:
+            step, coarse, remaining = preview_order(len(self.series_index), self.preview_slices)
+            self._decode(coarse)
+            if not self.isInterruptionRequested():
+                self._emitPreview(coarse, step)
+                self._decode(remaining)
+        except BaseException:
+            if cache_backed:
+                volume_cache.discard(self.volume_data)
+            raise
+        if self.isInterruptionRequested():
+            # A cancelled load never becomes a cache entry
+            if cache_backed:
+                volume_cache.discard(self.volume_data)
+            return
+
+        if cache_backed:
+            volume_cache.commit(key, self.volume_data, self.series_index)
+        self.pyramid = VolumePyramid(self.volume_data, self.series_index)
+        self._finish()
+
+    def _decode(self, indices):
+        if indices:
+            decode_slices(self.series_index.file_paths, self.volume_data, workers=self.workers,
+                          use_processes=self.use_processes, indices=indices, on_slice=self._onSlice,
+                          is_cancelled=self.isInterruptionRequested)
+        self.progressChanged.emit(int(self.arrived.sum()), len(self.arrived))
+
+    def _onSlice(self, index):
+        self.arrived[index] = True
+        # Throttle progress signals so the GUI event queue is not flooded
+        now = time.perf_counter()
+        if now - self._last_progress > 0.1:
+            self._last_progress = now
+            self.progressChanged.emit(int(self.arrived.sum()), len(self.arrived))
+
+    def _emitPreview(self, coarse, step):
+        ds = self.preview_downsample
+        preview = np.ascontiguousarray(self.volume_data[coarse][:, ::ds, ::ds])
+        preview_surface = None
+        if self.surface_value is not None:
+            spacing_x, spacing_y, spacing_z = self.series_index.spacing
+            vtk_preview = volume_to_vtk_image(preview, spacing=(spacing_x * ds, spacing_y * ds, spacing_z * step),
+                                              origin=self.series_index.origin)
+            preview_surface = extract_surface(vtk_preview, self.surface_value)
+        self.previewReady.emit(preview, preview_surface)
+
+    def _emitPyramidPreview(self):
+        # A reopened volume is complete already, so preview from a coarse pyramid level instead
+        factor = self.pyramid.factor_for_voxels(INTERACTIVE_VOXELS)
+        preview = self.pyramid.level(factor) if factor > 1 else self.volume_data
+        preview_surface = None
+        if self.surface_value is not None:
+            preview_surface = extract_surface(self.pyramid.vtk_image(factor), self.surface_value)
+        self.previewReady.emit(preview, preview_surface)
+
+    def _finish(self):
+        surface = None
+        if self.surface_value is not None:
+            volume_data, origin = self.volume_data, self.series_index.origin
+            if self.auto_roi:
+                # Only the jaws are meshed; air, spine and skull are cropped away first
+                self.roi = detect_jaw_roi(self.volume_data, self.series_index.spacing)
+                volume_data = crop_volume(self.volume_data, self.roi)
+                origin = roi_origin(origin, self.series_index.spacing, self.roi)
+            with memory_stage('surface extraction'):
+                if volume_data.nbytes > OUT_OF_CORE_BYTES:
+                    # Too big to hand VTK in one piece: extract bricks in worker processes
+                    surface = extract_bricked(volume_data, self.surface_value, self.series_index.spacing, origin)
+                else:
+                    surface = extract_surface(volume_to_vtk_image(volume_data, spacing=self.series_index.spacing,
+                                                                  origin=origin), self.surface_value)
+        self.loadFinished.emit(self.volume_data, self.series_index, surface)
@@ -0,0 +1,284 @@
+import os
+import time
+import sqlite3
+import argparse
+import pydicom
+import numpy as np
+from pydicom.errors import InvalidDicomError
+from series_index import SeriesIndex, HEADER_TAGS, slice_positions, volume_dtype, check_positions
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.expanduser("~"), ".cache", "dental3d", "catalog.sqlite")
+
+CATALOG_TAGS = HEADER_TAGS + [
+    'PatientID', 'PatientName', 'PatientBirthDate', 'StudyInstanceUID', 'StudyDate', 'StudyDescription',
+    'AccessionNumber', 'Modality', 'SeriesDescription', 'SeriesNumber', 'SOPInstanceUID',
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    patient_id TEXT PRIMARY KEY,
+    patient_name TEXT COLLATE NOCASE,
+    birth_date TEXT
+);
+CREATE TABLE IF NOT EXISTS studies (
+    study_uid TEXT PRIMARY KEY,
+    patient_id TEXT,
+    study_date TEXT,
+    study_description TEXT COLLATE NOCASE,
+    accession_number TEXT
+);
+CREATE TABLE IF NOT EXISTS series (
+    series_uid TEXT PRIMARY KEY,
+    study_uid TEXT,
+    modality TEXT,
+    series_number INTEGER,
+    series_description TEXT COLLATE NOCASE,
+    rows INTEGER,
+    cols INTEGER,
+    dtype TEXT,
+    pixel_spacing_row REAL,
+    pixel_spacing_col REAL,
+    slice_thickness REAL,
+    rescale_slope REAL,
+    rescale_intercept REAL,
+    transfer_syntax TEXT
+);
+CREATE TABLE IF NOT EXISTS instances (
+    file_path TEXT PRIMARY KEY,
+    series_uid TEXT,
+    sop_uid TEXT,
+    instance_number INTEGER,
+    position REAL,
+    origin_x REAL,
+    origin_y REAL,
+    origin_z REAL,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS patients_name ON patients (patient_name);
+CREATE INDEX IF NOT EXISTS studies_patient ON studies (patient_id);
+CREATE INDEX IF NOT EXISTS studies_date ON studies (study_date);
+CREATE INDEX IF NOT EXISTS series_study ON series (study_uid);
+CREATE INDEX IF NOT EXISTS series_modality ON series (modality);
+CREATE INDEX IF NOT EXISTS instances_series ON instances (series_uid, position);
+"""
+
+SEARCH_SQL = """
+SELECT p.patient_id, p.patient_name, st.study_uid, st.study_date, st.study_description,
+       se.series_uid, se.modality, se.series_description,
+       (SELECT COUNT(*) FROM instances i WHERE i.series_uid = se.series_uid) AS instances
+FROM series se
+JOIN studies st ON st.study_uid = se.study_uid
+JOIN patients p ON p.patient_id = st.patient_id
+"""
+
+
+def walk_files(root_path):
+    # os.scandir hands back stat results with the directory entries, saving a syscall per file
+    stack = [root_path]
+    while stack:
+        directory_path = stack.pop()
+        try:
+            entries = list(os.scandir(directory_path))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file() and entry.name.upper() != 'DICOMDIR':
+                # DICOMDIR files only point at images that the walk reaches anyway
+                stat = entry.stat()
+                yield os.path.abspath(entry.path), stat.st_size, stat.st_mtime_ns
+
+
+class SeriesCatalog:
+    def __init__(self, catalog_path=None):
+        self.catalog_path = catalog_path or os.environ.get('DENTAL_CATALOG', DEFAULT_CATALOG_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.catalog_path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.catalog_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def scan(self, root_path, batch_size=1000):
+        # Index every DICOM file under root_path from headers only. Files whose size and mtime
+        # match the catalog are skipped, and files that have disappeared are dropped.
+        start_time = time.perf_counter()
+        root_path = os.path.abspath(root_path)
+        known = {row['file_path']: (row['size'], row['mtime_ns']) for row in self.connection.execute(
+            "SELECT file_path, size, mtime_ns FROM instances WHERE file_path >= ? AND file_path < ?",
+            (root_path + os.sep, root_path + chr(ord(os.sep) + 1)))}
+
+        seen = set()
+        pending = []
+        indexed = 0
+        for file_path, size, mtime_ns in walk_files(root_path):
+            seen.add(file_path)
+            if known.get(file_path) == (size, mtime_ns):
+                continue
+            try:
+                header = pydicom.dcmread(file_path, stop_before_pixels=True, specific_tags=CATALOG_TAGS)
+            except (InvalidDicomError, OSError):
+                continue
+            if 'Rows' not in header or 'SeriesInstanceUID' not in header:
+                continue
+            pending.append((file_path, size, mtime_ns, header))
+            if len(pending) >= batch_size:
+                indexed += self._store(pending)
+                pending = []
+        indexed += self._store(pending)
+
+        removed = [(file_path,) for file_path in known if file_path not in seen]
+        with self.connection:
+            self.connection.executemany("DELETE FROM instances WHERE file_path = ?", removed)
+            self._prune()
+
+        print(f"Catalog scan of {root_path}: {indexed} indexed, {len(seen) - indexed} unchanged or skipped, "
+              f"{len(removed)} removed in {time.perf_counter() - start_time:.2f}s")
+        return indexed
+
+    def _store(self, pending):
+        patients, studies, series, instances = {}, {}, {}, []
+        for file_path, size, mtime_ns, header in pending:
+            patient_id = str(header.get('PatientID', ''))
+            study_uid = str(header.get('StudyInstanceUID', ''))
+            series_uid = str(header.SeriesInstanceUID)
+            pixel_spacing = [float(v) for v in header.get('PixelSpacing', (1.0, 1.0))]
+            origin = [float(v) for v in header.get('ImagePositionPatient', (0.0, 0.0, 0.0))]
+
+            patients[patient_id] = (patient_id, str(header.get('PatientName', '')),
+                                    str(header.get('PatientBirthDate', '')))
+            studies[study_uid] = (study_uid, patient_id, str(header.get('StudyDate', '')),
+                                  str(header.get('StudyDescription', '')), str(header.get('AccessionNumber', '')))
+            series[series_uid] = (series_uid, study_uid, str(header.get('Modality', '')),
+                                  int(header.get('SeriesNumber', 0) or 0), str(header.get('SeriesDescription', '')),
+                                  int(header.Rows), int(header.Columns), np.dtype(volume_dtype(header)).name,
+                                  pixel_spacing[0], pixel_spacing[1],
+                                  float(header.get('SliceThickness', 1.0) or 1.0),
+                                  float(header.get('RescaleSlope', 1.0)), float(header.get('RescaleIntercept', 0.0)),
+                                  str(header.file_meta.TransferSyntaxUID))
+            position = slice_positions([header])[0]
+            instances.append((file_path, series_uid, str(header.get('SOPInstanceUID', '')),
+                              int(header.get('InstanceNumber', 0) or 0), position,
+                              origin[0], origin[1], origin[2], size, mtime_ns))
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO patients VALUES (?, ?, ?)", patients.values())
+            self.connection.executemany("INSERT OR REPLACE INTO studies VALUES (?, ?, ?, ?, ?)", studies.values())
+            self.connection.executemany("INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        series.values())
+            self.connection.executemany("INSERT OR REPLACE INTO instances VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        instances)
+        return len(instances)
+
+    def _prune(self):
+        self.connection.execute("DELETE FROM series WHERE series_uid NOT IN (SELECT DISTINCT series_uid FROM instances)")
+        self.connection.execute("DELETE FROM studies WHERE study_uid NOT IN (SELECT DISTINCT study_uid FROM series)")
+        self.connection.execute("DELETE FROM patients WHERE patient_id NOT IN (SELECT DISTINCT patient_id FROM studies)")
+
+    def search(self, patient=None, patient_id=None, study_date=None, modality=None, description=None, limit=200):
+        # Prefix matches on indexed columns, so searches stay fast on large archives
+        clauses, params = [], []
+        if patient:
+            clauses.append("p.patient_name LIKE ?")
+            params.append(patient + '%')
+        if patient_id:
+            clauses.append("p.patient_id = ?")
+            params.append(patient_id)
+        if study_date:
+            clauses.append("st.study_date LIKE ?")
+            params.append(study_date + '%')
+        if modality:
+            clauses.append("se.modality = ?")
+            params.append(modality)
+        if description:
+            clauses.append("se.series_description LIKE ?")
+            params.append(description + '%')
+
+        sql = SEARCH_SQL
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY st.study_date DESC, se.series_number LIMIT ?"
+        return [dict(row) for row in self.connection.execute(sql, params + [limit])]
+
+    def series_index(self, series_uid):
+        # Rebuild the series index from catalog rows alone: no folder listing, no header parsing
+        series = self.connection.execute("SELECT * FROM series WHERE series_uid = ?", (series_uid,)).fetchone()
+        if series is None:
+            raise KeyError(f"Series {series_uid} is not in the catalog")
+        instances = self.connection.execute(
+            "SELECT * FROM instances WHERE series_uid = ? ORDER BY position, instance_number, file_path",
+            (series_uid,)).fetchall()
+
+        # The same instance copied into two folders is loaded once
+        seen, unique = set(), []
+        for row in instances:
+            if row['sop_uid'] and row['sop_uid'] in seen:
+                continue
+            seen.add(row['sop_uid'])
+            unique.append(row)
+        instances = unique
+
+        positions = [row['position'] for row in instances]
+        file_paths = [row['file_path'] for row in instances]
+        slice_spacing = series['slice_thickness']
+        if len(positions) > 1 and None not in positions:
+            check_positions(positions, file_paths)
+            slice_spacing = float(np.median(np.diff(positions)))
+
+        return SeriesIndex.from_metadata({
+            'file_paths': file_paths,
+            'series_instance_uid': series_uid,
+            'transfer_syntax': series['transfer_syntax'],
+            'rows': series['rows'],
+            'cols': series['cols'],
+            'dtype': series['dtype'],
+            'pixel_spacing': (series['pixel_spacing_row'], series['pixel_spacing_col']),
+            'slice_thickness': series['slice_thickness'],
+            'rescale_slope': series['rescale_slope'],
+            'rescale_intercept': series['rescale_intercept'],
+            'origin': (instances[0]['origin_x'], instances[0]['origin_y'], instances[0]['origin_z']),
+            'instance_numbers': [row['instance_number'] for row in instances],
+            'slice_positions': positions,
+            'slice_spacing': slice_spacing,
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index DICOM archives into a local SQLite catalog and search it")
+    parser.add_argument('--catalog', default=None, help=f"catalog file (default: {DEFAULT_CATALOG_PATH})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scan_parser = subparsers.add_parser('scan', help="index or refresh a folder tree")
+    scan_parser.add_argument('root')
+
+    search_parser = subparsers.add_parser('search', help="find series")
+    search_parser.add_argument('--patient', help="patient name prefix")
+    search_parser.add_argument('--patient-id')
+    search_parser.add_argument('--date', help="study date prefix, e.g. 2024 or 202403")
+    search_parser.add_argument('--modality')
+    search_parser.add_argument('--description', help="series description prefix")
+    args = parser.parse_args()
+
+    catalog = SeriesCatalog(args.catalog)
+    if args.command == 'scan':
+        catalog.scan(args.root)
+    else:
+        start_time = time.perf_counter()
+        results = catalog.search(patient=args.patient, patient_id=args.patient_id, study_date=args.date,
+                                 modality=args.modality, description=args.description)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        for row in results:
+            print(f"{row['patient_name']} ({row['patient_id']})  {row['study_date']}  {row['modality']}  "
+                  f"{row['series_description']}  {row['instances']} images  {row['series_uid']}")
+        print(f"{len(results)} series in {elapsed_ms:.1f} ms")
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
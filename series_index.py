@@ -0,0 +1,150 @@
+import os
+import time
+import pydicom
+import numpy as np
+from pydicom.errors import InvalidDicomError
+
+HEADER_TAGS = [
+    'SeriesInstanceUID', 'InstanceNumber', 'ImagePositionPatient', 'ImageOrientationPatient',
+    'PixelSpacing', 'SliceThickness', 'RescaleSlope', 'RescaleIntercept',
+    'Rows', 'Columns', 'BitsAllocated', 'PixelRepresentation',
+]
+
+
+class SeriesIndex:
+    def __init__(self, file_paths, headers):
+        first = headers[0]
+        self.file_paths = file_paths
+        self.series_instance_uid = str(first.get('SeriesInstanceUID', ''))
+        self.transfer_syntax = str(first.file_meta.TransferSyntaxUID)
+        self.rows, self.cols = int(first.Rows), int(first.Columns)
+        self.dtype = volume_dtype(first)
+        self.pixel_spacing = tuple(float(v) for v in first.get('PixelSpacing', (1.0, 1.0)))
+        self.slice_thickness = float(first.get('SliceThickness', 1.0) or 1.0)
+        self.rescale_slope = float(first.get('RescaleSlope', 1.0))
+        self.rescale_intercept = float(first.get('RescaleIntercept', 0.0))
+        self.origin = tuple(float(v) for v in first.get('ImagePositionPatient', (0.0, 0.0, 0.0)))
+        self.instance_numbers = [int(h.get('InstanceNumber', 0) or 0) for h in headers]
+        self.slice_positions = slice_positions(headers)
+        self.cache_prefix = None
+        self.slice_spacing = self.slice_thickness
+        if len(self.slice_positions) > 1 and self.slice_positions[0] is not None:
+            self.slice_spacing = float(np.median(np.diff(self.slice_positions)))
+
+    def metadata(self):
+        metadata = dict(self.__dict__)
+        metadata.pop('cache_prefix', None)
+        metadata['dtype'] = np.dtype(self.dtype).name
+        return metadata
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        series_index = cls.__new__(cls)
+        series_index.__dict__.update(metadata)
+        series_index.cache_prefix = None
+        series_index.dtype = np.dtype(metadata['dtype']).type
+        series_index.pixel_spacing = tuple(metadata['pixel_spacing'])
+        series_index.origin = tuple(metadata['origin'])
+        return series_index
+
+    @property
+    def shape(self):
+        return (len(self.file_paths), self.rows, self.cols)
+
+    @property
+    def spacing(self):
+        # x, y, z spacing in the order VTK expects
+        return (self.pixel_spacing[1], self.pixel_spacing[0], self.slice_spacing)
+
+    def __len__(self):
+        return len(self.file_paths)
+
+
+def volume_dtype(header):
+    bits_allocated = int(header.get('BitsAllocated', 16))
+    signed = int(header.get('PixelRepresentation', 0)) == 1
+    if bits_allocated == 8:
+        return np.int8 if signed else np.uint8
+    if bits_allocated == 32:
+        return np.int32 if signed else np.uint32
+    return np.int16 if signed else np.uint16
+
+
+def slice_positions(headers):
+    # Distance of each slice along the slice normal, or None when the series carries no geometry
+    if any('ImagePositionPatient' not in h for h in headers):
+        return [None] * len(headers)
+
+    orientation = headers[0].get('ImageOrientationPatient', [1, 0, 0, 0, 1, 0])
+    normal = np.cross(np.array(orientation[:3], dtype=float), np.array(orientation[3:], dtype=float))
+    return [float(np.dot(normal, np.array(h.ImagePositionPatient, dtype=float))) for h in headers]
+
+
+def list_series_files(directory_path):
+    file_paths = []
+    for filename in sorted(os.listdir(directory_path)):
+        file_path = os.path.join(directory_path, filename)
+        if not filename.startswith('.') and os.path.isfile(file_path):
+            file_paths.append(file_path)
+    return file_paths
+
+
+def read_headers(directory_path):
+    headers = []
+    for file_path in list_series_files(directory_path):
+        try:
+            header = pydicom.dcmread(file_path, stop_before_pixels=True, specific_tags=HEADER_TAGS)
+        except (InvalidDicomError, OSError):
+            continue
+        if 'Rows' in header:
+            headers.append((file_path, header))
+    return headers
+
+
+def check_positions(positions, file_paths, tolerance=1e-3):
+    steps = np.diff(positions)
+    duplicates = np.flatnonzero(np.abs(steps) < tolerance)
+    if duplicates.size:
+        i = duplicates[0]
+        raise ValueError(f"Duplicate slice position {positions[i]:.3f} in "
+                         f"{os.path.basename(file_paths[i])} and {os.path.basename(file_paths[i + 1])}")
+
+    median_step = float(np.median(steps))
+    gaps = np.flatnonzero(steps > 1.5 * median_step)
+    if gaps.size:
+        i = gaps[0]
+        missing = int(round(steps[i] / median_step)) - 1
+        raise ValueError(f"{missing} slice(s) missing between positions {positions[i]:.3f} "
+                         f"and {positions[i + 1]:.3f} (expected spacing {median_step:.3f})")
+
+
+def build_series_index(directory_path):
+    start_time = time.perf_counter()
+    headers = read_headers(directory_path)
+    if not headers:
+        raise ValueError(f"No DICOM images found in {directory_path}")
+
+    # Keep the largest series when the folder holds more than one
+    series = {}
+    for file_path, header in headers:
+        series.setdefault(str(header.get('SeriesInstanceUID', '')), []).append((file_path, header))
+    entries = max(series.values(), key=len)
+    if len(series) > 1:
+        print(f"Found {len(series)} series in {directory_path}, using the largest ({len(entries)} images)")
+
+    # Order by position along the slice normal, falling back to InstanceNumber, then filename
+    positions = slice_positions([header for _, header in entries])
+    if positions[0] is None and all('InstanceNumber' in header for _, header in entries):
+        positions = [float(header.InstanceNumber) for _, header in entries]
+    if positions[0] is not None:
+        order = np.argsort(positions, kind='stable')
+        entries = [entries[i] for i in order]
+        positions = [positions[i] for i in order]
+
+    file_paths = [file_path for file_path, _ in entries]
+    if positions[0] is not None and len(entries) > 1:
+        check_positions(positions, file_paths)
+
+    series_index = SeriesIndex(file_paths, [header for _, header in entries])
+    print(f"Indexed {len(series_index)} headers in {time.perf_counter() - start_time:.2f}s")
+    return series_index
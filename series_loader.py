@@ -0,0 +1,236 @@
+import os
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+import pydicom
+import numpy as np
+from pydicom.uid import UID
+from series_index import build_series_index
+from volume_cache import VolumeCache, series_key, files_key
+from volume_store import allocate_volume, memory_stage
+
+# Per-process view of the shared staging slots, set up once by the pool initializer
+_staging = None
+
+
+def is_compressed(transfer_syntax):
+    return UID(transfer_syntax).is_compressed
+
+
+def decode_slice(file_path):
+    return pydicom.dcmread(file_path).pixel_array
+
+
+def _decode_into(volume_data, index, file_path):
+    volume_data[index, :, :] = decode_slice(file_path)
+
+
+def _attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block again; pool workers share the
+        # parent's resource tracker, so the duplicate entry is dropped when the parent unlinks it
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_staging(name, shape, dtype):
+    global _staging
+    shm = _attach_shared_memory(name)
+    _staging = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def _decode_into_staging(slot, file_path):
+    _staging[1][slot] = decode_slice(file_path)
+    return slot
+
+
+def _decode_with_processes(file_paths, volume_data, workers, indices, on_slice, is_cancelled):
+    # Compressed syntaxes hold the GIL while decoding, so they go to a process pool. Workers write
+    # into a small ring of shared-memory slots and only the slot number is sent back.
+    slot_count = workers * 2
+    slot_shape = (slot_count,) + volume_data.shape[1:]
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(slot_shape)) * volume_data.dtype.itemsize)
+    staging = np.ndarray(slot_shape, dtype=volume_data.dtype, buffer=shm.buf)
+    decoded = 0
+
+    try:
+        # Spawned rather than forked: the progressive loader calls this from a QThread, and a fork taken while
+        # VTK's or Qt's threads hold locks can deadlock the workers
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_staging,
+                                 initargs=(shm.name, slot_shape, volume_data.dtype)) as executor:
+            pending_indices = iter(indices)
+            running = {}
+            for slot in range(slot_count):
+                i = next(pending_indices, None)
+                if i is None:
+                    break
+                running[executor.submit(_decode_into_staging, slot, file_paths[i])] = i
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    slot = future.result()
+                    volume_data[i, :, :] = staging[slot]
+                    decoded += 1
+                    if on_slice:
+                        on_slice(i)
+
+                    next_index = None if is_cancelled and is_cancelled() else next(pending_indices, None)
+                    if next_index is not None:
+                        running[executor.submit(_decode_into_staging, slot, file_paths[next_index])] = next_index
+    finally:
+        del staging
+        shm.close()
+        shm.unlink()
+
+    return decoded
+
+
+def decode_slices(file_paths, volume_data, workers=None, use_processes=False, indices=None, on_slice=None,
+                  is_cancelled=None):
+    # Decode files into their own slots of the preallocated volume, in the order given by indices.
+    # Threads write straight into volume_data; processes return slices through shared memory.
+    # on_slice(index) runs as each slice lands; is_cancelled() is polled to stop early.
+    workers = workers or os.cpu_count() or 1
+    indices = range(len(file_paths)) if indices is None else indices
+    start_time = time.perf_counter()
+    decoded = 0
+
+    if workers == 1:
+        for i in indices:
+            if is_cancelled and is_cancelled():
+                break
+            _decode_into(volume_data, i, file_paths[i])
+            decoded += 1
+            if on_slice:
+                on_slice(i)
+    elif use_processes:
+        decoded = _decode_with_processes(file_paths, volume_data, workers, indices, on_slice, is_cancelled)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_decode_into, volume_data, i, file_paths[i]): i for i in indices}
+            for future in as_completed(futures):
+                if is_cancelled and is_cancelled():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                future.result()
+                decoded += 1
+                if on_slice:
+                    on_slice(futures[future])
+
+    elapsed = time.perf_counter() - start_time
+    megabytes = decoded * volume_data[0].nbytes / (1024 * 1024)
+    stats = {
+        'slices': decoded,
+        'workers': workers,
+        'seconds': elapsed,
+        'slices_per_second': decoded / elapsed if elapsed > 0 else float('inf'),
+        'mb_per_second': megabytes / elapsed if elapsed > 0 else float('inf'),
+    }
+    return stats
+
+
+def decode_summary(stats, use_processes):
+    kind = 'processes' if use_processes else 'threads'
+    return (f"Decoded {stats['slices']} slices with {stats['workers']} {kind} in {stats['seconds']:.2f}s "
+            f"({stats['slices_per_second']:.1f} slices/s, {stats['mb_per_second']:.1f} MB/s)")
+
+
+def open_cached_series(directory_path, dtype=None, series_index=None):
+    # Returns the cache, the series key and the cached (volume, index) pair or None on a miss.
+    # With a prebuilt series index the key comes from its files, without listing the folder.
+    volume_cache = VolumeCache()
+    if series_index is not None:
+        key = files_key(series_index.file_paths, series_index.series_instance_uid, dtype)
+    else:
+        key = series_key(directory_path, dtype)
+
+    cached = volume_cache.get(key)
+    if cached is not None:
+        volume_data, cached_index = cached
+        if series_index is not None:
+            cached = volume_data, series_index
+        else:
+            # The key ignores the folder location, so point the index at where the files are now
+            cached_index.file_paths = [os.path.join(directory_path, os.path.basename(p))
+                                       for p in cached_index.file_paths]
+        cached[1].cache_prefix = volume_cache.prefix(key)
+    return volume_cache, key, cached
+
+
+def allocate_series_volume(series_index, dtype=None, volume_cache=None, key=None, out_of_core=None):
+    # Returns the volume and whether it lives in the cache and still needs commit()
+    dtype = dtype or series_index.dtype
+    nbytes = int(np.prod(series_index.shape)) * np.dtype(dtype).itemsize
+    if volume_cache is not None and volume_cache.fits(nbytes):
+        return volume_cache.allocate(key, series_index.shape, dtype), True
+    return allocate_volume(series_index.shape, dtype, out_of_core=out_of_core), False
+
+
+def load_series(directory_path, dtype=None, workers=None, use_processes=None, use_cache=True, out_of_core=None,
+                series_index=None):
+    # Pass series_index (e.g. from the catalog) to skip listing the folder and reading headers
+    volume_cache = key = None
+    if use_cache:
+        volume_cache, key, cached = open_cached_series(directory_path, dtype, series_index)
+        if cached is not None:
+            return cached
+
+    # Order and size the series from headers alone, then decode pixels in any order
+    if series_index is None:
+        with memory_stage('index'):
+            series_index = build_series_index(directory_path)
+
+    volume_data, cache_backed = allocate_series_volume(series_index, dtype, volume_cache, key, out_of_core)
+    if use_processes is None:
+        use_processes = is_compressed(series_index.transfer_syntax)
+
+    try:
+        with memory_stage('decode'):
+            stats = decode_slices(series_index.file_paths, volume_data, workers=workers, use_processes=use_processes)
+    except BaseException:
+        if cache_backed:
+            volume_cache.discard(volume_data)
+        raise
+
+    if cache_backed:
+        volume_cache.commit(key, volume_data, series_index)
+
+    print(decode_summary(stats, use_processes))
+    return volume_data, series_index
+
+
+def main():
+    # Benchmark decode throughput against the serial path for increasing worker counts:
+    #   python series_loader.py <dicom directory> [max workers] [--processes | --threads]
+    # Without a flag, compressed transfer syntaxes use processes and uncompressed ones threads.
+    directory_path = sys.argv[1]
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else (os.cpu_count() or 1)
+
+    series_index = build_series_index(directory_path)
+    volume_data = allocate_volume(series_index.shape, series_index.dtype)
+
+    use_processes = is_compressed(series_index.transfer_syntax)
+    if '--processes' in sys.argv or '--threads' in sys.argv:
+        use_processes = '--processes' in sys.argv
+    print(f"Transfer syntax {series_index.transfer_syntax} ({UID(series_index.transfer_syntax).name}), "
+          f"{'compressed' if is_compressed(series_index.transfer_syntax) else 'uncompressed'}")
+
+    baseline = None
+    workers = 1
+    while workers <= max_workers:
+        stats = decode_slices(series_index.file_paths, volume_data, workers=workers, use_processes=use_processes)
+        print(decode_summary(stats, use_processes))
+        baseline = baseline or stats['seconds']
+        print(f"  {workers} workers: {baseline / stats['seconds']:.2f}x speedup over the serial path")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
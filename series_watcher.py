@@ -0,0 +1,205 @@
+import os
+import bisect
+import threading
+import pydicom
+import numpy as np
+from pydicom.errors import InvalidDicomError
+from PyQt5.QtCore import QObject, QThread, QFileSystemWatcher, QTimer, pyqtSignal
+from series_index import list_series_files, slice_positions, volume_dtype
+from surface_extraction import ChunkedSurface
+
+
+class GrowingSeries:
+    # A volume that grows as slices land in the folder. Only files not seen before are decoded;
+    # slices stay ordered by position, and storage grows by doubling like a list.
+    # After snapshot() the rows handed out are never rewritten: appends land past them and an
+    # out-of-order slice moves the volume to a new buffer first.
+    def __init__(self, directory_path, initial_capacity=64):
+        self.directory_path = directory_path
+        self.initial_capacity = initial_capacity
+        self.file_paths = []
+        self.positions = []
+        self.seen = set()
+        self.buffer = None
+        self.count = 0
+        self.series_instance_uid = None
+        self.pixel_spacing = (1.0, 1.0)
+        self.slice_thickness = 1.0
+        self.origin = (0.0, 0.0, 0.0)
+        self.shared = False
+
+    @property
+    def volume_data(self):
+        return self.buffer[:self.count] if self.buffer is not None else None
+
+    @property
+    def spacing(self):
+        slice_spacing = self.slice_thickness
+        if self.count > 1:
+            slice_spacing = float(np.median(np.diff(self.positions)))
+        return (self.pixel_spacing[1], self.pixel_spacing[0], slice_spacing)
+
+    def __len__(self):
+        return self.count
+
+    def _readSlice(self, file_path):
+        # Files still being written fail to parse; they are left unseen and retried on the next scan
+        try:
+            ds = pydicom.dcmread(file_path)
+            return ds, ds.pixel_array
+        except (InvalidDicomError, EOFError, OSError, ValueError, AttributeError):
+            return None, None
+
+    def _start(self, ds):
+        self.series_instance_uid = str(ds.get('SeriesInstanceUID', ''))
+        self.pixel_spacing = tuple(float(v) for v in ds.get('PixelSpacing', (1.0, 1.0)))
+        self.slice_thickness = float(ds.get('SliceThickness', 1.0) or 1.0)
+        self.buffer = np.zeros((self.initial_capacity, int(ds.Rows), int(ds.Columns)), dtype=volume_dtype(ds))
+
+    def _grow(self, capacity=None):
+        grown = np.zeros((capacity or len(self.buffer) * 2,) + self.buffer.shape[1:], dtype=self.buffer.dtype)
+        grown[:self.count] = self.buffer[:self.count]
+        self.buffer = grown
+        self.shared = False
+
+    def snapshot(self):
+        # (volume, file paths, spacing, origin) as of now, safe to read while later slices are added
+        self.shared = True
+        return self.volume_data, list(self.file_paths), self.spacing, self.origin
+
+    def _position(self, ds):
+        position = slice_positions([ds])[0]
+        if position is None:
+            position = float(ds.get('InstanceNumber', self.count))
+        return position
+
+    def add(self, file_path):
+        # Decode one file into the volume; returns its slice index, or None if it was skipped
+        if file_path in self.seen:
+            return None
+        ds, pixel_array = self._readSlice(file_path)
+        if ds is None:
+            return None
+        self.seen.add(file_path)
+
+        if self.buffer is None:
+            self._start(ds)
+        elif str(ds.get('SeriesInstanceUID', '')) != self.series_instance_uid:
+            return None
+
+        position = self._position(ds)
+        index = bisect.bisect_left(self.positions, position)
+        if index < self.count and abs(self.positions[index] - position) < 1e-3:
+            print(f"Skipping {os.path.basename(file_path)}: duplicate slice position {position:.3f}")
+            return None
+
+        if self.count == len(self.buffer):
+            self._grow()
+        elif index < self.count and self.shared:
+            self._grow(len(self.buffer))
+        if index < self.count:
+            # Out-of-order arrival: shift the later slices up by one
+            self.buffer[index + 1:self.count + 1] = self.buffer[index:self.count].copy()
+        self.buffer[index] = pixel_array
+        self.positions.insert(index, position)
+        self.file_paths.insert(index, file_path)
+        self.count += 1
+        if index == 0:
+            self.origin = tuple(float(v) for v in ds.get('ImagePositionPatient', (0.0, 0.0, 0.0)))
+        return index
+
+    def scan(self):
+        # Decode new files into the volume; returns the first slice index that changed, or None
+        first_changed = None
+        for file_path in list_series_files(self.directory_path):
+            index = self.add(file_path)
+            if index is not None:
+                first_changed = index if first_changed is None else min(first_changed, index)
+        return first_changed
+
+
+class SeriesScanWorker(QThread):
+    # Scans the folder and re-extracts the touched slabs off the GUI thread. Scan requests arriving while
+    # one runs are coalesced into a single follow-up scan.
+    # scanned(first changed index, volume, file paths, spacing, origin, surface or None)
+    scanned = pyqtSignal(int, object, object, object, object, object)
+
+    def __init__(self, directory_path, surface_value=None, parent=None):
+        super().__init__(parent)
+        self.series = GrowingSeries(directory_path)
+        self.chunked_surface = ChunkedSurface(surface_value) if surface_value is not None else None
+        self.pending = False
+        self._wake = threading.Condition()
+
+    def request(self):
+        with self._wake:
+            self.pending = True
+            self._wake.notify()
+
+    def stop(self):
+        self.requestInterruption()
+        with self._wake:
+            self._wake.notify()
+        self.wait()
+
+    def run(self):
+        while not self.isInterruptionRequested():
+            with self._wake:
+                while not self.pending and not self.isInterruptionRequested():
+                    self._wake.wait()
+                if self.isInterruptionRequested():
+                    break
+                self.pending = False
+
+            first_changed = self.series.scan()
+            if first_changed is None:
+                continue
+            volume_data, file_paths, spacing, origin = self.series.snapshot()
+            surface = None
+            if self.chunked_surface is not None:
+                surface = self.chunked_surface.update(volume_data, spacing, origin, first_changed)
+            self.scanned.emit(first_changed, volume_data, file_paths, spacing, origin, surface)
+
+
+class SeriesWatcher(QObject):
+    # Watches a folder and emits slicesAdded(first changed index, volume, file paths, spacing, origin, surface)
+    # after new slices are decoded. Only the timers live on the GUI thread; scans and surface updates run
+    # in a SeriesScanWorker. surface is None unless a surface_value is given.
+    slicesAdded = pyqtSignal(int, object, object, object, object, object)
+
+    def __init__(self, directory_path, surface_value=None, debounce_ms=250, poll_ms=2000, parent=None):
+        super().__init__(parent)
+        self.worker = SeriesScanWorker(directory_path, surface_value, self)
+        self.worker.scanned.connect(self.slicesAdded)
+        self.series = self.worker.series
+
+        self.file_watcher = QFileSystemWatcher([directory_path], self)
+        self.file_watcher.directoryChanged.connect(self.scheduleScan)
+
+        # Coalesce bursts of file events into one scan
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(debounce_ms)
+        self.debounce_timer.timeout.connect(self.scan)
+
+        # Files that were still being written are picked up by a slow poll once they are complete
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(poll_ms)
+        self.poll_timer.timeout.connect(self.scan)
+
+    def start(self):
+        self.worker.start()
+        self.scan()
+        self.poll_timer.start()
+
+    def stop(self):
+        self.poll_timer.stop()
+        self.debounce_timer.stop()
+        self.file_watcher.removePaths(self.file_watcher.directories())
+        self.worker.stop()
+
+    def scheduleScan(self, path=None):
+        self.debounce_timer.start()
+
+    def scan(self):
+        self.worker.request()
@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from series_loader import decode_slice
+
+
+class SliceCache:
+    # Serves 2D slices from the loaded volume when a slice is there, otherwise from a bounded LRU of
+    # decoded slices. Each request prefetches the next few slices in the direction the user is scrolling.
+    def __init__(self, file_paths, volume_data=None, arrived=None, capacity=64, prefetch=4, workers=2):
+        self.file_paths = file_paths
+        self.volume_data = volume_data
+        self.arrived = arrived
+        self.capacity = capacity
+        self.prefetch = prefetch
+        self.slices = OrderedDict()
+        self.pending = {}
+        self.last_index = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def __len__(self):
+        return len(self.file_paths)
+
+    def inVolume(self, index):
+        return self.volume_data is not None and index < len(self.volume_data) and (
+            self.arrived is None or self.arrived[index])
+
+    def get(self, index):
+        direction = 1 if self.last_index is None or index >= self.last_index else -1
+        self.last_index = index
+
+        if self.inVolume(index):
+            pixel_array = self.volume_data[index]
+        else:
+            pixel_array = self._decoded(index)
+
+        self._prefetch(index, direction)
+        return pixel_array
+
+    def _decoded(self, index):
+        with self._lock:
+            if index in self.slices:
+                self.slices.move_to_end(index)
+                return self.slices[index]
+            future = self.pending.get(index)
+
+        pixel_array = None
+        if future is not None:
+            try:
+                pixel_array = future.result()
+            except Exception:
+                # The failed prefetch is retried here, so any error raised is the one from this read
+                pixel_array = None
+        if pixel_array is None:
+            pixel_array = decode_slice(self.file_paths[index])
+        self._store(index, pixel_array)
+        return pixel_array
+
+    def _store(self, index, pixel_array):
+        with self._lock:
+            self.pending.pop(index, None)
+            self.slices[index] = pixel_array
+            self.slices.move_to_end(index)
+            while len(self.slices) > self.capacity:
+                self.slices.popitem(last=False)
+
+    def _prefetchOne(self, index):
+        try:
+            pixel_array = decode_slice(self.file_paths[index])
+        except BaseException:
+            # Forget the failed prefetch so the slice is scheduled again or read directly when asked for
+            with self._lock:
+                self.pending.pop(index, None)
+            raise
+        self._store(index, pixel_array)
+        return pixel_array
+
+    def _prefetch(self, index, direction):
+        for step in range(1, self.prefetch + 1):
+            neighbour = index + direction * step
+            if not 0 <= neighbour < len(self.file_paths) or self.inVolume(neighbour):
+                continue
+            with self._lock:
+                if neighbour in self.slices or neighbour in self.pending:
+                    continue
+                self.pending[neighbour] = self._executor.submit(self._prefetchOne, neighbour)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
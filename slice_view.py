@@ -0,0 +1,218 @@
+import sys
+import time
+from collections import deque
+import numpy as np
+from matplotlib.colors import Normalize
+from matplotlib.image import AxesImage
+from matplotlib.transforms import IdentityTransform
+
+# One display frame at 60 Hz
+FRAME_BUDGET = 1 / 60
+
+
+class SliceImage(AxesImage):
+    # An AxesImage that samples its own data. Like NonUniformImage it overrides make_image: the nearest data
+    # pixel for every display pixel is cached per axes size and view limits, and the windowed values go
+    # through a packed RGBA table of the colormap. matplotlib's masked normalize and resample pass alone takes
+    # longer than a frame for a 512x512 slice. set_data, set_clim, the colormap and drawing are unchanged.
+    def __init__(self, ax, **kwargs):
+        super().__init__(ax, **kwargs)
+        self._sampling_key = None
+        self._lut_key = None
+
+    def _sampling(self, shape):
+        x0, y0, x1, y1 = (int(round(v)) for v in self.axes.bbox.extents)
+        key = (x0, y0, x1, y1, self.axes.get_xlim(), self.axes.get_ylim(), self.get_extent(), shape)
+        if key == self._sampling_key:
+            return self._rows, self._cols, self._corner
+        (view_left, view_right), (view_bottom, view_top) = key[4], key[5]
+        left, right, bottom, top = key[6]
+        # Data coordinate at the centre of every display pixel, bottom row first as draw_image expects
+        xs = view_left + (np.arange(x1 - x0) + 0.5) * (view_right - view_left) / max(x1 - x0, 1)
+        ys = view_bottom + (np.arange(y1 - y0) + 0.5) * (view_top - view_bottom) / max(y1 - y0, 1)
+        # A centre exactly on a pixel boundary takes the lower pixel, as matplotlib's resampler does
+        cols = np.ceil((xs - left) / (right - left) * shape[1]).astype(np.int64) - 1
+        if self.origin == 'upper':
+            rows = np.ceil((ys - top) / (bottom - top) * shape[0]).astype(np.int64) - 1
+        else:
+            rows = np.ceil((ys - bottom) / (top - bottom) * shape[0]).astype(np.int64) - 1
+        # Only the display pixels the image covers are drawn
+        col_inside = np.flatnonzero((cols >= 0) & (cols < shape[1]))
+        row_inside = np.flatnonzero((rows >= 0) & (rows < shape[0]))
+        self._cols = cols[col_inside[0]:col_inside[-1] + 1] if len(col_inside) else cols[:0]
+        self._rows = rows[row_inside[0]:row_inside[-1] + 1] if len(row_inside) else rows[:0]
+        self._corner = (x0 + (col_inside[0] if len(col_inside) else 0),
+                        y0 + (row_inside[0] if len(row_inside) else 0))
+        self._sampling_key = key
+        return self._rows, self._cols, self._corner
+
+    def _lut(self):
+        # The colormap's 256 colors packed as uint32, so one gather writes whole RGBA pixels
+        if self._lut_key is not self.cmap:
+            self._packed_lut = self.cmap(np.linspace(0.0, 1.0, 256), bytes=True).view(np.uint32).reshape(-1)
+            self._lut_key = self.cmap
+        return self._packed_lut
+
+    def make_image(self, renderer, magnification=1.0, unsampled=False):
+        data = self.get_array()
+        if data is None or data.ndim != 2 or type(self.norm) is not Normalize or np.ma.is_masked(data):
+            return super().make_image(renderer, magnification, unsampled)
+        rows, cols, (left, bottom) = self._sampling(data.shape)
+        if not len(rows) or not len(cols):
+            return None, 0, 0, None
+        self.norm.autoscale_None(data)
+        vmin, vmax = self.norm.vmin, self.norm.vmax
+        scale = 255.0 / (vmax - vmin) if vmax > vmin else 0.0
+        levels = (np.asarray(data)[rows[:, None], cols] - np.float32(vmin)) * np.float32(scale)
+        np.clip(levels, 0, 255, out=levels)
+        pixels = self._lut()[levels.astype(np.uint8)].view(np.uint8)
+        return pixels.reshape(len(rows), len(cols), 4), left, bottom, IdentityTransform()
+
+
+class SliceView:
+    # The 2D slice view on persistent artists. The axes are laid out once per slice shape and the figure
+    # without the changing artists is cached; paging a slice only swaps the image data, title and overlay
+    # offsets, draws those artists over the cached background and blits the result.
+    def __init__(self, figure, canvas, highlights=(), axis_off=True):
+        # highlights: fixed (x, y, label) points drawn as red crosses with a legend
+        self.figure = figure
+        self.canvas = canvas
+        self.highlights = list(highlights)
+        self.axis_off = axis_off
+        self.ax = None
+        self.image = None
+        self.marks = None
+        self.title = None
+        self.legend = None
+        self.legend_pixels = None
+        self.animated = []
+        self.shape = None
+        self.background = None
+        self.frame_times = deque(maxlen=200)
+        self.canvas.mpl_connect('draw_event', self.onDraw)
+
+    def layout(self, shape):
+        # Full rebuild, only when the first slice arrives or the slice shape changes
+        self.figure.clear()
+        self.ax = self.figure.add_subplot(111)
+        # One image for the session; paging only swaps its data and contrast limits
+        self.image = SliceImage(self.ax, cmap='gray', interpolation='nearest', animated=True)
+        self.image.set_data(np.zeros(shape, dtype=np.int16))
+        self.ax.add_image(self.image)
+        # Fits the view to the image as imshow does, so click coordinates are pixel indices
+        self.image.set_extent(self.image.get_extent())
+        self.title = self.ax.set_title(' ', animated=True)
+        highlight_artists = [self.ax.scatter(x, y, s=100, c='red', marker='X', label=label, animated=True)
+                             for x, y, label in self.highlights]
+        self.marks, = self.ax.plot([], [], 'ro', animated=True)
+        # An opaque legend is drawn once per layout and then pasted back as pixels
+        self.legend = self.ax.legend(framealpha=1.0) if self.highlights else None
+        if self.legend is not None:
+            self.legend.set_animated(True)
+        self.legend_pixels = None
+        if self.axis_off:
+            self.ax.set_axis_off()
+        self.animated = [self.image] + highlight_artists + [self.marks, self.title]
+        self.shape = shape
+        self.background = None
+        self.canvas.draw()
+
+    def onDraw(self, event):
+        # Any full draw (first layout, window resize, toolbar zoom or pan) refreshes the cached background
+        if self.ax is None:
+            return
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.legend_pixels = None
+        self._drawAnimated()
+
+    def _drawAnimated(self):
+        for artist in self.animated:
+            self.figure.draw_artist(artist)
+        if self.legend is None:
+            return
+        if self.legend_pixels is None:
+            self.figure.draw_artist(self.legend)
+            self.legend_pixels = self.canvas.copy_from_bbox(self.legend.get_window_extent())
+        else:
+            self.canvas.restore_region(self.legend_pixels)
+
+    def showSlice(self, pixel_array, title, marks=None):
+        start_time = time.perf_counter()
+        if self.ax is None or pixel_array.shape != self.shape:
+            self.layout(pixel_array.shape)
+
+        # Per-slice contrast from the slice's own range, as imshow picks for a new image
+        self.image.set_data(pixel_array)
+        self.image.set_clim(pixel_array.min(), pixel_array.max())
+        self.title.set_text(title)
+        if marks is not None and len(marks):
+            self.marks.set_data(marks[:, 0], marks[:, 1])
+        else:
+            self.marks.set_data([], [])
+
+        if self.background is None:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self._drawAnimated()
+            self.canvas.blit(self.figure.bbox)
+        self.frame_times.append(time.perf_counter() - start_time)
+
+    def frameLatency(self):
+        # (median, 95th percentile) seconds per slice update over the recent frames
+        if not self.frame_times:
+            return 0.0, 0.0
+        times = np.array(self.frame_times)
+        return float(np.median(times)), float(np.percentile(times, 95))
+
+
+def main():
+    # python slice_view.py [slices] [size]: rebuilding the figure per slice against the blitted view
+    from PyQt5.QtWidgets import QApplication
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+
+    slices = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+    app = QApplication.instance() or QApplication(sys.argv)
+    volume_data = np.random.default_rng(0).integers(-1000, 3000, (slices, size, size), dtype=np.int16)
+    marks = np.random.default_rng(1).uniform(0, size, (20, 3))
+    highlights = [(50, 50, 'Missing 1'), (50, 50, 'Missing 3')]
+
+    figure = Figure()
+    canvas = FigureCanvas(figure)
+    canvas.resize(800, 800)
+    canvas.show()
+    app.processEvents()
+    start_time = time.perf_counter()
+    for i in range(slices):
+        figure.clear()
+        ax = figure.add_subplot(111)
+        ax.imshow(volume_data[i], cmap='gray', aspect='auto')
+        ax.set_title(f'DICOM Slice {i + 1}/{slices}')
+        ax.set_axis_off()
+        for x, y, label in highlights:
+            ax.scatter(x, y, s=100, c='red', marker='X', label=label)
+        ax.plot(marks[:, 0], marks[:, 1], 'ro')
+        ax.legend()
+        canvas.draw()
+        canvas.repaint()
+    rebuild = (time.perf_counter() - start_time) / slices
+
+    figure = Figure()
+    canvas = FigureCanvas(figure)
+    canvas.resize(800, 800)
+    canvas.show()
+    app.processEvents()
+    view = SliceView(figure, canvas, highlights)
+    view.showSlice(volume_data[0], 'DICOM Slice 1')
+    view.frame_times.clear()
+    for i in range(slices):
+        view.showSlice(volume_data[i], f'DICOM Slice {i + 1}/{slices}', marks)
+    median, p95 = view.frameLatency()
+    print(f"{slices} slices of {size}x{size}: rebuild {rebuild * 1000:.1f} ms per slice, persistent artists + blit "
+          f"median {median * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms (budget {FRAME_BUDGET * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import threading
+import vtk
+from collections import OrderedDict
+from PyQt5.QtCore import QThread, pyqtSignal
+from surface_extraction import extract_surface
+from mesh_lod import build_lod, INTERACTIVE_TRIANGLES
+from volume_pyramid import INTERACTIVE_VOXELS
+
+DEFAULT_SURFACE_CACHE_BYTES = 512 * 1024 ** 2
+
+
+def surface_bytes(surface):
+    return surface.GetActualMemorySize() * 1024
+
+
+class SurfaceCache:
+    # Bounded LRU of extracted surfaces keyed by (volume, pyramid factor, isovalue), sized by mesh memory
+    def __init__(self, max_bytes=DEFAULT_SURFACE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            surface = self.surfaces.get(key)
+            if surface is not None:
+                self.surfaces.move_to_end(key)
+            return surface
+
+    def put(self, key, surface):
+        with self._lock:
+            if key in self.surfaces:
+                self.total_bytes -= surface_bytes(self.surfaces.pop(key))
+            self.surfaces[key] = surface
+            self.total_bytes += surface_bytes(surface)
+            # The newest surface is always kept, even when it alone is over budget
+            while self.total_bytes > self.max_bytes and len(self.surfaces) > 1:
+                _, evicted = self.surfaces.popitem(last=False)
+                self.total_bytes -= surface_bytes(evicted)
+
+
+class IsosurfaceWorker(QThread):
+    # Extracts isosurfaces off the GUI thread. Only the latest request is kept, so dragging a slider
+    # never queues up stale extractions. surfaceReady(surface, value, factor) carries factor > 1 for previews;
+    # each full-resolution surface is followed by lodReady(interactive surface, value) when it is over budget.
+    surfaceReady = pyqtSignal(object, float, int)
+    lodReady = pyqtSignal(object, float)
+
+    def __init__(self, volume_pyramid, volume_key, surface_cache, lod_triangles=INTERACTIVE_TRIANGLES, parent=None):
+        super().__init__(parent)
+        self.volume_pyramid = volume_pyramid
+        self.volume_key = volume_key
+        self.surface_cache = surface_cache
+        self.lod_triangles = lod_triangles
+        self.roi = None
+        self.preview_factor = max(2, volume_pyramid.factor_for_voxels(INTERACTIVE_VOXELS))
+        self.pending = None
+        self._wake = threading.Condition()
+
+    def cacheKey(self, value, factor):
+        return (self.volume_key, self.roi, factor, float(value))
+
+    def cached(self, value, factor=1):
+        return self.surface_cache.get(self.cacheKey(value, factor))
+
+    def cachedLod(self, value):
+        return self.surface_cache.get(self.cacheKey(value, 'lod'))
+
+    def request(self, value, preview=False):
+        with self._wake:
+            self.pending = (float(value), self.preview_factor if preview else 1, self.roi)
+            self._wake.notify()
+
+    def stop(self):
+        self.requestInterruption()
+        with self._wake:
+            self._wake.notify()
+        self.wait()
+
+    def run(self):
+        while not self.isInterruptionRequested():
+            with self._wake:
+                while self.pending is None and not self.isInterruptionRequested():
+                    self._wake.wait()
+                request, self.pending = self.pending, None
+            if request is None:
+                break
+
+            value, factor, roi = request
+            key = (self.volume_key, roi, factor, value)
+            surface = self.surface_cache.get(key)
+            if surface is None:
+                surface = extract_surface(self.volume_pyramid.vtk_image(factor, roi), value)
+                self.surface_cache.put(key, surface)
+            # The GUI may add arrays to the surface once it is emitted, so the interactive level
+            # is built from a shallow copy taken beforehand
+            lod_input = vtk.vtkPolyData()
+            lod_input.ShallowCopy(surface)
+            self.surfaceReady.emit(surface, value, factor)
+
+            # Skip the interactive level when a newer request is already waiting
+            if factor != 1 or surface.GetNumberOfCells() <= self.lod_triangles or self.pending is not None:
+                continue
+            lod_key = (self.volume_key, roi, 'lod', value)
+            lod_surface = self.surface_cache.get(lod_key)
+            if lod_surface is None:
+                lod_surface = build_lod(lod_input, self.lod_triangles)
+                self.surface_cache.put(lod_key, lod_surface)
+            self.lodReady.emit(lod_surface, value)
@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+import vtk
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from vtk_bridge import volume_to_vtk_image
+
+SURFACE_ENGINES = ('marching-cubes', 'flying-edges', 'sub-volume')
+DEFAULT_ENGINE = os.environ.get('DENTAL_SURFACE_ENGINE', 'flying-edges')
+
+
+def set_surface_threads(threads=None):
+    # Threads used by VTK's SMP backend (flying edges) and by sub-volume extraction; None means one per core.
+    # The pip wheels start on the sequential backend, so switch to the thread pool one when it was built in.
+    if vtk.vtkSMPTools.GetBackend() == 'Sequential':
+        vtk.vtkSMPTools.SetBackend('STDThread')
+    threads = threads or os.cpu_count() or 1
+    vtk.vtkSMPTools.Initialize(threads)
+    return threads
+
+
+def surface_filter(engine=None, threads=None):
+    # An isosurface filter for pipelines; sub-volume extraction has no filter form and uses flying edges
+    engine = engine or DEFAULT_ENGINE
+    if engine not in SURFACE_ENGINES:
+        raise ValueError(f"Unknown surface engine '{engine}', expected one of {SURFACE_ENGINES}")
+    if engine == 'marching-cubes':
+        return vtk.vtkMarchingCubes()
+    set_surface_threads(threads)
+    return vtk.vtkFlyingEdges3D()
+
+
+def _run_filter(vtk_volume, surface_value, engine, threads):
+    isosurface = surface_filter(engine, threads)
+    isosurface.SetInputData(vtk_volume)
+    isosurface.SetValue(0, surface_value)
+    isosurface.Update()
+
+    # Detach the output from the filter so the caller holds only the mesh
+    surface = vtk.vtkPolyData()
+    surface.ShallowCopy(isosurface.GetOutput())
+    return surface
+
+
+def _extract_sub_volumes(vtk_volume, surface_value, threads):
+    # Split along z into slabs that share their boundary slice and extract them concurrently.
+    # The slab meshes meet at the shared slices; their seam vertices are duplicated, not merged.
+    extent = vtk_volume.GetExtent()
+    num_cells = extent[5] - extent[4]
+    slabs = max(1, min(threads, num_cells))
+    bounds = [extent[4] + round(i * num_cells / slabs) for i in range(slabs + 1)]
+
+    def extract_slab(i):
+        clip = vtk.vtkExtractVOI()
+        clip.SetInputData(vtk_volume)
+        clip.SetVOI(extent[0], extent[1], extent[2], extent[3], bounds[i], bounds[i + 1])
+        clip.Update()
+        return _run_filter(clip.GetOutput(), surface_value, 'marching-cubes', 1)
+
+    with ThreadPoolExecutor(max_workers=slabs) as executor:
+        pieces = list(executor.map(extract_slab, range(slabs)))
+
+    append_filter = vtk.vtkAppendPolyData()
+    for piece in pieces:
+        append_filter.AddInputData(piece)
+    append_filter.Update()
+    surface = vtk.vtkPolyData()
+    surface.ShallowCopy(append_filter.GetOutput())
+    return surface
+
+
+def extract_surface(vtk_volume, surface_value, engine=None, threads=None, verbose=True):
+    engine = engine or DEFAULT_ENGINE
+    if engine not in SURFACE_ENGINES:
+        raise ValueError(f"Unknown surface engine '{engine}', expected one of {SURFACE_ENGINES}")
+    threads = set_surface_threads(threads) if engine != 'marching-cubes' else 1
+
+    start_time = time.perf_counter()
+    if engine == 'sub-volume':
+        surface = _extract_sub_volumes(vtk_volume, surface_value, threads)
+    else:
+        surface = _run_filter(vtk_volume, surface_value, engine, threads)
+
+    if verbose:
+        print(f"[{engine}] {surface.GetNumberOfCells()} triangles at {surface_value:g} with {threads} threads "
+              f"in {time.perf_counter() - start_time:.2f}s")
+    return surface
+
+
+class ChunkedSurface:
+    # Surface kept as one piece per slab of slices, so a change only re-extracts the slabs it touches.
+    # Neighbouring slabs share their boundary slice, which keeps the pieces seamless.
+    def __init__(self, surface_value, chunk_slices=16):
+        self.surface_value = surface_value
+        self.chunk_slices = chunk_slices
+        self.pieces = {}
+        self.geometry = None
+        self.append_filter = vtk.vtkAppendPolyData()
+        self.append_filter.AddInputData(vtk.vtkPolyData())
+
+    def output(self):
+        return self.append_filter.GetOutput()
+
+    def update(self, volume_data, spacing, origin, first_slice):
+        # Re-extract every slab from the one touching first_slice to the end of the volume.
+        # Slab c holds the cells between slices c*K and c*K+K; slice s borders cells s-1 and s.
+        num_cells = len(volume_data) - 1
+        chunk_count = -(-num_cells // self.chunk_slices) if num_cells > 0 else 0
+        first_chunk = max(0, (first_slice - 1) // self.chunk_slices)
+        # Pieces are in world coordinates, so a new slice spacing or origin invalidates all of them
+        geometry = (tuple(float(v) for v in spacing), tuple(float(v) for v in origin))
+        if geometry != self.geometry:
+            self.pieces.clear()
+            first_chunk = 0
+            self.geometry = geometry
+
+        for chunk in [c for c in self.pieces if c >= chunk_count]:
+            del self.pieces[chunk]
+
+        for chunk in range(first_chunk, chunk_count):
+            start = chunk * self.chunk_slices
+            stop = min(start + self.chunk_slices, num_cells)
+            slab_origin = (origin[0], origin[1], origin[2] + start * spacing[2])
+            slab = volume_to_vtk_image(volume_data[start:stop + 1], spacing=spacing, origin=slab_origin)
+            self.pieces[chunk] = extract_surface(slab, self.surface_value, verbose=False)
+
+        self.append_filter.RemoveAllInputs()
+        self.append_filter.AddInputData(vtk.vtkPolyData())
+        for chunk in sorted(self.pieces):
+            self.append_filter.AddInputData(self.pieces[chunk])
+        self.append_filter.Update()
+        # A copy of the appended surface, so a surface already handed out is not changed by the next update
+        surface = vtk.vtkPolyData()
+        surface.ShallowCopy(self.output())
+        return surface
+
+
+def phantom(size):
+    # Synthetic jaw-like phantom: a curved band of "bone" with "teeth" on top, in Hounsfield-like units
+    z, y, x = np.mgrid[0:size, 0:size, 0:size].astype(np.float32) / size
+    arch = np.abs(np.hypot(x - 0.5, (y - 0.2) * 1.3) - 0.3)
+    volume_data = np.where((arch < 0.06) & (np.abs(z - 0.4) < 0.12), 1800, -200).astype(np.int16)
+    for angle in np.linspace(0.3, np.pi - 0.3, 12):
+        cx, cy = 0.5 + 0.3 * np.cos(angle), 0.2 + 0.3 * np.sin(angle) / 1.3
+        tooth = (np.hypot(x - cx, y - cy) < 0.035) & (z > 0.5) & (z < 0.7)
+        volume_data[tooth] = 2500
+    return volume_data
+
+
+def main():
+    # python surface_extraction.py [size ...] [--threads N]: compares engines on phantoms
+    args = sys.argv[1:]
+    threads = None
+    if '--threads' in args:
+        threads = int(args[args.index('--threads') + 1])
+        del args[args.index('--threads'):args.index('--threads') + 2]
+    sizes = [int(a) for a in args] or [64, 128, 256]
+
+    set_surface_threads(threads)
+    print(f"VTK SMP backend: {vtk.vtkSMPTools.GetBackend()}")
+    for size in sizes:
+        vtk_volume = volume_to_vtk_image(phantom(size), spacing=(0.3, 0.3, 0.3))
+        print(f"Phantom {size}^3")
+        for engine in SURFACE_ENGINES:
+            extract_surface(vtk_volume, 1500, engine=engine, threads=threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import sys
+import time
+import vtk
+import numpy as np
+from vtk.util import numpy_support
+from vtk_bridge import volume_to_vtk_image
+from surface_extraction import extract_surface, phantom
+
+
+def geometry_time(surface):
+    # Modification time of the points and triangles only, so recoloring a surface keeps its locator
+    return max(surface.GetPoints().GetMTime() if surface.GetPoints() else 0, surface.GetPolys().GetMTime())
+
+
+class SurfaceLocator:
+    # Spatial index over one extracted surface for ray picks, closest-surface-point and radius queries.
+    # Built once per mesh; a re-extracted surface needs a new locator (see for_surface).
+    def __init__(self, surface, verbose=True):
+        start_time = time.perf_counter()
+        self.surface = surface
+        self.cell_locator = vtk.vtkStaticCellLocator()
+        self.cell_locator.SetDataSet(surface)
+        self.cell_locator.BuildLocator()
+        self.point_locator = vtk.vtkStaticPointLocator()
+        self.point_locator.SetDataSet(surface)
+        self.point_locator.BuildLocator()
+        self.build_time = time.perf_counter() - start_time
+        self.geometry_time = geometry_time(surface)
+        self._ids = vtk.vtkIdList()
+        if verbose:
+            print(f"Surface locator over {surface.GetNumberOfCells()} triangles built in {self.build_time:.2f}s")
+
+    def for_surface(self, surface):
+        # This locator if it indexes the given surface, otherwise a new one
+        if surface is self.surface and geometry_time(surface) == self.geometry_time:
+            return self
+        return SurfaceLocator(surface)
+
+    def pick_ray(self, start, end):
+        # First surface hit on the segment start -> end as (point, cell id), or None
+        t = vtk.reference(0.0)
+        sub_id = vtk.reference(0)
+        cell_id = vtk.reference(0)
+        point = [0.0, 0.0, 0.0]
+        pcoords = [0.0, 0.0, 0.0]
+        if not self.cell_locator.IntersectWithLine(start, end, 0.0, t, point, pcoords, sub_id, cell_id):
+            return None
+        return tuple(point), int(cell_id)
+
+    def pick_display(self, renderer, x, y):
+        # Surface hit under display pixel (x, y): the ray runs from the near to the far clipping plane
+        ends = []
+        for depth in (0.0, 1.0):
+            renderer.SetDisplayPoint(x, y, depth)
+            renderer.DisplayToWorld()
+            world = renderer.GetWorldPoint()
+            ends.append([c / world[3] for c in world[:3]])
+        return self.pick_ray(*ends)
+
+    def closest_point(self, position):
+        # Closest point on the surface (not just the closest vertex) as (point, cell id, distance)
+        point = [0.0, 0.0, 0.0]
+        cell_id = vtk.reference(0)
+        sub_id = vtk.reference(0)
+        distance2 = vtk.reference(0.0)
+        self.cell_locator.FindClosestPoint(position, point, cell_id, sub_id, distance2)
+        return tuple(point), int(cell_id), float(distance2) ** 0.5
+
+    def nearest_vertex(self, position):
+        return self.point_locator.FindClosestPoint(position)
+
+    def points_within_radius(self, position, radius):
+        # Ids of the surface vertices within radius of position
+        self.point_locator.FindPointsWithinRadius(radius, position, self._ids)
+        return np.array([self._ids.GetId(i) for i in range(self._ids.GetNumberOfIds())], dtype=np.int64)
+
+
+def voxel_to_world(series_index, column, row, slice_index):
+    # Pixel column/row on a slice to world coordinates; spacing and origin are in VTK (x, y, z) order
+    origin, spacing = series_index.origin, series_index.spacing
+    return (origin[0] + column * spacing[0], origin[1] + row * spacing[1], origin[2] + slice_index * spacing[2])
+
+
+def main():
+    # python surface_locator.py [phantom size] [queries]: locator build and per-query times
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 448
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    surface = extract_surface(volume_to_vtk_image(phantom(size), spacing=(0.3, 0.3, 0.3)), 1500)
+    locator = SurfaceLocator(surface)
+
+    rng = np.random.default_rng(0)
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+    lower, upper = points.min(axis=0), points.max(axis=0)
+    # Query positions within a couple of millimetres of the surface, like detected centroids or clicks
+    positions = points[rng.integers(0, len(points), queries)] + rng.normal(0, 1.0, (queries, 3))
+    # Rays from above the jaw straight down, as a pick from an occlusal view
+    starts = positions.copy()
+    starts[:, 2] = upper[2] + 10
+    ends = starts.copy()
+    ends[:, 2] = lower[2] - 10
+
+    timings = {}
+    start_time = time.perf_counter()
+    hits = sum(locator.pick_ray(s, e) is not None for s, e in zip(starts, ends))
+    timings['ray pick'] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    closest = [locator.closest_point(p) for p in positions]
+    timings['closest surface point'] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    found = sum(len(locator.points_within_radius(p, 1.0)) for p in positions)
+    timings['vertices within 1 mm'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for p in positions[:100]:
+        np.argmin(np.einsum('ij,ij->i', points - p, points - p))
+    brute = (time.perf_counter() - start_time) / 100
+
+    print(f"{surface.GetNumberOfCells()} triangles, locator built in {locator.build_time:.2f}s")
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds / queries * 1e6:.0f} us per query")
+    print(f"{hits}/{queries} rays hit, {found / queries:.0f} vertices per radius query, "
+          f"mean distance to surface {np.mean([c[2] for c in closest]):.2f} mm; "
+          f"brute-force nearest vertex {brute * 1e6:.0f} us per query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+from annotation_store import AnnotationStore, annotation_path
+
+
+def test_save_and_load_round_trip(tmp_path):
+    store = AnnotationStore()
+    kept = store.add('mark', 3, 10.0, 20.0)
+    removed = store.add('mark', 3, 11.0, 21.0)
+    store.add('marker3d', 5, 1.5, 2.5, 3.5)
+    store.add_many('mark', [7, 7], np.array([[1.0, 2.0, 0.0], [3.0, 4.0, 0.0]]))
+    store.remove(removed)
+
+    file_path = str(tmp_path / 'series.npz')
+    store.save(file_path)
+    loaded = AnnotationStore.load(file_path)
+    assert len(loaded) == 4
+    np.testing.assert_array_equal(loaded.points(3)[:, :2], [[10.0, 20.0]])
+    # Removal compacts rows, so order within a slice is not kept
+    np.testing.assert_array_equal(sorted(loaded.points(7)[:, :2].tolist()), [[1.0, 2.0], [3.0, 4.0]])
+    np.testing.assert_array_equal(loaded.positions('marker3d'), [[1.5, 2.5, 3.5]])
+    # Ids keep counting from where the saved store stopped
+    assert loaded.add('mark', 3, 0.0, 0.0) == store.add('mark', 3, 0.0, 0.0)
+    loaded.remove(kept)
+    assert len(loaded.points(3)) == 1
+
+
+def test_missing_file_loads_empty(tmp_path):
+    assert len(AnnotationStore.load(str(tmp_path / 'none.npz'))) == 0
+
+
+def test_annotation_path_names():
+    directory_path = os.environ['DENTAL_ANNOTATIONS']
+    assert annotation_path('1.2.840.1') == os.path.join(directory_path, '1.2.840.1.npz')
+    for unsafe in ('../../etc/x', '..', '1.2/3'):
+        assert os.path.dirname(annotation_path(unsafe)) == directory_path
+    # Series without a UID are told apart by their files
+    first = annotation_path('', ['/a/1.dcm', '/a/2.dcm'])
+    assert first == annotation_path(None, ['/a/2.dcm', '/a/1.dcm'])
+    assert first != annotation_path('', ['/b/1.dcm'])
+    assert os.path.basename(first) != '.npz'
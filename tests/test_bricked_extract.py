@@ -0,0 +1,17 @@
+import pytest
+from bricked_extract import boundary_edges, extract_bricked
+from surface_extraction import extract_surface, phantom
+from vtk_bridge import volume_to_vtk_image
+
+
+@pytest.mark.parametrize('spacing, origin', [((1.0, 1.0, 1.0), (0.0, 0.0, 0.0)),
+                                             ((0.27, 0.31, 0.413), (-101.17, 33.3, -7.77))])
+def test_bricked_matches_whole_volume(spacing, origin):
+    # Bricks overlap by one voxel and are welded, so the mesh is the whole-volume mesh without seams
+    volume_data = phantom(40)
+    bricked = extract_bricked(volume_data, 1500, spacing=spacing, origin=origin, brick_size=16, workers=2)
+    whole = extract_surface(volume_to_vtk_image(volume_data, spacing=spacing, origin=origin), 1500, verbose=False)
+    assert bricked.GetNumberOfCells() == whole.GetNumberOfCells()
+    assert bricked.GetNumberOfPoints() == whole.GetNumberOfPoints()
+    assert boundary_edges(bricked) == boundary_edges(whole)
+    assert bricked.GetBounds() == pytest.approx(whole.GetBounds(), abs=1e-4)
@@ -0,0 +1,52 @@
+import gzip
+import struct
+import pytest
+import vtk
+from mesh_export import export_mesh
+from surface_extraction import extract_surface, phantom
+from vtk_bridge import volume_to_vtk_image
+
+
+@pytest.fixture(scope='module')
+def surface():
+    return extract_surface(volume_to_vtk_image(phantom(32), spacing=(0.3, 0.3, 0.3), origin=(-5.0, 3.0, 1.0)),
+                           1500, verbose=False)
+
+
+def _read(reader_class, file_path):
+    reader = reader_class()
+    reader.SetFileName(file_path)
+    reader.Update()
+    return reader.GetOutput()
+
+
+@pytest.mark.parametrize('extension, reader_class', [('stl', vtk.vtkSTLReader), ('ply', vtk.vtkPLYReader)])
+def test_round_trip(surface, tmp_path, extension, reader_class):
+    file_path = str(tmp_path / f'mesh.{extension}')
+    result = export_mesh(surface, file_path, chunk_triangles=1000, verbose=False)
+    assert result['triangles'] == surface.GetNumberOfCells()
+    assert not (tmp_path / f'mesh.{extension}.part').exists()
+    read_back = _read(reader_class, file_path)
+    assert read_back.GetNumberOfCells() == surface.GetNumberOfCells()
+    assert read_back.GetBounds() == pytest.approx(surface.GetBounds(), abs=1e-4)
+
+
+def test_gzip_matches_plain(surface, tmp_path):
+    export_mesh(surface, str(tmp_path / 'mesh.stl'), verbose=False)
+    export_mesh(surface, str(tmp_path / 'mesh.stl.gz'), verbose=False)
+    with gzip.open(tmp_path / 'mesh.stl.gz', 'rb') as f:
+        assert f.read() == (tmp_path / 'mesh.stl').read_bytes()
+
+
+@pytest.mark.parametrize('quantize', [False, True])
+def test_glb_header(surface, tmp_path, quantize):
+    file_path = tmp_path / 'mesh.glb'
+    export_mesh(surface, str(file_path), quantize=quantize, verbose=False)
+    data = file_path.read_bytes()
+    magic, version, length = struct.unpack('<4sII', data[:12])
+    assert (magic, version, length) == (b'glTF', 2, len(data))
+
+
+def test_quantize_needs_glb(surface, tmp_path):
+    with pytest.raises(ValueError):
+        export_mesh(surface, str(tmp_path / 'mesh.stl'), quantize=True, verbose=False)
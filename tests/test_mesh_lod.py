@@ -0,0 +1,71 @@
+import vtk
+from mesh_lod import InteractionLod
+
+
+def _scene():
+    # Offscreen window with the interactor ui7's QVTK widget wraps, which defaults to a vtkInteractorStyleSwitch
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.SetSize(200, 200)
+    renderer = vtk.vtkRenderer()
+    render_window.AddRenderer(renderer)
+    interactor = vtk.vtkGenericRenderWindowInteractor()
+    interactor.SetRenderWindow(render_window)
+    interactor.Initialize()
+    levels = []
+    for resolution in (64, 8):
+        sphere = vtk.vtkSphereSource()
+        sphere.SetThetaResolution(resolution)
+        sphere.SetPhiResolution(resolution)
+        sphere.Update()
+        levels.append(sphere.GetOutput())
+    mapper = vtk.vtkPolyDataMapper()
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+    renderer.AddActor(actor)
+    lod = InteractionLod(interactor, actor)
+    lod.setLevels(*levels)
+    renderer.ResetCamera()
+    render_window.Render()
+    return interactor, mapper, levels
+
+
+def _drag(interactor, mapper):
+    # Mapper input seen while the left button is held and after it is released
+    interactor.SetEventInformation(100, 100)
+    interactor.LeftButtonPressEvent()
+    interactor.SetEventInformation(120, 100)
+    interactor.MouseMoveEvent()
+    during = mapper.GetInput()
+    interactor.LeftButtonReleaseEvent()
+    return during, mapper.GetInput()
+
+
+def test_style_switch_drag_shows_lod():
+    interactor, mapper, (full, interactive) = _scene()
+    interactor.GetInteractorStyle().SetCurrentStyleToTrackballCamera()
+    assert isinstance(interactor.GetInteractorStyle(), vtk.vtkInteractorStyleSwitch)
+    assert mapper.GetInput() is full
+    during, after = _drag(interactor, mapper)
+    assert during is interactive
+    assert after is full
+
+
+def test_key_switched_style_is_observed():
+    interactor, mapper, (full, interactive) = _scene()
+    interactor.GetInteractorStyle().SetCurrentStyleToTrackballCamera()
+    # 'a' switches the style to trackball actor, as a key press in the widget would
+    interactor.SetKeyEventInformation(0, 0, 'a', 0, 'a')
+    interactor.CharEvent()
+    assert isinstance(interactor.GetInteractorStyle().GetCurrentStyle(), vtk.vtkInteractorStyleTrackballActor)
+    during, after = _drag(interactor, mapper)
+    assert during is interactive
+    assert after is full
+
+
+def test_replaced_style_is_observed():
+    interactor, mapper, (full, interactive) = _scene()
+    interactor.SetInteractorStyle(vtk.vtkInteractorStyleTrackballCamera())
+    during, after = _drag(interactor, mapper)
+    assert during is interactive
+    assert after is full
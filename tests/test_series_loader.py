@@ -0,0 +1,33 @@
+import os
+import numpy as np
+import pytest
+from series_loader import decode_slices, load_series
+
+
+def test_load_orders_slices_by_position(dicom_series):
+    directory_path, expected = dicom_series
+    volume_data, series_index = load_series(directory_path, use_cache=False)
+    assert volume_data.dtype == np.uint16
+    np.testing.assert_array_equal(volume_data, expected)
+    assert series_index.spacing == pytest.approx((0.3, 0.3, 0.5))
+    assert series_index.origin == pytest.approx((-10.0, 20.0, 0.0))
+
+
+def test_thread_and_process_decode_match(dicom_series):
+    directory_path, expected = dicom_series
+    _, series_index = load_series(directory_path, use_cache=False)
+    for use_processes in (False, True):
+        volume_data = np.zeros_like(expected)
+        stats = decode_slices(series_index.file_paths, volume_data, workers=2, use_processes=use_processes)
+        assert stats['slices'] == len(expected)
+        np.testing.assert_array_equal(volume_data, expected)
+
+
+def test_truncated_slice_leaves_no_cache_files(dicom_series):
+    directory_path, _ = dicom_series
+    file_path = os.path.join(directory_path, sorted(os.listdir(directory_path))[3])
+    with open(file_path, 'r+b') as f:
+        f.truncate(os.path.getsize(file_path) - 100)
+    with pytest.raises(Exception):
+        load_series(directory_path, workers=1)
+    assert os.listdir(os.environ['DENTAL_VOLUME_CACHE']) == []
@@ -0,0 +1,42 @@
+import os
+import shutil
+import numpy as np
+from conftest import write_series
+from series_loader import load_series
+
+
+def test_second_load_reopens_cached_volume(dicom_series, tmp_path):
+    directory_path, expected = dicom_series
+    volume_data, series_index = load_series(directory_path)
+    assert series_index.cache_prefix is not None
+    cache_files = sorted(os.listdir(os.environ['DENTAL_VOLUME_CACHE']))
+    assert [os.path.splitext(f)[1] for f in cache_files] == ['.json', '.npy']
+
+    # A copy with the same names, sizes and mtimes is the same entry; the index points at the copy
+    moved_path = str(tmp_path / 'moved')
+    shutil.copytree(directory_path, moved_path)
+    reopened, reopened_index = load_series(moved_path)
+    assert isinstance(reopened, np.memmap)
+    np.testing.assert_array_equal(reopened, expected)
+    assert all(os.path.dirname(p) == moved_path for p in reopened_index.file_paths)
+    assert sorted(os.listdir(os.environ['DENTAL_VOLUME_CACHE'])) == cache_files
+
+
+def test_changed_series_is_decoded_again(dicom_series):
+    directory_path, expected = dicom_series
+    load_series(directory_path)
+    shutil.rmtree(directory_path)
+    write_series(directory_path, expected + 1)
+    volume_data, _ = load_series(directory_path)
+    np.testing.assert_array_equal(volume_data, expected + 1)
+    cache_files = os.listdir(os.environ['DENTAL_VOLUME_CACHE'])
+    assert len([f for f in cache_files if f.endswith('.json')]) == 2
+
+
+def test_cached_volume_edits_do_not_reach_the_file(dicom_series):
+    directory_path, expected = dicom_series
+    load_series(directory_path)
+    reopened, _ = load_series(directory_path)
+    reopened[:] = 0
+    again, _ = load_series(directory_path)
+    np.testing.assert_array_equal(again, expected)
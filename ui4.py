@@ -1,13 +1,17 @@
 import os
-import pydicom
 import vtk
-import numpy as np
+from series_loader import load_series
+from slice_cache import SliceCache
+from vtk_bridge import volume_to_vtk_image
+from surface_extraction import surface_filter
+from volume_store import memory_stage
 from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QFileDialog, QVBoxLayout, QHBoxLayout, QSlider
 from PyQt5.QtCore import Qt
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+from slice_view import SliceView
 
 class DicomRenderer(QWidget):
     def __init__(self):
@@ -32,6 +36,7 @@ class DicomRenderer(QWidget):
         self.figure, self.ax = plt.subplots()
         self.canvas = FigureCanvas(self.figure)
         self.toolbar = NavigationToolbar(self.canvas, self)
+        self.slice_view = SliceView(self.figure, self.canvas)
 
         # Slider for navigating through slices
         self.slice_slider = QSlider(Qt.Horizontal)
@@ -59,33 +64,23 @@ class DicomRenderer(QWidget):
 
         self.dicom_files = []
         self.current_slice = 0
+        self.slice_cache = None
 
     def loadDicomAndRender(self, directory_path):
-        self.dicom_files = [f for f in os.listdir(directory_path) if f.endswith(".dcm")]
-        self.dicom_files.sort(key=lambda x: int(x.split('Slice')[1].split('.dcm')[0]))
+        volume_data, self.series_index = load_series(directory_path)
+        self.dicom_files = [os.path.basename(p) for p in self.series_index.file_paths]
+        # The previous series' prefetch threads are stopped before its cache is dropped
+        if self.slice_cache is not None:
+            self.slice_cache.close()
+        self.slice_cache = SliceCache(self.series_index.file_paths, volume_data)
 
-        first_dcm_file = pydicom.read_file(os.path.join(directory_path, self.dicom_files[0]))
-        rows, cols = first_dcm_file.Rows, first_dcm_file.Columns
+        vtk_volume = volume_to_vtk_image(volume_data, self.series_index)
 
-        volume_data = np.zeros((len(self.dicom_files), rows, cols), dtype=np.uint16)
-
-        for i, filename in enumerate(self.dicom_files):
-            file_path = os.path.join(directory_path, filename)
-            dcm_file = pydicom.read_file(file_path)
-            volume_data[i, :, :] = dcm_file.pixel_array
-
-        vtk_volume = vtk.vtkImageData()
-        vtk_volume.SetDimensions(cols, rows, len(self.dicom_files))
-        vtk_volume.AllocateScalars(vtk.VTK_UNSIGNED_SHORT, 1)
-
-        vtk_np_array_flat = volume_data.ravel()
-        vtk_data_array = vtk.vtkUnsignedShortArray()
-        vtk_data_array.SetArray(vtk_np_array_flat, len(vtk_np_array_flat), 1)
-        vtk_volume.GetPointData().SetScalars(vtk_data_array)
-
-        marching_cubes = vtk.vtkMarchingCubes()
+        marching_cubes = surface_filter()
         marching_cubes.SetInputData(vtk_volume)
         marching_cubes.SetValue(0, 1500)
+        with memory_stage('surface extraction'):
+            marching_cubes.Update()
 
         mapper = vtk.vtkPolyDataMapper()
         mapper.SetInputConnection(marching_cubes.GetOutputPort())
@@ -102,18 +97,11 @@ class DicomRenderer(QWidget):
         self.displayDicomSlice()
 
     def displayDicomSlice(self):
-        self.figure.clear()
-        self.ax = self.figure.add_subplot(111)
-
-        filename = self.dicom_files[self.current_slice]
-        dicom_path = os.path.join(self.directory_path, filename)
-        ds = pydicom.read_file(dicom_path)
-        pixel_array = ds.pixel_array
-        self.ax.imshow(pixel_array, cmap='gray', aspect='auto')
-        self.ax.set_title(f'DICOM Slice {self.current_slice + 1}/{len(self.dicom_files)}')
-        self.ax.set_axis_off()
-
-        self.canvas.draw()
+        # Served from the loaded volume or the decoded-slice cache instead of re-reading the file
+        pixel_array = self.slice_cache.get(self.current_slice)
+        # Only the image, title and marks change; they are redrawn over the cached figure and blitted
+        self.slice_view.showSlice(pixel_array, f'DICOM Slice {self.current_slice + 1}/{len(self.dicom_files)}')
+        self.ax = self.slice_view.ax
 
     def chooseDirectory(self):
         options = QFileDialog.Options()
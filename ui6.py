@@ -1,15 +1,22 @@
 import os
-import pydicom
 import vtk
 import numpy as np
+from series_loader import load_series
+from slice_cache import SliceCache
+from vtk_bridge import volume_to_vtk_image
+from surface_extraction import surface_filter
+from volume_store import memory_stage
+from mesh_coloring import BoxRegion, color_regions
+from marker_layer import MarkerLayer
+from surface_locator import voxel_to_world
+from annotation_store import AnnotationStore, annotation_path
 from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QFileDialog, QVBoxLayout, QHBoxLayout, QSlider, QCheckBox
 from PyQt5.QtCore import Qt
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
-from segmentation_models import Unet
-from keras.models import load_model
+from slice_view import SliceView
 
 class DicomRenderer(QWidget):
     def __init__(self):
@@ -34,6 +41,8 @@ class DicomRenderer(QWidget):
         self.figure, self.ax = plt.subplots()
         self.canvas = FigureCanvas(self.figure)
         self.toolbar = NavigationToolbar(self.canvas, self)
+        # Missing teeth highlighted in red in the 2D view (replace with the actual locations)
+        self.slice_view = SliceView(self.figure, self.canvas, [(50, 50, f"Missing {i}") for i in [1, 3]], axis_off=True)
 
         # Slider for navigating through slices
         self.slice_slider = QSlider(Qt.Horizontal)
@@ -71,16 +80,23 @@ class DicomRenderer(QWidget):
 
         self.dicom_files = []
         self.current_slice = 0
+        self.slice_cache = None
         self.directory_path = ""
-        self.marking_points = []
+        self.annotations = AnnotationStore()
+        self.series_index = None
         self.marking_mode_enabled = False
-        self.yellow_markers_3d = []
+        self.marker_layer = MarkerLayer(self.vtk_renderer, attached=False)
+        self.surface_actor = None
+        self.surface_coloring = None
 
         # Initialize the segmentation model
         self.tooth_segmentation_model = self.initializeSegmentationModel()
 
     def initializeSegmentationModel(self):
-        # Load the segmentation model
+        # Load the segmentation model; imported here so decode worker processes that re-import this script
+        # do not load keras
+        from segmentation_models import Unet
+
         model = Unet('resnet34', classes=1, activation='sigmoid')
 
         # Load the pretrained weights
@@ -99,68 +115,48 @@ class DicomRenderer(QWidget):
         return model
 
     def loadDicomAndRender(self, directory_path):
-        self.dicom_files = [f for f in os.listdir(directory_path) if f.endswith(".dcm")]
-        self.dicom_files.sort(key=lambda x: int(x.split('Slice')[1].split('.dcm')[0]))
-
-        first_dcm_file = pydicom.read_file(os.path.join(directory_path, self.dicom_files[0]))
-        rows, cols = first_dcm_file.Rows, first_dcm_file.Columns
-
-        volume_data = np.zeros((len(self.dicom_files), rows, cols), dtype=np.uint16)
-
-        for i, filename in enumerate(self.dicom_files):
-            file_path = os.path.join(directory_path, filename)
-            dcm_file = pydicom.read_file(file_path)
-            volume_data[i, :, :] = dcm_file.pixel_array
-
-        vtk_volume = vtk.vtkImageData()
-        vtk_volume.SetDimensions(cols, rows, len(self.dicom_files))
-        vtk_volume.AllocateScalars(vtk.VTK_UNSIGNED_SHORT, 1)
-
-        vtk_np_array_flat = volume_data.ravel()
-        vtk_data_array = vtk.vtkUnsignedShortArray()
-        vtk_data_array.SetArray(vtk_np_array_flat, len(vtk_np_array_flat), 1)
-        vtk_volume.GetPointData().SetScalars(vtk_data_array)
-
-        marching_cubes = vtk.vtkMarchingCubes()
+        self.saveAnnotations()
+        volume_data, self.series_index = load_series(directory_path)
+        self.loadAnnotations()
+        self.dicom_files = [os.path.basename(p) for p in self.series_index.file_paths]
+        # The previous series' prefetch threads are stopped before its cache is dropped
+        if self.slice_cache is not None:
+            self.slice_cache.close()
+        self.slice_cache = SliceCache(self.series_index.file_paths, volume_data)
+
+        vtk_volume = volume_to_vtk_image(volume_data, self.series_index)
+
+        marching_cubes = surface_filter()
         marching_cubes.SetInputData(vtk_volume)
         marching_cubes.SetValue(0, 1500)
+        with memory_stage('surface extraction'):
+            marching_cubes.Update()
 
+        # The mapper takes the extracted surface itself, so the colors are not lost if the filter re-executes
+        surface = marching_cubes.GetOutput()
         mapper = vtk.vtkPolyDataMapper()
-        mapper.SetInputConnection(marching_cubes.GetOutputPort())
+        mapper.SetInputData(surface)
 
         actor = vtk.vtkActor()
         actor.SetMapper(mapper)
 
         self.vtk_renderer.AddActor(actor)
+        self.surface_actor = actor
+        # Restored markers are drawn from here on, over the surface
+        self.marker_layer.attach()
         self.vtk_renderer.ResetCamera()
 
         # Color the missing teeth in yellow
         missing_teeth = [1, 3]  # Replace with the actual list of missing teeth indices
+        tooth_location_x = 50  # Replace with the actual X-coordinate
+        tooth_location_y = 50  # Replace with the actual Y-coordinate
 
-        color_array = vtk.vtkUnsignedCharArray()
-        color_array.SetNumberOfComponents(3)
-        color_array.SetName("Colors")
-
-        for i in range(mapper.GetInput().GetNumberOfPoints()):
-            color = [255, 255, 255]  # Default color (white)
-
-            for tooth_idx in missing_teeth:
-                tooth_location_x = 50  # Replace with the actual X-coordinate
-                tooth_location_y = 50  # Replace with the actual Y-coordinate
-
-                # Define a region around the missing tooth to color in yellow
-                region_x_min, region_x_max = tooth_location_x - 5, tooth_location_x + 5
-                region_y_min, region_y_max = tooth_location_y - 5, tooth_location_y + 5
-
-                # Check if the current point is in the region of the missing tooth
-                point = mapper.GetInput().GetPoint(i)
-                if region_x_min <= point[0] <= region_x_max and region_y_min <= point[1] <= region_y_max:
-                    color = [255, 255, 0]  # Yellow color for the missing tooth
-                    break  # Break out of the loop if the point is in the region
-
-            color_array.InsertNextTuple(color)
-
-        mapper.GetInput().GetPointData().SetScalars(color_array)
+        # A region around each missing tooth, classified for all points at once
+        # The box is placed in slice pixels and converted to the surface's world coordinates
+        x0, y0, _ = voxel_to_world(self.series_index, tooth_location_x - 5, tooth_location_y - 5, 0)
+        x1, y1, _ = voxel_to_world(self.series_index, tooth_location_x + 5, tooth_location_y + 5, 0)
+        regions = [BoxRegion((x0, x1, y0, y1, -np.inf, np.inf)) for tooth_idx in missing_teeth]
+        self.surface_coloring = color_regions(surface, regions)
 
         self.vtk_render_window.Render()
 
@@ -168,42 +164,12 @@ class DicomRenderer(QWidget):
         self.displayDicomSlice()
 
     def displayDicomSlice(self):
-        self.figure.clear()
-        self.ax = self.figure.add_subplot(111)
-
-        filename = self.dicom_files[self.current_slice]
-        dicom_path = os.path.join(self.directory_path, filename)
-        ds = pydicom.read_file(dicom_path)
-        pixel_array = ds.pixel_array
-        self.ax.imshow(pixel_array, cmap='gray', aspect='auto')
-        self.ax.set_title(f'DICOM Slice {self.current_slice + 1}/{len(self.dicom_files)}')
-        self.ax.set_axis_off()
-
-        # Highlight missing teeth in red in 2D view
-        missing_teeth = [1, 3]  # Replace with the actual list of missing teeth indices
-        for tooth_idx in missing_teeth:
-            tooth_location_x = 50  # Replace with the actual X-coordinate
-            tooth_location_y = 50  # Replace with the actual Y-coordinate
-            self.ax.scatter(tooth_location_x, tooth_location_y, s=100, c='red', marker='X', label=f"Missing {tooth_idx}")
-
-        # Marking points on the current slice
-        for point in self.marking_points:
-            self.ax.plot(point[0], point[1], 'ro')  # Assuming marking points are (x, y) coordinates
-
-        # Yellow markers in 3D
-        for marker_position in self.yellow_markers_3d:
-            marker = vtk.vtkSphereSource()
-            marker.SetCenter(marker_position[0], marker_position[1], marker_position[2])
-            marker.SetRadius(5.0)
-            marker_mapper = vtk.vtkPolyDataMapper()
-            marker_mapper.SetInputConnection(marker.GetOutputPort())
-            marker_actor = vtk.vtkActor()
-            marker_actor.SetMapper(marker_mapper)
-            marker_actor.GetProperty().SetColor(1.0, 1.0, 0.0)  # Yellow color
-            self.vtk_renderer.AddActor(marker_actor)
-
-        self.ax.legend()  # Display the legend for the missing teeth markers
-        self.canvas.draw()
+        # Served from the loaded volume or the decoded-slice cache instead of re-reading the file
+        pixel_array = self.slice_cache.get(self.current_slice)
+        # Only the image, title and marks change; they are redrawn over the cached figure and blitted
+        self.slice_view.showSlice(pixel_array, f'DICOM Slice {self.current_slice + 1}/{len(self.dicom_files)}',
+                                  self.annotations.points(self.current_slice))
+        self.ax = self.slice_view.ax
 
     def chooseDirectory(self):
         options = QFileDialog.Options()
@@ -216,10 +182,8 @@ class DicomRenderer(QWidget):
             self.slice_slider.setValue(0)
 
     def toggleCutoutMode(self, state):
-        actor_collection = self.vtk_renderer.GetActors()
-
-        if actor_collection.GetNumberOfItems() > 0:
-            actor = actor_collection.GetItemAsObject(0)
+        if self.surface_actor is not None:
+            actor = self.surface_actor
 
             if state == Qt.Checked:
                 # Enable mesh cut-out mode
@@ -242,15 +206,13 @@ class DicomRenderer(QWidget):
 
         # Update marking points on the current slice
         if self.marking_mode_enabled:
-            self.marking_points = self.getMarkingPointsFromUser()
+            self.getMarkingPointsFromUser()
 
     def getMarkingPointsFromUser(self):
-        self.marking_points = []
-
         def on_click(event):
             if event.inaxes is not None:
                 x, y = event.xdata, event.ydata
-                self.marking_points.append((x, y))
+                self.annotations.add('mark', self.current_slice, x, y)
                 self.displayDicomSlice()  # Update display after each marking
 
         # Connect the on_click function to mouse click events
@@ -265,11 +227,34 @@ class DicomRenderer(QWidget):
         # Disconnect the event handler to prevent further interaction
         self.canvas.mpl_disconnect('button_press_event')
 
-        return self.marking_points
+        return self.annotations.points(self.current_slice)
+
+    def loadAnnotations(self):
+        # Annotations are kept per series and restored when it is opened again
+        file_path = annotation_path(self.series_index.series_instance_uid, self.series_index.file_paths)
+        self.annotations = AnnotationStore.load(file_path)
+        self.marker_layer.clear()
+        self.marker_layer.addMarkers(self.annotations.positions('marker3d'))
+
+    def saveAnnotations(self):
+        if self.series_index is None:
+            return
+        file_path = annotation_path(self.series_index.series_instance_uid, self.series_index.file_paths)
+        if len(self.annotations) or os.path.exists(file_path):
+            self.annotations.save(file_path)
+
+    def closeEvent(self, event):
+        if self.slice_cache is not None:
+            self.slice_cache.close()
+        self.saveAnnotations()
+        super().closeEvent(event)
 
     def addYellowMarker3D(self, x, y, z):
-        self.yellow_markers_3d.append((x, y, z))
-        self.displayDicomSlice()
+        # (x, y) is a pixel on slice z. Only the marker arrays change; the slice view is not redrawn
+        position = voxel_to_world(self.series_index, x, y, z)
+        self.annotations.add('marker3d', int(z), *position)
+        self.marker_layer.addMarker(position)
+        self.vtk_render_window.Render()
 
 if __name__ == '__main__':
     app = QApplication([])
@@ -1,17 +1,26 @@
 import os
-import pydicom
 import vtk
 import numpy as np
-from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QFileDialog, QVBoxLayout, QHBoxLayout, QSlider, QCheckBox
+from progressive_loader import ProgressiveSeriesLoader
+from series_catalog import SeriesCatalog
+from dicom_retrieval import RetrievalThread, client_for, retrieve_directory
+from series_watcher import SeriesWatcher
+from slice_cache import SliceCache
+from surface_cache import SurfaceCache, IsosurfaceWorker
+from mesh_lod import InteractionLod
+from mesh_coloring import BoxRegion, color_regions
+from marker_layer import MarkerLayer
+from annotation_store import AnnotationStore, annotation_path
+from surface_locator import SurfaceLocator, voxel_to_world
+from mesh_export import export_mesh
+from jaw_roi import detect_jaw_roi, full_roi, roi_bounds, roi_from_bounds
+from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QFileDialog, QVBoxLayout, QHBoxLayout, QSlider, QCheckBox, QInputDialog, QLabel
 from PyQt5.QtCore import Qt
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
-from skimage import measure
-from segmentation_models import Unet
-from keras.models import load_model
-import cv2  # Make sure to install OpenCV: pip install opencv-python
+from slice_view import SliceView
 
 class DicomRenderer(QWidget):
     def __init__(self):
@@ -22,6 +31,15 @@ class DicomRenderer(QWidget):
         self.choose_directory_button = QPushButton('Choose DICOM Directory', self)
         self.choose_directory_button.clicked.connect(self.chooseDirectory)
 
+        self.open_catalog_button = QPushButton('Open From Catalog', self)
+        self.open_catalog_button.clicked.connect(self.openFromCatalog)
+
+        self.retrieve_button = QPushButton('Retrieve From PACS', self)
+        self.retrieve_button.clicked.connect(self.retrieveFromPacs)
+
+        self.export_button = QPushButton('Export Mesh', self)
+        self.export_button.clicked.connect(self.exportMesh)
+
         self.vtk_renderer = vtk.vtkRenderer()
         self.vtk_render_window = vtk.vtkRenderWindow()
         self.vtk_render_window.SetWindowName("Dental 3D Rendering")
@@ -30,29 +48,53 @@ class DicomRenderer(QWidget):
 
         self.vtk_render_window_interactor = QVTKRenderWindowInteractor(self)
         self.vtk_render_window_interactor.SetRenderWindow(self.vtk_render_window)
+        self.vtk_render_window_interactor.AddObserver('LeftButtonPressEvent', self.onSurfaceClick, 1.0)
 
         self.figure, self.ax = plt.subplots()
         self.canvas = FigureCanvas(self.figure)
         self.toolbar = NavigationToolbar(self.canvas, self)
+        # Missing teeth highlighted in red in the 2D view (replace with the actual locations)
+        self.slice_view = SliceView(self.figure, self.canvas, [(50, 50, f"Missing {i}") for i in [1, 3]], axis_off=False)
 
         self.slice_slider = QSlider(Qt.Horizontal)
         self.slice_slider.valueChanged.connect(self.updateSlice)
 
+        self.threshold_label = QLabel('Threshold: 1500')
+        self.threshold_slider = QSlider(Qt.Horizontal)
+        self.threshold_slider.setRange(-1000, 4000)
+        self.threshold_slider.setValue(1500)
+        self.threshold_slider.valueChanged.connect(self.onThresholdChanged)
+        self.threshold_slider.sliderReleased.connect(self.onThresholdReleased)
+
         self.cutout_checkbox = QCheckBox("Mesh Cut-Out Mode")
         self.cutout_checkbox.stateChanged.connect(self.toggleCutoutMode)
 
         self.marking_checkbox = QCheckBox("Marking Mode")
         self.marking_checkbox.stateChanged.connect(self.toggleMarkingMode)
 
+        self.watch_checkbox = QCheckBox("Watch Folder For New Slices")
+        self.watch_checkbox.stateChanged.connect(self.toggleWatchMode)
+
+        self.roi_checkbox = QCheckBox("Crop To Jaw")
+        self.roi_checkbox.setChecked(True)
+        self.roi_checkbox.stateChanged.connect(self.toggleJawRoi)
+
         layout = QHBoxLayout(self)
 
         vtk_container = QWidget(self)
         vtk_layout = QVBoxLayout(vtk_container)
         vtk_layout.addWidget(self.choose_directory_button)
+        vtk_layout.addWidget(self.open_catalog_button)
+        vtk_layout.addWidget(self.retrieve_button)
+        vtk_layout.addWidget(self.export_button)
         vtk_layout.addWidget(self.vtk_render_window_interactor)
         vtk_layout.addWidget(self.slice_slider)
+        vtk_layout.addWidget(self.threshold_label)
+        vtk_layout.addWidget(self.threshold_slider)
         vtk_layout.addWidget(self.cutout_checkbox)
         vtk_layout.addWidget(self.marking_checkbox)
+        vtk_layout.addWidget(self.watch_checkbox)
+        vtk_layout.addWidget(self.roi_checkbox)
         layout.addWidget(vtk_container)
 
         matplotlib_container = QWidget(self)
@@ -66,14 +108,32 @@ class DicomRenderer(QWidget):
 
         self.dicom_files = []
         self.current_slice = 0
+        self.slice_cache = None
         self.directory_path = ""
-        self.marking_points = []
+        self.annotations = AnnotationStore()
+        self.series_index = None
         self.marking_mode_enabled = False
-        self.yellow_markers_3d = []
+        self.marker_layer = MarkerLayer(self.vtk_renderer, attached=False)
+        self.surface_locator = None
+        self.loader = None
+        self.surface_actor = None
+        self.series_watcher = None
+        self.watch_reset_camera = False
+        self.retrieval = None
+        self.surface_threshold = 1500
+        self.surface_cache = SurfaceCache()
+        self.isosurface_worker = None
+        self.surface_lod = None
+        self.jaw_roi = None
+        self.roi_box = None
 
         self.tooth_segmentation_model = self.initializeSegmentationModel()
 
     def initializeSegmentationModel(self):
+        # Imported here rather than at the top: worker processes re-import this script, and keras, skimage and
+        # OpenCV would otherwise be loaded into every decode and brick worker
+        from segmentation_models import Unet
+
         model = Unet('resnet34', classes=1, activation='sigmoid')
         weights_path = '/Users/shikarichacha/Downloads/resnet34_imagenet_1000_no_top.h5'
 
@@ -87,103 +147,189 @@ class DicomRenderer(QWidget):
 
         return model
 
-    def loadDicomAndRender(self, directory_path):
-        self.dicom_files = [f for f in os.listdir(directory_path) if f.endswith(".dcm")]
-        self.dicom_files.sort(key=lambda x: int(x.split('Slice')[1].split('.dcm')[0]))
-
-        first_dcm_file = pydicom.read_file(os.path.join(directory_path, self.dicom_files[0]))
-        rows, cols = first_dcm_file.Rows, first_dcm_file.Columns
-
-        volume_data = np.zeros((len(self.dicom_files), rows, cols), dtype=np.uint16)
-
-        for i, filename in enumerate(self.dicom_files):
-            file_path = os.path.join(directory_path, filename)
-            dcm_file = pydicom.read_file(file_path)
-            volume_data[i, :, :] = dcm_file.pixel_array
-
-        vtk_volume = vtk.vtkImageData()
-        vtk_volume.SetDimensions(cols, rows, len(self.dicom_files))
-        vtk_volume.AllocateScalars(vtk.VTK_UNSIGNED_SHORT, 1)
-
-        vtk_np_array_flat = volume_data.ravel()
-        vtk_data_array = vtk.vtkUnsignedShortArray()
-        vtk_data_array.SetArray(vtk_np_array_flat, len(vtk_np_array_flat), 1)
-        vtk_volume.GetPointData().SetScalars(vtk_data_array)
-
-        marching_cubes = vtk.vtkMarchingCubes()
-        marching_cubes.SetInputData(vtk_volume)
-        marching_cubes.SetValue(0, 1500)
-
-        mapper = vtk.vtkPolyDataMapper()
-        mapper.SetInputConnection(marching_cubes.GetOutputPort())
-
-        actor = vtk.vtkActor()
-        actor.SetMapper(mapper)
+    def loadDicomAndRender(self, directory_path, series_index=None):
+        # Load and extract the surface off the GUI thread, showing a coarse preview first
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader.wait()
+
+        self.loader = ProgressiveSeriesLoader(directory_path, surface_value=self.surface_threshold, series_index=series_index,
+                                              auto_roi=self.roi_checkbox.isChecked(), parent=self)
+        self.loader.indexed.connect(self.onSeriesIndexed)
+        self.loader.previewReady.connect(self.onPreviewReady)
+        self.loader.progressChanged.connect(self.onLoadProgress)
+        self.loader.loadFinished.connect(self.onSeriesLoaded)
+        self.loader.loadFailed.connect(print)
+        self.loader.start()
+
+    def onSeriesIndexed(self, volume_data, series_index):
+        self.saveAnnotations()
+        self.series_index = series_index
+        self.loadAnnotations()
+        self.dicom_files = [os.path.basename(p) for p in self.series_index.file_paths]
+        # The previous series' prefetch threads are stopped before its cache is dropped
+        if self.slice_cache is not None:
+            self.slice_cache.close()
+        self.slice_cache = SliceCache(self.series_index.file_paths, volume_data, arrived=self.loader.arrived)
+        self.slice_slider.setRange(0, len(self.dicom_files) - 1)
+        self.slice_slider.setValue(0)
+
+    def onPreviewReady(self, preview, preview_surface):
+        self.showSurface(preview_surface)
+        self.vtk_renderer.ResetCamera()
+        self.vtk_render_window.Render()
 
-        self.vtk_renderer.AddActor(actor)
+    def onLoadProgress(self, done, total):
+        self.setWindowTitle(f'DICOM Renderer - loading {done}/{total} slices')
+
+    def showSurface(self, surface, interactive_surface=None):
+        # interactive_surface is the decimated level shown while the camera moves
+        if self.surface_actor is None:
+            mapper = vtk.vtkPolyDataMapper()
+            self.surface_actor = vtk.vtkActor()
+            self.surface_actor.SetMapper(mapper)
+            self.vtk_renderer.AddActor(self.surface_actor)
+            self.surface_lod = InteractionLod(self.vtk_render_window_interactor, self.surface_actor)
+            # Restored markers are drawn from here on, over the surface
+            self.marker_layer.attach()
+        self.surface_lod.setLevels(surface, interactive_surface)
+
+    def onSeriesLoaded(self, volume_data, series_index, surface):
+        self.setWindowTitle('DICOM Renderer')
+        self.volume_data = volume_data
+        self.volume_pyramid = self.loader.pyramid
+        self.jaw_roi = self.loader.roi
+        self.colorSurface(surface)
+        self.showSurface(surface)
+        self.startIsosurfaceWorker(series_index, surface)
         self.vtk_renderer.ResetCamera()
+        self.vtk_render_window.Render()
+        self.displayDicomSlice()
 
+    def colorSurface(self, surface):
         missing_teeth = [1, 3]  # Replace with the actual list of missing teeth indices
+        tooth_location_x = 50  # Replace with the actual X-coordinate
+        tooth_location_y = 50  # Replace with the actual Y-coordinate
+
+        # A region around each missing tooth, classified for all points at once
+        # The box is placed in slice pixels and converted to the surface's world coordinates
+        corners = [(tooth_location_x - 5, tooth_location_y - 5, 0), (tooth_location_x + 5, tooth_location_y + 5, 0)]
+        if self.series_index is not None:
+            corners = [voxel_to_world(self.series_index, *corner) for corner in corners]
+        (x0, y0, _), (x1, y1, _) = corners
+        regions = [BoxRegion((x0, x1, y0, y1, -np.inf, np.inf)) for tooth_idx in missing_teeth]
+        return color_regions(surface, regions)
+
+    def startIsosurfaceWorker(self, series_index, surface):
+        # Threshold changes re-extract on a worker thread; the loaded surface seeds the cache
+        if self.isosurface_worker is not None:
+            self.isosurface_worker.stop()
+        volume_key = (series_index.series_instance_uid, series_index.shape)
+        self.isosurface_worker = IsosurfaceWorker(self.volume_pyramid, volume_key, self.surface_cache, parent=self)
+        self.isosurface_worker.roi = self.activeRoi()
+        self.surface_cache.put(self.isosurface_worker.cacheKey(self.surface_threshold, 1), surface)
+        self.isosurface_worker.surfaceReady.connect(self.onSurfaceReady)
+        self.isosurface_worker.lodReady.connect(self.onLodReady)
+        self.isosurface_worker.start()
+        # Served from the cache; only builds the interactive level
+        self.isosurface_worker.request(self.surface_threshold)
+        self.placeRoiBox()
+
+    def toggleJawRoi(self, state):
+        if self.isosurface_worker is None:
+            return
+        if state == Qt.Checked and self.jaw_roi is None:
+            self.jaw_roi = detect_jaw_roi(self.volume_data, self.series_index.spacing)
+        self.applyRoi(self.activeRoi())
+        self.placeRoiBox()
+
+    def activeRoi(self):
+        # The ROI extraction, rendering and segmentation use: the detected or edited box while "Crop To Jaw" is on
+        return self.jaw_roi if self.roi_checkbox.isChecked() else None
+
+    def placeRoiBox(self):
+        # A box widget over the ROI; dragging its faces overrides the automatic box
+        if self.roi_box is None:
+            self.roi_box = vtk.vtkBoxWidget2()
+            self.roi_box.SetInteractor(self.vtk_render_window.GetInteractor())
+            self.roi_box.SetRepresentation(vtk.vtkBoxRepresentation())
+            self.roi_box.GetRepresentation().SetPlaceFactor(1.0)
+            self.roi_box.GetRepresentation().HandlesOn()
+            self.roi_box.RotationEnabledOff()
+            self.roi_box.AddObserver('EndInteractionEvent', self.onRoiBoxChanged)
+        if self.activeRoi() is not None:
+            self.roi_box.GetRepresentation().PlaceWidget(
+                roi_bounds(self.jaw_roi, self.series_index.origin, self.series_index.spacing))
+            self.roi_box.On()
+        else:
+            self.roi_box.Off()
+        self.vtk_render_window.Render()
 
-        color_array = vtk.vtkUnsignedCharArray()
-        color_array.SetNumberOfComponents(3)
-        color_array.SetName("Colors")
-
-        for i in range(mapper.GetInput().GetNumberOfPoints()):
-            color = [255, 255, 255]
-
-            for tooth_idx in missing_teeth:
-                tooth_location_x = 50
-                tooth_location_y = 50
-
-                region_x_min, region_x_max = tooth_location_x - 5, tooth_location_x + 5
-                region_y_min, region_y_max = tooth_location_y - 5, tooth_location_y + 5
-
-                point = mapper.GetInput().GetPoint(i)
-                if region_x_min <= point[0] <= region_x_max and region_y_min <= point[1] <= region_y_max:
-                    color = [255, 255, 0]
-                    break
-
-            color_array.InsertNextTuple(color)
-
-        mapper.GetInput().GetPointData().SetScalars(color_array)
-
+    def onRoiBoxChanged(self, caller, event):
+        bounds = self.roi_box.GetRepresentation().GetBounds()
+        self.jaw_roi = roi_from_bounds(bounds, self.series_index.origin, self.series_index.spacing,
+                                       self.volume_data.shape)
+        self.applyRoi(self.jaw_roi)
+
+    def applyRoi(self, roi):
+        self.isosurface_worker.roi = roi
+        cached = self.isosurface_worker.cached(self.surface_threshold)
+        if cached is not None:
+            self.onSurfaceReady(cached, self.surface_threshold, 1)
+        self.isosurface_worker.request(self.surface_threshold)
+
+    def onThresholdChanged(self, value):
+        self.surface_threshold = value
+        self.threshold_label.setText(f'Threshold: {value}')
+        if self.isosurface_worker is None:
+            return
+        cached = self.isosurface_worker.cached(value)
+        if cached is not None:
+            self.onSurfaceReady(cached, value, 1)
+            if self.isosurface_worker.cachedLod(value) is None:
+                self.isosurface_worker.request(value)
+        else:
+            # Coarse pyramid level while dragging, full resolution once the slider is let go
+            self.isosurface_worker.request(value, preview=self.threshold_slider.isSliderDown())
+
+    def onThresholdReleased(self):
+        value = self.threshold_slider.value()
+        if self.isosurface_worker is not None and self.isosurface_worker.cached(value) is None:
+            self.isosurface_worker.request(value)
+
+    def onSurfaceReady(self, surface, value, factor):
+        # Previews are shown as they come; a full-resolution surface only if it is still the current value
+        if factor == 1 and value != self.surface_threshold:
+            return
+        if factor == 1 and surface.GetPointData().GetArray("Colors") is None:
+            self.colorSurface(surface)
+        self.showSurface(surface, self.isosurface_worker.cachedLod(value) if factor == 1 else None)
         self.vtk_render_window.Render()
-        self.displayDicomSlice()
+
+    def onLodReady(self, lod_surface, value):
+        if value != self.surface_threshold or self.surface_lod.full is not self.isosurface_worker.cached(value):
+            return
+        if lod_surface.GetPointData().GetArray("Colors") is None:
+            self.colorSurface(lod_surface)
+        self.surface_lod.setLevels(self.surface_lod.full, lod_surface)
+
+    def closeEvent(self, event):
+        if self.isosurface_worker is not None:
+            self.isosurface_worker.stop()
+        if self.series_watcher is not None:
+            self.series_watcher.stop()
+        if self.slice_cache is not None:
+            self.slice_cache.close()
+        self.saveAnnotations()
+        super().closeEvent(event)
 
     def displayDicomSlice(self):
-        self.figure.clear()
-        self.ax = self.figure.add_subplot(111)
-
-        filename = self.dicom_files[self.current_slice]
-        dicom_path = os.path.join(self.directory_path, filename)
-        ds = pydicom.read_file(dicom_path)
-        pixel_array = ds.pixel_array
-        self.ax.imshow(pixel_array, cmap='gray', aspect='auto')
-        self.ax.set_title(f'DICOM Slice {self.current_slice + 1}/{len(self.dicom_files)}')
-
-        missing_teeth = [1, 3]
-        for tooth_idx in missing_teeth:
-            tooth_location_x = 50
-            tooth_location_y = 50
-            self.ax.scatter(tooth_location_x, tooth_location_y, s=100, c='red', marker='X', label=f"Missing {tooth_idx}")
-
-        for point in self.marking_points:
-            self.ax.plot(point[0], point[1], 'ro')
-
-        for marker_position in self.yellow_markers_3d:
-            marker = vtk.vtkSphereSource()
-            marker.SetCenter(marker_position[0], marker_position[1], marker_position[2])
-            marker.SetRadius(5.0)
-            marker_mapper = vtk.vtkPolyDataMapper()
-            marker_mapper.SetInputConnection(marker.GetOutputPort())
-            marker_actor = vtk.vtkActor()
-            marker_actor.SetMapper(marker_mapper)
-            marker_actor.GetProperty().SetColor(1.0, 1.0, 0.0)
-            self.vtk_renderer.AddActor(marker_actor)
-
-        self.ax.legend()
-        self.canvas.draw()
+        # Served from the loaded volume or the decoded-slice cache instead of re-reading the file
+        pixel_array = self.slice_cache.get(self.current_slice)
+        # Only the image, title and marks change; they are redrawn over the cached figure and blitted
+        self.slice_view.showSlice(pixel_array, f'DICOM Slice {self.current_slice + 1}/{len(self.dicom_files)}',
+                                  self.annotations.points(self.current_slice))
+        self.ax = self.slice_view.ax
 
     def chooseDirectory(self):
         options = QFileDialog.Options()
@@ -191,20 +337,123 @@ class DicomRenderer(QWidget):
         self.directory_path = QFileDialog.getExistingDirectory(self, 'Select DICOM Directory', options=options)
 
         if self.directory_path:
-            self.loadDicomAndRender(self.directory_path)
-            self.slice_slider.setRange(0, len(self.dicom_files) - 1)
-            self.slice_slider.setValue(0)
-
-    def toggleCutoutMode(self, state):
-        actor_collection = self.vtk_renderer.GetActors()
+            if self.watch_checkbox.isChecked():
+                self.startWatching(self.directory_path)
+            else:
+                self.loadDicomAndRender(self.directory_path)
+
+    def openFromCatalog(self):
+        # Search the local catalog by patient name, study date or series description prefix
+        search_text, ok = QInputDialog.getText(self, 'Open From Catalog', 'Patient name, study date or description:')
+        if not ok:
+            return
+
+        catalog = SeriesCatalog()
+        results = catalog.search(patient=search_text) or catalog.search(study_date=search_text) or \
+            catalog.search(description=search_text)
+        if not results:
+            print(f"No catalogued series match '{search_text}'")
+            catalog.close()
+            return
+
+        labels = [f"{r['patient_name']}  {r['study_date']}  {r['modality']}  {r['series_description']}  "
+                  f"({r['instances']} images)" for r in results]
+        label, ok = QInputDialog.getItem(self, 'Open From Catalog', 'Series:', labels, 0, False)
+        if ok:
+            try:
+                series_index = catalog.series_index(results[labels.index(label)]['series_uid'])
+            except (KeyError, ValueError) as e:
+                # KeyError: the series was removed from the catalog after the search ran
+                print(f"Cannot open series: {e}")
+            else:
+                self.directory_path = os.path.dirname(series_index.file_paths[0])
+                self.loadDicomAndRender(self.directory_path, series_index)
+        catalog.close()
+
+    def retrieveFromPacs(self):
+        # Instances land in a local folder that is watched, so slices decode while the rest download
+        source, ok = QInputDialog.getText(self, 'Retrieve From PACS', 'DICOMweb URL or dimse://AETITLE@host:port:',
+                                          text='http://127.0.0.1:8042/dicom-web')
+        if not ok:
+            return
+        study_uid, ok = QInputDialog.getText(self, 'Retrieve From PACS', 'Study Instance UID:')
+        if not ok:
+            return
+        series_uid, ok = QInputDialog.getText(self, 'Retrieve From PACS', 'Series Instance UID:')
+        if not ok:
+            return
+
+        if self.retrieval is not None:
+            self.retrieval.requestInterruption()
+            self.retrieval.wait()
+
+        self.directory_path = retrieve_directory(series_uid.strip())
+        os.makedirs(self.directory_path, exist_ok=True)
+        self.startWatching(self.directory_path)
+        self.retrieval = RetrievalThread(client_for(source.strip()), study_uid.strip(), series_uid.strip(),
+                                         self.directory_path, parent=self)
+        self.retrieval.retrievalFinished.connect(self.onRetrievalFinished)
+        self.retrieval.retrievalFailed.connect(print)
+        self.retrieval.start()
+
+    def onRetrievalFinished(self, count):
+        print(f"Retrieved {count} instances into {self.directory_path}")
+        if self.series_watcher is not None:
+            self.series_watcher.scan()
+
+    def exportMesh(self):
+        # Export the full-resolution surface on screen for surgical guide and implant planning software
+        if self.surface_lod is None or self.surface_lod.full is None:
+            print("No surface to export")
+            return
+        file_path, _ = QFileDialog.getSaveFileName(self, 'Export Mesh', 'surface.stl',
+                                                   'Meshes (*.stl *.ply *.glb *.stl.gz *.ply.gz *.glb.gz)')
+        if not file_path:
+            return
+        try:
+            export_mesh(self.surface_lod.full, file_path)
+        except (ValueError, OSError) as e:
+            print(f"Cannot export mesh: {e}")
+
+    def toggleWatchMode(self, state):
+        if state != Qt.Checked and self.series_watcher is not None:
+            self.series_watcher.stop()
+            self.series_watcher = None
+        elif state == Qt.Checked and self.directory_path:
+            self.startWatching(self.directory_path)
+
+    def startWatching(self, directory_path):
+        # Decode slices as the scanner writes them and re-extract only the slabs they touch, off the GUI thread
+        if self.series_watcher is not None:
+            self.series_watcher.stop()
+        self.series_watcher = SeriesWatcher(directory_path, surface_value=self.surface_threshold, parent=self)
+        self.series_watcher.slicesAdded.connect(self.onSlicesAdded)
+        self.watch_reset_camera = True
+        self.series_watcher.start()
+
+    def onSlicesAdded(self, first_changed, volume_data, file_paths, spacing, origin, surface):
+        self.dicom_files = [os.path.basename(p) for p in file_paths]
+        self.volume_data = volume_data
+        # The cache over the previous snapshot stops its prefetch threads before it is replaced
+        if self.slice_cache is not None:
+            self.slice_cache.close()
+        self.slice_cache = SliceCache(file_paths, volume_data)
+        self.setWindowTitle(f'DICOM Renderer - watching, {len(file_paths)} slices')
+
+        self.showSurface(surface)
+        if self.watch_reset_camera:
+            self.vtk_renderer.ResetCamera()
+            self.watch_reset_camera = False
+        self.vtk_render_window.Render()
 
-        if actor_collection.GetNumberOfItems() > 0:
-            actor = actor_collection.GetItemAsObject(0)
+        self.slice_slider.setRange(0, len(self.dicom_files) - 1)
 
+    def toggleCutoutMode(self, state):
+        if self.surface_actor is not None:
             if state == Qt.Checked:
-                actor.GetProperty().SetOpacity(0.5)
+                self.surface_actor.GetProperty().SetOpacity(0.5)
             else:
-                actor.GetProperty().SetOpacity(1.0)
+                self.surface_actor.GetProperty().SetOpacity(1.0)
 
             self.vtk_render_window.Render()
 
@@ -212,7 +461,9 @@ class DicomRenderer(QWidget):
         self.marking_mode_enabled = state == Qt.Checked
 
         if not self.marking_mode_enabled:
-            self.yellow_markers_3d = []
+            self.annotations.clear('marker3d')
+            self.marker_layer.clear()
+            self.vtk_render_window.Render()
 
         self.displayDicomSlice()
 
@@ -222,15 +473,13 @@ class DicomRenderer(QWidget):
         self.toggleCutoutMode(self.cutout_checkbox.isChecked())
 
         if self.marking_mode_enabled:
-            self.marking_points = self.getMarkingPointsFromUser()
+            self.getMarkingPointsFromUser()
 
     def getMarkingPointsFromUser(self):
-        self.marking_points = []
-
         def on_click(event):
             if event.inaxes is not None:
                 x, y = event.xdata, event.ydata
-                self.marking_points.append((x, y))
+                self.annotations.add('mark', self.current_slice, x, y)
                 self.displayDicomSlice()
 
         self.canvas.mpl_connect('button_press_event', on_click)
@@ -238,19 +487,68 @@ class DicomRenderer(QWidget):
         plt.show(block=True)
         self.canvas.mpl_disconnect('button_press_event')
 
-        return self.marking_points
+        return self.annotations.points(self.current_slice)
+
+    def loadAnnotations(self):
+        # Annotations are kept per series and restored when it is opened again
+        file_path = annotation_path(self.series_index.series_instance_uid, self.series_index.file_paths)
+        self.annotations = AnnotationStore.load(file_path)
+        self.marker_layer.clear()
+        self.marker_layer.addMarkers(self.annotations.positions('marker3d'))
+
+    def saveAnnotations(self):
+        if self.series_index is None:
+            return
+        file_path = annotation_path(self.series_index.series_instance_uid, self.series_index.file_paths)
+        if len(self.annotations) or os.path.exists(file_path):
+            self.annotations.save(file_path)
+
+    def surfaceLocator(self):
+        # Built on first use for the full-resolution surface on screen, rebuilt once it is re-extracted
+        if self.surface_lod is None or self.surface_lod.full is None:
+            return None
+        if self.surface_locator is None:
+            self.surface_locator = SurfaceLocator(self.surface_lod.full)
+        else:
+            self.surface_locator = self.surface_locator.for_surface(self.surface_lod.full)
+        return self.surface_locator
+
+    def onSurfaceClick(self, caller, event):
+        # In marking mode a click in the 3D view drops a marker where the view ray meets the surface
+        if not self.marking_mode_enabled:
+            return
+        locator = self.surfaceLocator()
+        if locator is None:
+            return
+        x, y = caller.GetEventPosition()
+        hit = locator.pick_display(self.vtk_renderer, x, y)
+        if hit is not None:
+            slice_index = int(round((hit[0][2] - self.series_index.origin[2]) / self.series_index.spacing[2])) \
+                if self.series_index is not None else 0
+            self.annotations.add('marker3d', slice_index, *hit[0])
+            self.marker_layer.addMarker(hit[0])
+            self.vtk_render_window.Render()
 
     def addYellowMarker3D(self, x, y, z):
-        self.yellow_markers_3d.append({'x': x, 'y': y, 'z': z, 'slice': self.current_slice})
-        self.displayDicomSlice()
+        # (x, y) is a pixel on slice z; the marker snaps to the closest point on the surface when there is one.
+        # Only the marker arrays change; the slice view is not redrawn
+        position = voxel_to_world(self.series_index, x, y, z) if self.series_index is not None else (x, y, z)
+        locator = self.surfaceLocator()
+        if locator is not None:
+            position = locator.closest_point(position)[0]
+        self.annotations.add('marker3d', int(z), *position)
+        self.marker_layer.addMarker(position)
+        self.vtk_render_window.Render()
 
     def segmentTeeth(self):
+        import cv2  # Make sure to install OpenCV: pip install opencv-python
+
         segmentation_model = self.initializeSegmentationModel()
 
-        for i, filename in enumerate(self.dicom_files):
-            dicom_path = os.path.join(self.directory_path, filename)
-            ds = pydicom.read_file(dicom_path)
-            pixel_array = ds.pixel_array
+        # Only the slices and in-plane box of the jaw ROI are segmented
+        z0, z1, y0, y1, x0, x1 = self.activeRoi() or full_roi((len(self.dicom_files),) + self.series_index.shape[1:])
+        for i in range(z0, z1):
+            pixel_array = self.slice_cache.get(i)[y0:y1, x0:x1]
 
             resized_image = cv2.resize(pixel_array, (256, 256))
             normalized_image = resized_image / 255.0
@@ -265,6 +563,8 @@ class DicomRenderer(QWidget):
             plt.show()
 
     def detectDefectiveTeeth(self, pixel_array, slice_index):
+        from skimage import measure
+
         binary_mask = self.segmentTeethForSlice(pixel_array)
         labeled_regions = measure.label(binary_mask)
 
@@ -1,6 +1,7 @@
 import os
-import pydicom
 import numpy as np
+from volume_store import memory_stage
+from progressive_loader import ProgressiveSeriesLoader
 from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QFileDialog, QVBoxLayout, QHBoxLayout, QSlider, QCheckBox
 from PyQt5.QtCore import Qt
 import matplotlib.pyplot as plt
@@ -72,31 +73,44 @@ class DicomRenderer(QWidget):
         self.marking_points = []
         self.marking_mode_enabled = False
         self.yellow_markers_3d = []
+        self.loader = None
+        self.arrived = None
 
     def loadDicomAndRender(self, directory_path):
-        self.dicom_files = [f for f in os.listdir(directory_path) if f.endswith(".dcm")]
-        self.dicom_files.sort(key=lambda x: int(x.split('Slice')[1].split('.dcm')[0]))
-
-        first_dcm_file = pydicom.read_file(os.path.join(directory_path, self.dicom_files[0]))
-        self.rows, self.cols = first_dcm_file.Rows, first_dcm_file.Columns
-
-        volume_data = np.zeros((len(self.dicom_files), self.rows, self.cols), dtype=np.uint16)
-
-        for i, filename in enumerate(self.dicom_files):
-            file_path = os.path.join(directory_path, filename)
-            dcm_file = pydicom.read_file(file_path)
-            volume_data[i, :, :] = dcm_file.pixel_array
+        # Load off the GUI thread; slices become viewable as they arrive
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader.wait()
+
+        self.loader = ProgressiveSeriesLoader(directory_path, parent=self)
+        self.loader.indexed.connect(self.onSeriesIndexed)
+        self.loader.previewReady.connect(self.onPreviewReady)
+        self.loader.progressChanged.connect(self.onLoadProgress)
+        self.loader.loadFinished.connect(self.onSeriesLoaded)
+        self.loader.loadFailed.connect(print)
+        self.loader.start()
+
+    def onSeriesIndexed(self, volume_data, series_index):
+        self.series_index = series_index
+        self.dicom_files = [os.path.basename(p) for p in self.series_index.file_paths]
+        self.rows, self.cols = volume_data.shape[1:]
+        self.arrived = self.loader.arrived
+        self.current_slice = 0
 
         self.volume_data = volume_data
+        self.ax_axial.clear()
+        self.ax_coronal.clear()
 
-        self.axial_image = self.ax_axial.imshow(self.volume_data[self.current_slice], cmap='gray', aspect='auto')
-        self.ax_axial.set_title(f'DICOM Axial Slice {self.current_slice + 1}/{len(self.dicom_files)}')
-        self.ax_axial.set_axis_off()
+        # Views index the volume directly, so a memory-mapped volume only pages in the slices shown
+        with memory_stage('slice views'):
+            self.axial_image = self.ax_axial.imshow(self.volume_data[self.current_slice], cmap='gray', aspect='auto')
+            self.ax_axial.set_title(f'DICOM Axial Slice {self.current_slice + 1}/{len(self.dicom_files)}')
+            self.ax_axial.set_axis_off()
 
-        self.coronal_slice = np.transpose(self.volume_data[:, self.current_slice, :], (1, 0))
-        self.coronal_image = self.ax_coronal.imshow(self.coronal_slice, cmap='gray', aspect='auto')
-        self.ax_coronal.set_title(f'DICOM Coronal Slice {self.current_slice + 1}/{len(self.dicom_files)}')
-        self.ax_coronal.set_axis_off()
+            self.coronal_slice = np.transpose(self.volume_data[:, self.current_slice, :], (1, 0))
+            self.coronal_image = self.ax_coronal.imshow(self.coronal_slice, cmap='gray', aspect='auto')
+            self.ax_coronal.set_title(f'DICOM Coronal Slice {self.current_slice + 1}/{len(self.dicom_files)}')
+            self.ax_coronal.set_axis_off()
 
         self.canvas_axial.draw_idle()
         self.canvas_coronal.draw_idle()
@@ -104,6 +118,26 @@ class DicomRenderer(QWidget):
         self.slice_slider.setRange(0, len(self.dicom_files) - 1)
         self.slice_slider.setValue(0)
 
+    def onPreviewReady(self, preview, preview_surface):
+        # Fix the display range from the coarse preview so arriving slices are not shown black
+        self.axial_image.set_clim(preview.min(), preview.max())
+        self.coronal_image.set_clim(preview.min(), preview.max())
+        self.updateSlice()
+
+    def onLoadProgress(self, done, total):
+        self.setWindowTitle(f'DICOM Renderer - loading {done}/{total} slices')
+        self.updateSlice()
+
+    def onSeriesLoaded(self, volume_data, series_index, surface):
+        self.setWindowTitle('DICOM Renderer')
+        self.updateSlice()
+
+    def nearestArrivedSlice(self, index):
+        arrived_indices = np.flatnonzero(self.arrived)
+        if arrived_indices.size == 0:
+            return None
+        return int(arrived_indices[np.argmin(np.abs(arrived_indices - index))])
+
     def chooseDirectory(self):
         options = QFileDialog.Options()
         options |= QFileDialog.ShowDirsOnly | QFileDialog.DontUseNativeDialog
@@ -119,8 +153,14 @@ class DicomRenderer(QWidget):
         pass
 
     def updateSlice(self):
+        if self.arrived is None:
+            return
         self.current_slice = self.slice_slider.value()
-        img = self.volume_data[self.current_slice]
+        # Until loading finishes, show the closest slice that has already been decoded
+        shown_slice = self.nearestArrivedSlice(self.current_slice)
+        if shown_slice is None:
+            return
+        img = self.volume_data[shown_slice]
         img = self.clahe_equalization(img)
         img = self.adjustBrightness(img, self.brightness_slider.value())
         self.axial_image.set_array(img)
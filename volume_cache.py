@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import pydicom
+import numpy as np
+from pydicom.errors import InvalidDicomError
+from series_index import SeriesIndex, list_series_files
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "dental3d", "volumes")
+DEFAULT_MAX_BYTES = 8 * 1024 ** 3
+TMP_SUFFIX = '.tmp.npy'
+# Temporary files untouched for this long are left over from a crashed load and are removed on eviction
+STALE_TMP_SECONDS = 24 * 3600
+
+
+def files_key(file_paths, series_instance_uid, dtype):
+    # Content address: SeriesInstanceUID plus the name, size and mtime of every file
+    digest = hashlib.sha1((np.dtype(dtype).name if dtype else 'native').encode())
+    digest.update(str(series_instance_uid).encode())
+    for file_path in sorted(file_paths, key=os.path.basename):
+        stat = os.stat(file_path)
+        digest.update(f"{os.path.basename(file_path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def series_key(directory_path, dtype):
+    file_paths = list_series_files(directory_path)
+
+    series_instance_uid = ''
+    for file_path in file_paths:
+        try:
+            header = pydicom.dcmread(file_path, stop_before_pixels=True, specific_tags=['SeriesInstanceUID'])
+        except (InvalidDicomError, OSError):
+            continue
+        series_instance_uid = header.get('SeriesInstanceUID', '')
+        break
+
+    return files_key(file_paths, series_instance_uid, dtype)
+
+
+class VolumeCache:
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.environ.get('DENTAL_VOLUME_CACHE', DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes or int(os.environ.get('DENTAL_VOLUME_CACHE_BYTES', DEFAULT_MAX_BYTES))
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + '.npy'), os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key):
+        volume_path, metadata_path = self._paths(key)
+        if not (os.path.exists(volume_path) and os.path.exists(metadata_path)):
+            return None
+
+        start_time = time.perf_counter()
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        # Copy-on-write keeps the volume writable without touching the cached file
+        volume_data = np.load(volume_path, mmap_mode='c')
+
+        # Touch the sidecar so eviction sees this entry as recently used
+        os.utime(metadata_path)
+        print(f"Reopened cached volume {volume_data.shape} in {time.perf_counter() - start_time:.3f}s")
+        return volume_data, SeriesIndex.from_metadata(metadata)
+
+    def fits(self, nbytes):
+        return nbytes <= self.max_bytes
+
+    def allocate(self, key, shape, dtype):
+        # Decode straight into the cache file so the volume is never written out twice. Each load gets its
+        # own temporary file, so two loads of the same series never write into the same one.
+        self.evict(self.max_bytes - int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        fd, tmp_path = tempfile.mkstemp(prefix=key + '.', suffix=TMP_SUFFIX, dir=self.cache_dir)
+        os.close(fd)
+        return np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+
+    def commit(self, key, volume_data, series_index):
+        volume_path, metadata_path = self._paths(key)
+
+        # Entries only appear under their final names once complete, so a crash never leaves a half-written one
+        volume_data.flush()
+        os.replace(volume_data.filename, volume_path)
+        with open(metadata_path + '.tmp', 'w') as f:
+            json.dump(series_index.metadata(), f)
+        os.replace(metadata_path + '.tmp', metadata_path)
+        series_index.cache_prefix = self.prefix(key)
+
+    def discard(self, volume_data):
+        # Drops the temporary file of a load that failed or was cancelled before commit()
+        try:
+            os.remove(volume_data.filename)
+        except OSError:
+            pass
+
+    def prefix(self, key):
+        # Derived data such as pyramid levels is stored as <prefix>.*.npy and evicted with the entry
+        return os.path.join(self.cache_dir, key)
+
+    def _entry_files(self, key):
+        # Temporary files of loads still in progress are not part of the entry
+        return [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir)
+                if f.startswith(key + '.') and not f.endswith(TMP_SUFFIX)]
+
+    def _tmp_bytes(self):
+        # Bytes held by loads in progress; files not written to for STALE_TMP_SECONDS are removed instead
+        total_bytes = 0
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(TMP_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                if time.time() - os.path.getmtime(path) > STALE_TMP_SECONDS:
+                    os.remove(path)
+                else:
+                    total_bytes += os.path.getsize(path)
+            except OSError:
+                continue
+        return total_bytes
+
+    def entries(self):
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.json'):
+                continue
+            key = filename[:-len('.json')]
+            _, metadata_path = self._paths(key)
+            size = sum(os.path.getsize(path) for path in self._entry_files(key))
+            entries.append((os.path.getmtime(metadata_path), size, key))
+        return sorted(entries)
+
+    def evict(self, budget_bytes):
+        # Drop least recently used entries until the cache fits in the given budget
+        entries = self.entries()
+        total_bytes = sum(size for _, size, _ in entries) + self._tmp_bytes()
+        for _, size, key in entries:
+            if total_bytes <= budget_bytes:
+                break
+            for path in self._entry_files(key):
+                os.remove(path)
+            total_bytes -= size
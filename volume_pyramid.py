@@ -0,0 +1,91 @@
+import os
+import threading
+import numpy as np
+from vtk_bridge import volume_to_vtk_image
+from jaw_roi import crop_volume, roi_origin
+
+PYRAMID_FACTORS = (2, 4, 8)
+# Voxel budget for anything that has to respond while the user is interacting
+INTERACTIVE_VOXELS = 4 * 1024 ** 2
+
+
+def downsample_2x(volume_data, slab_slices=64):
+    # 2x2x2 block average, built slab by slab so a memory-mapped volume is streamed rather than loaded.
+    # Trailing voxels that do not fill a whole block are dropped.
+    slices, rows, cols = (d // 2 for d in volume_data.shape)
+    downsampled = np.empty((slices, rows, cols), dtype=volume_data.dtype)
+    for start in range(0, slices, slab_slices):
+        stop = min(start + slab_slices, slices)
+        slab = volume_data[2 * start:2 * stop, :2 * rows, :2 * cols]
+        blocks = slab.reshape(stop - start, 2, rows, 2, cols, 2)
+        downsampled[start:stop] = blocks.mean(axis=(1, 3, 5), dtype=np.float32)
+    return downsampled
+
+
+class VolumePyramid:
+    # Lazily built 2x/4x/8x block-averaged levels of a loaded volume, for previews and interaction.
+    # Level 1 is the volume itself. With a cache prefix, levels are kept on disk next to the cached volume.
+    def __init__(self, volume_data, series_index=None, cache_prefix=None):
+        self.volume_data = volume_data
+        self.series_index = series_index
+        self.cache_prefix = cache_prefix or getattr(series_index, 'cache_prefix', None)
+        self.levels = {1: volume_data}
+        self._lock = threading.Lock()
+
+    def _level_path(self, factor):
+        return f"{self.cache_prefix}.level{factor}.npy"
+
+    def level(self, factor):
+        with self._lock:
+            if factor not in self.levels:
+                if factor not in PYRAMID_FACTORS:
+                    raise ValueError(f"Unsupported pyramid factor {factor}, expected one of {PYRAMID_FACTORS}")
+                self.levels[factor] = self._loadOrBuild(factor)
+            return self.levels[factor]
+
+    def _loadOrBuild(self, factor):
+        if self.cache_prefix and os.path.exists(self._level_path(factor)):
+            return np.load(self._level_path(factor), mmap_mode='c')
+
+        # Each level is built from the one above it, so only the first pass touches full resolution
+        previous = self.levels.get(factor // 2)
+        if previous is None:
+            previous = self._loadOrBuild(factor // 2) if factor // 2 > 1 else self.volume_data
+            self.levels[factor // 2] = previous
+        level_data = downsample_2x(previous)
+
+        if self.cache_prefix:
+            path = self._level_path(factor)
+            np.save(path + '.tmp.npy', level_data)
+            os.replace(path + '.tmp.npy', path)
+        return level_data
+
+    def spacing(self, factor):
+        spacing = self.series_index.spacing if self.series_index is not None else (1.0, 1.0, 1.0)
+        return tuple(s * factor for s in spacing)
+
+    def origin(self, factor):
+        # Block centres sit half a block in from the first voxel
+        origin = self.series_index.origin if self.series_index is not None else (0.0, 0.0, 0.0)
+        spacing = self.series_index.spacing if self.series_index is not None else (1.0, 1.0, 1.0)
+        return tuple(o + s * (factor - 1) / 2 for o, s in zip(origin, spacing))
+
+    def factor_for_voxels(self, max_voxels):
+        # Finest level that stays under the voxel budget, falling back to the coarsest
+        for factor in (1,) + PYRAMID_FACTORS:
+            if self.volume_data.size / factor ** 3 <= max_voxels:
+                return factor
+        return PYRAMID_FACTORS[-1]
+
+    def vtk_image(self, factor, roi=None):
+        # roi (z0, z1, y0, y1, x0, x1) in full-resolution voxels restricts the image to that box
+        if roi is None:
+            if factor == 1:
+                return volume_to_vtk_image(self.volume_data, self.series_index)
+            return volume_to_vtk_image(self.level(factor), spacing=self.spacing(factor), origin=self.origin(factor))
+
+        z0, z1, y0, y1, x0, x1 = roi
+        level_roi = (z0 // factor, -(-z1 // factor), y0 // factor, -(-y1 // factor), x0 // factor, -(-x1 // factor))
+        level_data = self.level(factor) if factor > 1 else self.volume_data
+        return volume_to_vtk_image(crop_volume(level_data, level_roi), spacing=self.spacing(factor),
+                                   origin=roi_origin(self.origin(factor), self.spacing(factor), level_roi))
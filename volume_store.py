@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCRATCH_DIR = os.environ.get('DENTAL_SCRATCH_DIR', tempfile.gettempdir())
+OUT_OF_CORE_BYTES = int(os.environ.get('DENTAL_OUT_OF_CORE_BYTES', 1024 ** 3))
+
+
+def allocate_volume(shape, dtype, out_of_core=None, path=None):
+    # Large volumes get a file-backed memmap so only the pages a view touches stay resident
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if out_of_core is None:
+        out_of_core = nbytes > OUT_OF_CORE_BYTES
+    if not out_of_core:
+        return np.zeros(shape, dtype=dtype)
+
+    if path is not None:
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    fd, path = tempfile.mkstemp(suffix='.npy', prefix='volume_', dir=SCRATCH_DIR)
+    os.close(fd)
+    volume_data = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    try:
+        # The mapping keeps the scratch file alive; unlinking it now means nothing is left behind
+        os.unlink(path)
+    except OSError:
+        pass
+    return volume_data
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+@contextmanager
+def memory_stage(name):
+    start_time = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start_time
+    rss, peak = current_rss_mb(), peak_rss_mb()
+    rss_text = f"{rss:.0f} MB" if rss is not None else "n/a"
+    peak_text = f"{peak:.0f} MB" if peak is not None else "n/a"
+    print(f"[{name}] {elapsed:.2f}s, RSS {rss_text}, peak RSS {peak_text}")
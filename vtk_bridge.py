@@ -0,0 +1,67 @@
+import vtk
+import numpy as np
+from vtk.util import numpy_support
+
+SUPPORTED_DTYPES = (np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32, np.float32)
+
+
+def rescale_volume(volume_data, slope, intercept):
+    # Apply RescaleSlope/Intercept into the narrowest type that holds the result: int16 or float32
+    if slope == 1.0 and intercept == 0.0:
+        return volume_data
+
+    integer = np.issubdtype(volume_data.dtype, np.integer) and volume_data.size > 0
+    if integer and float(slope).is_integer() and float(intercept).is_integer():
+        # Bounded by the values actually stored, not the dtype: 12-bit CT in uint16 with intercept -1024 fits int16
+        data_min, data_max = int(volume_data.min()), int(volume_data.max())
+        low, high = sorted((data_min * slope + intercept, data_max * slope + intercept))
+        int16 = np.iinfo(np.int16)
+        if low >= int16.min and high <= int16.max and all(int16.min <= v <= int16.max for v in (slope, intercept)):
+            rescaled = volume_data.astype(np.int16)
+            rescaled *= np.int16(slope)
+            rescaled += np.int16(intercept)
+            return rescaled
+
+    rescaled = volume_data.astype(np.float32)
+    rescaled *= np.float32(slope)
+    rescaled += np.float32(intercept)
+    return rescaled
+
+
+def volume_to_vtk_image(volume_data, series_index=None, rescale=False, spacing=None, origin=None):
+    # Wrap a (slices, rows, cols) volume as vtkImageData scalars without copying it
+    if rescale and series_index is not None:
+        volume_data = rescale_volume(volume_data, series_index.rescale_slope, series_index.rescale_intercept)
+    if volume_data.dtype.type not in SUPPORTED_DTYPES:
+        raise TypeError(f"Unsupported volume dtype {volume_data.dtype}, expected one of "
+                        f"{', '.join(np.dtype(t).name for t in SUPPORTED_DTYPES)}")
+
+    volume_data = np.ascontiguousarray(volume_data)
+    slices, rows, cols = volume_data.shape
+
+    vtk_volume = vtk.vtkImageData()
+    vtk_volume.SetDimensions(cols, rows, slices)
+    if series_index is not None:
+        vtk_volume.SetSpacing(*series_index.spacing)
+        vtk_volume.SetOrigin(*series_index.origin)
+    if spacing is not None:
+        vtk_volume.SetSpacing(*spacing)
+    if origin is not None:
+        vtk_volume.SetOrigin(*origin)
+
+    # reshape(-1) is a view of a contiguous array, so VTK points straight at the NumPy buffer
+    vtk_data_array = numpy_support.numpy_to_vtk(volume_data.reshape(-1), deep=False)
+    vtk_data_array.SetName("ImageScalars")
+    vtk_volume.GetPointData().SetScalars(vtk_data_array)
+
+    # VTK does not own the buffer; keep the array alive for as long as the image is.
+    # Attributes on VTK objects survive while the C++ object is referenced by a pipeline.
+    vtk_volume._volume_data = volume_data
+    return vtk_volume
+
+
+def vtk_image_to_volume(vtk_volume):
+    # The reverse view: a (slices, rows, cols) array sharing memory with the image scalars
+    cols, rows, slices = vtk_volume.GetDimensions()
+    scalars = numpy_support.vtk_to_numpy(vtk_volume.GetPointData().GetScalars())
+    return scalars.reshape(slices, rows, cols)